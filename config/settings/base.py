@@ -14,6 +14,7 @@ import donkeycar
 import os
 import environ
 import logging
+import tempfile
 
 from packaging import version
 from pathlib import Path
@@ -204,12 +205,68 @@ DONKEYCAR_DIR = env.str("DONKEYCAR_DIR")
 DATA_DIR = Path(CARAPP_PATH) / "data"
 MOVIE_DIR = CARAPP_PATH + "/movies"
 MODEL_DIR = CARAPP_PATH + "/models"
+IMAGE_CACHE_DIR = CARAPP_PATH + "/image_cache"
+UPLOAD_DIR = CARAPP_PATH + "/uploads"
+IMAGE_CACHE_MAX_SIZE = env.int("IMAGE_CACHE_MAX_SIZE", default=200 * 1024 * 1024)
 CONSOLE_DIR = env.str("CONSOLE_DIR")
 
 VENV_PATH = env.str("VENV_PATH")
 WLAN = env.str("WLAN")
 HOTSPOT_IF_NAME = env.str("HOTSPOT_IF_NAME")
 HQ_BASE_URL = env.str("HQ_BASE_URL")
+# Every call to HQ goes through dkconsole.hq_client with these timeouts (seconds) and retry policy
+HQ_CONNECT_TIMEOUT = env.float("HQ_CONNECT_TIMEOUT", default=5)
+HQ_READ_TIMEOUT = env.float("HQ_READ_TIMEOUT", default=30)
+HQ_RETRIES = env.int("HQ_RETRIES", default=3)
+HQ_BACKOFF = 0.5
+HQ_BACKOFF_MAX = 8
+HQ_POOL_SIZE = 8
+
+# Training job status is refreshed from HQ by a background poller, every TRAIN_POLL_MIN_INTERVAL seconds while jobs
+# change, backing off to TRAIN_POLL_MAX_INTERVAL. Turn it off when running manage.py poll_job_status instead.
+TRAIN_POLLER_ENABLED = env.bool("TRAIN_POLLER_ENABLED", default=True)
+TRAIN_POLL_MIN_INTERVAL = env.int("TRAIN_POLL_MIN_INTERVAL", default=30)
+TRAIN_POLL_MAX_INTERVAL = env.int("TRAIN_POLL_MAX_INTERVAL", default=600)
+TRAIN_POLL_LOCK_FILE = os.path.join(tempfile.gettempdir(), "dkconsole_job_poll.lock")
+# Number of jobs whose model, accuracy plot and movie are downloaded at the same time
+TRAIN_DOWNLOAD_WORKERS = env.int("TRAIN_DOWNLOAD_WORKERS", default=2)
+# Tubs are uploaded to HQ in parts of this size, an interrupted upload resumes at the first missing part
+HQ_UPLOAD_PART_SIZE = env.int("HQ_UPLOAD_PART_SIZE", default=4 * 1024 * 1024)
+# Number of tubs archived / uploaded at the same time
+HQ_UPLOAD_WORKERS = env.int("HQ_UPLOAD_WORKERS", default=2)
+# Only send the tub files HQ does not have yet. The whole archive is sent when off or when HQ does not support it
+HQ_UPLOAD_DEDUP = env.bool("HQ_UPLOAD_DEDUP", default=True)
+
+# Number of threads used to scan tub folders when listing tubs. 1 scans serially.
+TUB_SCAN_WORKERS = env.int("TUB_SCAN_WORKERS", default=4)
+
+# Tub archives are mostly jpgs, which barely compress, so a low level is usually the best trade-off
+TUB_ARCHIVE_COMPRESSLEVEL = env.int("TUB_ARCHIVE_COMPRESSLEVEL", default=1)
+TUB_ARCHIVE_CHUNK_SIZE = 64 * 1024
+# Number of threads used by the pgz and zst archive compressions
+TUB_ARCHIVE_WORKERS = env.int("TUB_ARCHIVE_WORKERS", default=4)
+# Number of tub histograms generated at the same time, in the background
+HISTOGRAM_WORKERS = env.int("HISTOGRAM_WORKERS", default=1)
+# Seconds a v1 tub histogram (donkey tubhist) may take to generate before it is given up
+HISTOGRAM_TIMEOUT = env.int("HISTOGRAM_TIMEOUT", default=120)
+# Number of bins of the tub histograms
+HISTOGRAM_BINS = env.int("HISTOGRAM_BINS", default=50)
+# Number of tub movies rendered at the same time, in the background
+MOVIE_WORKERS = env.int("MOVIE_WORKERS", default=1)
+# The least recently watched tub movies are deleted when they grow over this size. Training job movies are kept.
+MOVIE_DIR_QUOTA_MB = env.int("MOVIE_DIR_QUOTA_MB", default=2048)
+# Seconds clients are told to wait before asking again for a movie being rendered
+MOVIE_RETRY_AFTER = env.int("MOVIE_RETRY_AFTER", default=5)
+# Seconds clients are told to wait before asking again for a histogram being generated
+HISTOGRAM_RETRY_AFTER = env.int("HISTOGRAM_RETRY_AFTER", default=2)
+# Number of tub playbacks streamed at the same time. Each holds a server thread while it plays, gunicorn runs 4
+PLAYBACK_MAX_STREAMS = env.int("PLAYBACK_MAX_STREAMS", default=2)
+# Movies and videos are sent by the front proxy when set: "x-accel-redirect" (nginx) or "x-sendfile" (Apache, lighttpd)
+SENDFILE_BACKEND = env.str("SENDFILE_BACKEND", default="")
+# Only the files under this folder are offloaded to the proxy
+SENDFILE_ROOT = env.str("SENDFILE_ROOT", default=CARAPP_PATH)
+# Internal nginx location aliased to SENDFILE_ROOT, for x-accel-redirect
+SENDFILE_URL = env.str("SENDFILE_URL", default="/protected/")
 logger = logging.getLogger(__name__)
 
 logger.debug(f"DONKEYCAR_DIR = {DONKEYCAR_DIR}")
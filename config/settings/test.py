@@ -16,4 +16,7 @@ elif (donkeycar_version.major == 4):
 MOVIE_DIR = ROOT_DIR / "dkconsole/mycar_test/movies"
 
 MODEL_DIR = ROOT_DIR / "dkconsole/mycar_test/models"
+IMAGE_CACHE_DIR = ROOT_DIR / "dkconsole/mycar_test/image_cache"
+UPLOAD_DIR = ROOT_DIR / "dkconsole/mycar_test/uploads"
+TRAIN_POLLER_ENABLED = False
 # CARAPP_PATH = str(ROOT_DIR / "dkconsole/mycar_test")
@@ -0,0 +1,299 @@
+import abc
+import collections
+import gzip
+import logging
+import os
+import struct
+import tarfile
+import tempfile
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from django.conf import settings
+
+from dkconsole.data.dedup_upload import IMAGE_HASHES_FILE
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+
+class ChunkBuffer():
+    """
+    Write-only file object which keeps what was written until it is popped, used to turn tarfile output into a
+    stream of chunks
+    """
+
+    def __init__(self):
+        self.chunks = []
+        self.size = 0
+        self.position = 0
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.size += len(data)
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+    def pop(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        self.size = 0
+        return data
+
+
+class StoreWriter():
+    """
+    Passes the tar stream through uncompressed
+    """
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+
+    def write(self, data):
+        return self.fileobj.write(data)
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def compress_block(block, dictionary, compresslevel, last):
+    """
+    Raw deflate of one block, primed with the end of the previous block so matches can reach across blocks
+    """
+    if dictionary:
+        compressor = zlib.compressobj(compresslevel, zlib.DEFLATED, -zlib.MAX_WBITS, zdict=dictionary)
+    else:
+        compressor = zlib.compressobj(compresslevel, zlib.DEFLATED, -zlib.MAX_WBITS)
+    return compressor.compress(block) + compressor.flush(zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH)
+
+
+class ParallelGzipWriter():
+    """
+    gzip writer which deflates fixed size blocks on a thread pool, the same way pigz does.
+
+    Every block but the last one ends with a sync flush, so the compressed blocks simply concatenate into a single
+    deflate stream. The output is a regular single member gzip file. zlib releases the GIL while compressing, so
+    the blocks really are compressed on several cores.
+    """
+    BLOCK_SIZE = 128 * 1024
+    DICTIONARY_SIZE = 32 * 1024
+    # magic, deflate, no flags, mtime 0, no extra flags, unknown OS
+    HEADER = b'\x1f\x8b\x08\x00\x00\x00\x00\x00\x00\xff'
+
+    def __init__(self, fileobj, compresslevel, workers, block_size=BLOCK_SIZE):
+        self.fileobj = fileobj
+        self.compresslevel = compresslevel
+        self.block_size = block_size
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='archive_gzip')
+        self.max_pending = workers * 2
+        self.pending = collections.deque()
+        self.buffer = bytearray()
+        self.dictionary = b''
+        self.crc = 0
+        self.length = 0
+        self.closed = False
+
+        self.fileobj.write(self.HEADER)
+
+    def write(self, data):
+        self.crc = zlib.crc32(data, self.crc)
+        self.length += len(data)
+        self.buffer += data
+
+        while len(self.buffer) >= self.block_size:
+            block = bytes(self.buffer[:self.block_size])
+            del self.buffer[:self.block_size]
+            self._submit(block, last=False)
+        return len(data)
+
+    def _submit(self, block, last):
+        self.pending.append(self.executor.submit(compress_block, block, self.dictionary, self.compresslevel, last))
+        self.dictionary = block[-self.DICTIONARY_SIZE:]
+
+        # blocks are written in order, waiting for the oldest one keeps the memory bounded
+        while self.pending and (last or len(self.pending) > self.max_pending):
+            self.fileobj.write(self.pending.popleft().result())
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            self._submit(bytes(self.buffer), last=True)
+            self.fileobj.write(struct.pack('<II', self.crc, self.length & 0xffffffff))
+        finally:
+            self.executor.shutdown()
+
+    def abort(self):
+        self.closed = True
+        for future in self.pending:
+            future.cancel()
+        self.executor.shutdown(wait=False)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+class Codec(abc.ABC):
+    """
+    Compression applied on top of the tar stream of an archive
+    """
+
+    def __init__(self, name, extension, content_type):
+        self.name = name
+        self.extension = extension
+        self.content_type = content_type
+
+    @abc.abstractmethod
+    def open(self, fileobj, compresslevel, workers):
+        """
+        Return a writer compressing into fileobj. Closing the writer must not close fileobj.
+        """
+
+
+class StoreCodec(Codec):
+    def open(self, fileobj, compresslevel, workers):
+        return StoreWriter(fileobj)
+
+
+class GzipCodec(Codec):
+    def open(self, fileobj, compresslevel, workers):
+        return gzip.GzipFile(fileobj=fileobj, mode='wb', compresslevel=compresslevel, mtime=0)
+
+
+class ParallelGzipCodec(Codec):
+    def open(self, fileobj, compresslevel, workers):
+        return ParallelGzipWriter(fileobj, compresslevel, workers)
+
+
+class ZstdCodec(Codec):
+    def open(self, fileobj, compresslevel, workers):
+        compressor = zstandard.ZstdCompressor(level=compresslevel, threads=workers)
+        return compressor.stream_writer(fileobj, closefd=False)
+
+
+CODECS = {codec.name: codec for codec in [
+    StoreCodec('none', '.tar', 'application/x-tar'),
+    GzipCodec('gz', '.tar.gz', 'application/gzip'),
+    ParallelGzipCodec('pgz', '.tar.gz', 'application/gzip'),
+]}
+if zstandard is not None:
+    CODECS['zst'] = ZstdCodec('zst', '.tar.zst', 'application/zstd')
+
+COMPRESSIONS = {name: codec.extension for name, codec in CODECS.items()}
+
+
+def iter_archive_members(tub_paths, extra_files=()):
+    """
+    (path, arcname) for every file and folder of the tubs, tub folders are stored under their own name
+    """
+    for tub_path in tub_paths:
+        tub_path = Path(tub_path)
+        yield tub_path, tub_path.name
+        for dirpath, dirnames, filenames in os.walk(tub_path):
+            dirnames.sort()
+            relative_dir = Path(dirpath).relative_to(tub_path.parent)
+            for name in dirnames + sorted(filenames):
+                if dirpath == str(tub_path) and name == IMAGE_HASHES_FILE:
+                    # local cache, HQ and the copies of the tub compute their own
+                    continue
+                yield Path(dirpath) / name, str(relative_dir / name)
+
+    for path, arcname in extra_files:
+        yield Path(path), arcname
+
+
+def iter_tub_archive(tub_paths, extra_files=(), compression='gz', compresslevel=None):
+    """
+    Generate a tar archive of tub_paths as a stream of bytes chunks, without temp file.
+
+    Members are added one at a time and the output is handed out after each of them, so memory stays bounded by
+    the largest file in the tubs. extra_files is a list of (path, arcname). compression is one of CODECS, pgz and
+    zst compress on TUB_ARCHIVE_WORKERS threads.
+    """
+    if compression not in CODECS:
+        raise ValueError(f"Unsupported compression {compression}")
+    if compresslevel is None:
+        compresslevel = settings.TUB_ARCHIVE_COMPRESSLEVEL
+
+    buffer = ChunkBuffer()
+    with CODECS[compression].open(buffer, compresslevel, max(1, settings.TUB_ARCHIVE_WORKERS)) as out:
+        with tarfile.open(fileobj=out, mode='w|') as tar:
+            for path, arcname in iter_archive_members(tub_paths, extra_files):
+                tar.add(path, arcname=arcname, recursive=False)
+                if buffer.size >= settings.TUB_ARCHIVE_CHUNK_SIZE:
+                    yield buffer.pop()
+
+    yield buffer.pop()
+
+
+def write_tub_archive(tub_paths, extra_files=(), compression='gz', compresslevel=None, dir=None):
+    """
+    Write the archive to a temp file in dir and return its path. The caller has to delete the file.
+    """
+    f = tempfile.NamedTemporaryFile(mode='w+b', suffix=COMPRESSIONS[compression], dir=dir, delete=False)
+    try:
+        with f:
+            for chunk in iter_tub_archive(tub_paths, extra_files, compression, compresslevel):
+                f.write(chunk)
+    except Exception:
+        os.remove(f.name)
+        raise
+    return f.name
+
+
+def benchmark_codecs(tub_paths, compressions=None, compresslevel=None):
+    """
+    Build the archive of tub_paths with each codec and measure how long it takes and how big it gets.
+
+    The archive is discarded as it is generated, so this measures reading the tubs plus compressing them. Returns a
+    list of dicts with compression, seconds, size, ratio (to the plain tar) and throughput (tar MB/s).
+    """
+    compressions = compressions or list(CODECS)
+    results = []
+    tar_size = None
+    for compression in ['none'] + [c for c in compressions if c != 'none']:
+        start = time.perf_counter()
+        size = sum(len(chunk) for chunk in iter_tub_archive(tub_paths, compression=compression,
+                                                            compresslevel=compresslevel))
+        seconds = time.perf_counter() - start
+
+        if compression == 'none':
+            tar_size = size
+            if 'none' not in compressions:
+                continue
+        results.append({
+            'compression': compression,
+            'seconds': seconds,
+            'size': size,
+            'ratio': size / tar_size if tar_size else 1,
+            'throughput': tar_size / seconds / 1024 / 1024 if seconds else 0,
+        })
+    return results
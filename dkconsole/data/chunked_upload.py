@@ -0,0 +1,254 @@
+import hashlib
+import json
+import logging
+import os
+import tempfile
+from pathlib import Path
+
+from django.conf import settings
+from requests_toolbelt.multipart.encoder import MultipartEncoder
+from rest_framework import status
+
+from dkconsole.hq_client import hq_client
+
+logger = logging.getLogger(__name__)
+
+
+class UploadError(Exception):
+    pass
+
+
+class ChunkedUploadNotSupported(UploadError):
+    pass
+
+
+def get_part_checksums(archive_path, part_size):
+    """
+    sha256 of the whole archive and of each part_size part of it, in a single read
+    """
+    total = hashlib.sha256()
+    checksums = []
+    with open(archive_path, 'rb') as f:
+        while True:
+            part = f.read(part_size)
+            if not part:
+                break
+            total.update(part)
+            checksums.append(hashlib.sha256(part).hexdigest())
+    return total.hexdigest(), checksums
+
+
+def remove_file(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def post_archive(url, tub_name, archive_path, fields):
+    """
+    Send the whole archive in one multipart POST, to the upload_tub endpoint of HQs without upload sessions.
+    Returns the response, which carries the tub uuid.
+    """
+    with open(archive_path, 'rb') as f:
+        mp_encoder = MultipartEncoder(
+            fields={
+                **fields,
+                'tub_name': tub_name,
+                'tub_archive_file': ('file.tar.gz', f, 'application/gzip'),
+            }
+        )
+        r = hq_client.post(url, endpoint='data/upload_tub', data=mp_encoder,
+                           headers={'Content-Type': mp_encoder.content_type})
+
+    if r.status_code != status.HTTP_200_OK:
+        raise UploadError(f"POST {url} failed with {r.status_code}")
+    return r.json()
+
+
+def read_part(archive_path, part_size, part_no):
+    with open(archive_path, 'rb') as f:
+        f.seek(part_no * part_size)
+        return f.read(part_size)
+
+
+class UploadJournal():
+    """
+    Local record of an upload in progress, kept in UPLOAD_DIR next to the archive being uploaded.
+
+    It holds the HQ upload id, the archive path, the tub signature the archive was built from, the part checksums
+    and the parts HQ acknowledged, so an interrupted upload can carry on from the last acknowledged part.
+    """
+
+    def __init__(self, tub_name):
+        self.path = Path(settings.UPLOAD_DIR) / f"{tub_name}.json"
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except ValueError:
+            logger.warning(f"Discarding unreadable upload journal {self.path}")
+            return None
+
+    def save(self, entry):
+        fd, tmp_path = tempfile.mkstemp(dir=self.path.parent, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(entry, f)
+            os.replace(tmp_path, self.path)
+        except Exception:
+            os.remove(tmp_path)
+            raise
+
+    def discard(self, entry=None):
+        """
+        Delete the journal and the archive it refers to
+        """
+        entry = entry or self.load()
+        if entry is not None:
+            remove_file(entry['archive_path'])
+        remove_file(self.path)
+
+
+class ChunkedUploader():
+    """
+    Upload tub archives to HQ in fixed size parts.
+
+    The protocol is:
+        POST {sessions_url}                          create an upload, returns upload_id
+        GET  {sessions_url}/{upload_id}              parts HQ received so far, with their sha256
+        PUT  {sessions_url}/{upload_id}/parts/{no}   one part, with its sha256 in X-Checksum-Sha256
+        POST {sessions_url}/{upload_id}/complete     assemble the parts, returns the tub uuid
+
+    A part only counts as uploaded once HQ acknowledged it with the same checksum. HQ answering 404 to the creation
+    of the upload means it does not support upload sessions, ChunkedUploadNotSupported is raised so the caller can
+    fall back to posting the archive in one request.
+    """
+    CHECKSUM_HEADER = 'X-Checksum-Sha256'
+
+    def __init__(self, sessions_url, part_size=None):
+        self.sessions_url = sessions_url
+        self.part_size = part_size or settings.HQ_UPLOAD_PART_SIZE
+
+    def upload(self, tub_name, signature, build_archive, fields, progress=None):
+        """
+        Upload the archive of tub_name and return the response of the complete call.
+
+        build_archive(dir) writes the archive into dir and returns its path. It is only called when there is no
+        upload of the same tub (same signature) to resume. fields are sent along when the upload is created.
+        progress, when given, is told about the stage and bytes sent as the upload goes.
+        """
+        Path(settings.UPLOAD_DIR).mkdir(parents=True, exist_ok=True)
+        journal = UploadJournal(tub_name)
+        entry = self.resume(journal, signature)
+
+        if entry is None:
+            if progress:
+                progress.update(stage='archiving')
+            archive_path = build_archive(settings.UPLOAD_DIR)
+            try:
+                entry = self.create(tub_name, signature, archive_path, fields)
+            except Exception:
+                remove_file(archive_path)
+                raise
+            journal.save(entry)
+
+        acked = set(entry['acked_parts'])
+        if progress:
+            progress.update(stage='uploading', bytes_sent=self.get_bytes_sent(entry), total_bytes=entry['size'])
+        for part_no, checksum in enumerate(entry['part_checksums']):
+            if part_no in acked:
+                continue
+            self.put_part(entry, part_no, checksum)
+            entry['acked_parts'].append(part_no)
+            journal.save(entry)
+            if progress:
+                progress.update(bytes_sent=self.get_bytes_sent(entry))
+
+        if progress:
+            progress.update(stage='completing')
+        result = self.complete(entry, fields)
+        journal.discard(entry)
+        return result
+
+    def get_bytes_sent(self, entry):
+        part_size = entry['part_size']
+        return sum(min(part_size, entry['size'] - part_no * part_size) for part_no in entry['acked_parts'])
+
+    def resume(self, journal, signature):
+        """
+        The journal entry of an upload that can be resumed, with acked_parts as HQ knows them, or None
+        """
+        entry = journal.load()
+        if entry is None:
+            return None
+
+        if entry['signature'] != signature or not Path(entry['archive_path']).exists():
+            logger.info(f"Tub changed since the upload started, restarting {journal.path}")
+            journal.discard(entry)
+            return None
+
+        r = hq_client.get(f"{self.sessions_url}/{entry['upload_id']}", endpoint='data/upload_sessions/status')
+        if r.status_code == status.HTTP_404_NOT_FOUND:
+            logger.info(f"HQ forgot upload {entry['upload_id']}, restarting")
+            journal.discard(entry)
+            return None
+        self.check_response(r)
+
+        received = {int(part_no): checksum for part_no, checksum in r.json()['parts'].items()}
+        entry['acked_parts'] = [part_no for part_no, checksum in enumerate(entry['part_checksums'])
+                                if received.get(part_no) == checksum]
+        logger.info(f"Resuming upload {entry['upload_id']} at {len(entry['acked_parts'])}/"
+                    f"{len(entry['part_checksums'])} parts")
+        return entry
+
+    def create(self, tub_name, signature, archive_path, fields):
+        sha256, part_checksums = get_part_checksums(archive_path, self.part_size)
+        size = os.path.getsize(archive_path)
+
+        r = hq_client.post(self.sessions_url, endpoint='data/upload_sessions', json={
+            **fields,
+            'tub_name': tub_name,
+            'size': size,
+            'sha256': sha256,
+            'part_size': self.part_size,
+            'no_of_parts': len(part_checksums),
+        })
+        if r.status_code == status.HTTP_404_NOT_FOUND:
+            raise ChunkedUploadNotSupported("HQ does not support chunked uploads")
+        self.check_response(r)
+
+        return {
+            'upload_id': r.json()['upload_id'],
+            'tub_name': tub_name,
+            'signature': signature,
+            'archive_path': str(archive_path),
+            'size': size,
+            'sha256': sha256,
+            'part_size': self.part_size,
+            'part_checksums': part_checksums,
+            'acked_parts': [],
+        }
+
+    def put_part(self, entry, part_no, checksum):
+        data = read_part(entry['archive_path'], entry['part_size'], part_no)
+        r = hq_client.put(f"{self.sessions_url}/{entry['upload_id']}/parts/{part_no}",
+                          endpoint='data/upload_sessions/parts', data=data,
+                          headers={'Content-Type': 'application/octet-stream', self.CHECKSUM_HEADER: checksum})
+        self.check_response(r)
+
+        if r.json().get('sha256') != checksum:
+            raise UploadError(f"HQ acknowledged part {part_no} of {entry['upload_id']} with a different checksum")
+
+    def complete(self, entry, fields):
+        r = hq_client.post(f"{self.sessions_url}/{entry['upload_id']}/complete",
+                           endpoint='data/upload_sessions/complete', json={**fields, 'sha256': entry['sha256']})
+        self.check_response(r)
+        return r.json()
+
+    def check_response(self, r):
+        if r.status_code not in (status.HTTP_200_OK, status.HTTP_201_CREATED):
+            raise UploadError(f"{r.request.method} {r.url} failed with {r.status_code}")
@@ -3,34 +3,102 @@ import json
 import logging
 import os
 import shutil
-import subprocess
-import tarfile
-import tempfile
 import uuid
 from datetime import datetime
+from itertools import islice
 from pathlib import Path
 
-import requests
 from PIL import Image
 from django.conf import settings
 from django.utils.timezone import make_aware
 from donkeycar.parts.tub_v2 import Tub as DKTubV2
-from requests_toolbelt import MultipartEncoder
-from rest_framework import status
 
+from dkconsole.data.archive import iter_tub_archive, write_tub_archive
+from dkconsole.data.chunked_upload import (ChunkedUploader, ChunkedUploadNotSupported, UploadError, post_archive,
+                                           remove_file)
+from dkconsole.data.dedup_upload import (DedupUploader, DedupNegotiationError, DedupNotSupported, read_image_hashes,
+                                         update_image_hashes, write_image_hashes)
+from dkconsole.data.histogram import compute_histograms, render_png
+from dkconsole.data.histogram_jobs import histogram_jobs, EmptyTubError
 from dkconsole.data.models import Meta, Tub, TubImage
+from dkconsole.data.movie_jobs import movie_jobs, get_temp_path, render_movie, touch_movie, MovieProgress
+from dkconsole.data.playback import iter_mjpeg, iter_records, playback_slots
+from dkconsole.data.previews import PreviewCache
+from dkconsole.data.tub_index import get_mtimes
+from dkconsole.data.tub_query import query_tubs
+from dkconsole.data.upload_jobs import UploadJobs
 from dkconsole.service_factory import factory
 from dkconsole.vehicle.vehicle_service import VehicleService
 
 logger = logging.getLogger(__name__)
 
 
+class TubView():
+    """
+    A tub opened once for a single request.
+
+    The manifest is opened once and the first records are read with a single iterator. Thumbnail and image
+    resolution are served from those records.
+    """
+
+    def __init__(self, tub_path, no_of_records=1):
+        self.tub = DKTubV2(str(tub_path))
+        self.records = []
+
+        # ManifestIterator only implements __next__
+        it = iter(self.tub)
+        try:
+            while len(self.records) < no_of_records:
+                self.records.append(next(it))
+        except StopIteration:
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    def close(self):
+        self.tub.close()
+
+    def __len__(self):
+        return len(self.tub)
+
+    @property
+    def manifest(self):
+        return self.tub.manifest
+
+    @property
+    def thumbnail_name(self):
+        if len(self.records) == 0:
+            return None
+        return self.records[0]['cam/image_array']
+
+    @property
+    def image_resolution(self):
+        if self.thumbnail_name is None:
+            return 0, 0
+        with Image.open(Path(self.tub.images_base_path) / self.thumbnail_name) as image:
+            return image.size
+
+
 class TubServiceV2:
     """
     This tub service works with the new datastore v2 on donkeycar
     """
     REFRESH_TUB_STATUS_URL = f'{settings.HQ_BASE_URL}/data/refresh_tub_statuses'
+    UPLOAD_SESSIONS_URL = f'{settings.HQ_BASE_URL}/data/upload_sessions'
     UPLOAD_TUB_URL = f'{settings.HQ_BASE_URL}/data/upload_tub'
+    HQ_BASE_URL = settings.HQ_BASE_URL
+    # donkeycar input types which are stored as files in the images folder
+    IMAGE_EXTENSIONS = {'image_array': '.jpg', 'gray16_array': '.png'}
+    PREVIEW_COUNT = 5
+    preview_cache = PreviewCache()
+    upload_jobs = UploadJobs()
+    histogram_jobs = histogram_jobs
+    movie_jobs = movie_jobs
+    playback_slots = playback_slots
 
     vehicle_service: VehicleService = factory.create('vehicle_service')
 
@@ -65,40 +133,23 @@ class TubServiceV2:
         if not (type(tub_path) is Path):
             tub_path = Path(tub_path)
 
-        tub = DKTubV2(tub_path)
+        with TubView(tub_path) as tub:
+            first_jpg_name = tub.thumbnail_name
+            width, height = tub.image_resolution
+            created_at = make_aware(datetime.fromtimestamp(tub.manifest.manifest_metadata['created_at']))
+            no_of_images = len(tub)
+            previews = cls.get_previews(tub_path, tub.manifest.current_index, tub.manifest.deleted_indexes)
 
-        meta_json_path = cls.get_meta_json_path(tub_path)
-        first_jpg_name = cls.get_thumbnail_name(tub)
-        width, height = cls.get_image_resolution(tub)
-
-        created_at = make_aware(datetime.fromtimestamp(tub.manifest.manifest_metadata['created_at']))
+            if 'rating' in tub.manifest.metadata:
+                rating = tub.manifest.metadata['rating']
+            else:
+                rating = 0
 
+        meta_json_path = cls.get_meta_json_path(tub_path)
         with open(meta_json_path) as f:
             meta = json.load(f)
-            print(meta)
-
-        if 'size' in meta.keys():
-            size = meta['size']
-            print("have 'size'")
-        else:
-            size = cls.get_size(tub_path)
-            cls.update_meta(tub_path.name, {"size": size})
-            print("dont have 'size'")
-        # TODO: fix this file size by fstat
-
-        no_of_images = len(tub)
 
-        previews = []
-
-        if no_of_images > 0:
-            it = iter(tub)
-            for i in range(5):
-                previews.append(next(it)['cam/image_array'])
-
-        if 'rating' in tub.manifest.metadata:
-            rating = tub.manifest.metadata['rating']
-        else:
-            rating = 0
+        size = cls.get_size(tub_path, meta)
 
         tub_image = TubImage(first_jpg_name, width, height)
 
@@ -110,34 +161,122 @@ class TubServiceV2:
                    uuid=uuid or None)
 
     @classmethod
-    def get_size(cls, tub_path):
-        # initialize the size
+    def get_previews(cls, tub_path, current_index, deleted_indexes):
+        """
+        Up to PREVIEW_COUNT image names spread evenly over the live records of the tub
+        """
+        manifest_mtime_ns = os.stat(Path(tub_path) / 'manifest.json').st_mtime_ns
+        record_indexes = cls.preview_cache.get_record_indexes(tub_path, current_index, deleted_indexes,
+                                                              cls.PREVIEW_COUNT, manifest_mtime_ns)
+        return [cls.get_image_name(index) for index in record_indexes]
+
+    @classmethod
+    def get_image_name(cls, index, key='cam/image_array', extension='.jpg'):
+        """
+        Name of the image donkeycar writes for a record, e.g. cam/image_array of record 12 is 12_cam_image_array_.jpg
+        """
+        return f"{index}_{key.replace('/', '_')}_{extension}"
+
+    @classmethod
+    def get_size(cls, tub_path, meta=None):
+        """
+        Tub size in MB.
+
+        The bytes of the images folder are accumulated in meta.json together with the manifest index they were
+        counted up to, so only the images of records written since the last call are stat'ed. The folder is
+        re-counted when the manifest index went backwards (tub re-created).
+        """
+        tub_path = Path(tub_path)
+        if meta is None:
+            with open(cls.get_meta_json_path(tub_path)) as f:
+                meta = json.load(f)
+
+        manifest = cls.read_manifest(tub_path)
+        current_index = manifest['catalog_metadata']['current_index']
+        size_index = meta.get('size_index')
+        images_size = meta.get('images_size')
+
+        if size_index is None or images_size is None or size_index > current_index:
+            images_size = cls.get_dir_size(tub_path / DKTubV2.images())
+        else:
+            images_size += cls.get_images_size(tub_path, manifest, range(size_index, current_index))
+
+        total_size = cls.get_dir_size(tub_path) + images_size
+        size = round(total_size / 1024 / 1024, 2)
+
+        if (size_index, meta.get('images_size'), meta.get('size')) != (current_index, images_size, size):
+            cls.update_meta(tub_path.name, {'size': size, 'size_index': current_index, 'images_size': images_size})
+
+        return size
+
+    @classmethod
+    def get_dir_size(cls, path):
+        """
+        Bytes of the files directly under path, from a single scandir pass
+        """
         total_size = 0
-        # use the walk() method to navigate through directory tree
-        for dirpath, dirnames, filenames in os.walk(tub_path):
-            for i in filenames:
-                # use join to concatenate all the components of path
-                f = os.path.join(dirpath, i)
-                # use getsize to generate size in bytes and add it to the total size
-                total_size += os.path.getsize(f)
-        total_size = total_size / 1024 / 1024
-        return round(total_size, 2)
-
-    @classmethod
-    def get_tubs(cls):
-        tubs = []
-
-        for child in Path(cls.data_dir()).iterdir():
-            if child.is_dir():
+        try:
+            with os.scandir(path) as it:
+                for entry in it:
+                    if entry.is_file(follow_symlinks=False):
+                        total_size += entry.stat(follow_symlinks=False).st_size
+        except FileNotFoundError:
+            pass
+        return total_size
+
+    @classmethod
+    def get_images_size(cls, tub_path, manifest, record_indexes):
+        """
+        Bytes of the images written for record_indexes. Image names are derived from the record index the same way
+        donkeycar names them, so the catalogs do not need to be read.
+        """
+        image_keys = [(key, cls.IMAGE_EXTENSIONS[type_])
+                      for key, type_ in zip(manifest['inputs'], manifest['types']) if type_ in cls.IMAGE_EXTENSIONS]
+
+        images_path = tub_path / DKTubV2.images()
+        total_size = 0
+        for index in record_indexes:
+            for key, extension in image_keys:
                 try:
-                    tub = cls.get_tub(child)
-                    tubs.append(tub)
-                except Exception as e:
-                    print(e)
+                    total_size += os.stat(images_path / cls.get_image_name(index, key, extension)).st_size
+                except FileNotFoundError:
+                    pass
+        return total_size
+
+    @classmethod
+    def read_manifest(cls, tub_path):
+        """
+        Parse the header of manifest.json (inputs, types, metadata, manifest metadata and catalog metadata) without
+        opening the tub and its catalogs
+        """
+        with open(Path(tub_path) / 'manifest.json') as f:
+            lines = [json.loads(line) for line in islice(f, 5)]
+        return dict(zip(['inputs', 'types', 'metadata', 'manifest_metadata', 'catalog_metadata'], lines))
 
-        tubs.sort(key=lambda x: x.created_at, reverse=True)
+    @classmethod
+    def get_tub_signature(cls, tub_path):
+        """
+        A tub has to be re-scanned when records are added (manifest.json) or the console meta.json changes
+        """
+        return get_mtimes([tub_path, tub_path / 'manifest.json', tub_path / 'meta.json'])
+
+    @classmethod
+    def get_created_at(cls, tub_path):
+        """
+        Read created_at from the manifest metadata without opening the whole tub
+        """
+        return cls.read_manifest(tub_path)['manifest_metadata']['created_at']
 
-        return tubs
+    @classmethod
+    def get_tubs(cls, sort='created_at', reverse=True, name_prefix=None, min_images=0):
+        return list(cls.query_tubs(sort, reverse, name_prefix, min_images))
+
+    @classmethod
+    def query_tubs(cls, sort='created_at', reverse=True, name_prefix=None, min_images=0):
+        """
+        Same as get_tubs, but tubs are only scanned when they are accessed. Used by the paginated listing.
+        """
+        return query_tubs(cls, sort, reverse, name_prefix, min_images)
 
     @classmethod
     def get_jpg_file_count_on_disk(cls, tub_path):
@@ -147,18 +286,21 @@ class TubServiceV2:
     @classmethod
     def generate_tub_archive(cls, tub_paths, add_config_file=True):
         print("generating tub archive")
-        f = tempfile.NamedTemporaryFile(mode='w+b', suffix='.tar.gz', delete=False)
-
-        with tarfile.open(fileobj=f, mode='w:gz') as tar:
-            for tub_path in tub_paths:
-                p = Path(tub_path)
-                tar.add(p, arcname=p.name)
-            if add_config_file:
-                tar.add(f"{settings.CARAPP_PATH}/myconfig.py", arcname="myconfig.py")
+        return write_tub_archive(tub_paths, cls.get_archive_extra_files(add_config_file))
 
-        f.close()
+    @classmethod
+    def stream_tub_archive(cls, tub_paths, add_config_file=True, compression='gz', compresslevel=None):
+        """
+        Same archive as generate_tub_archive, generated as a stream of chunks while the tar is being built
+        """
+        return iter_tub_archive(tub_paths, cls.get_archive_extra_files(add_config_file), compression, compresslevel)
 
-        return f.name
+    @classmethod
+    def get_archive_extra_files(cls, add_config_file=True):
+        config_path = Path(settings.CARAPP_PATH) / "myconfig.py"
+        if add_config_file and config_path.exists():
+            return [(config_path, "myconfig.py")]
+        return []
 
     @classmethod
     def delete_tub(cls, tub_path):
@@ -193,41 +335,109 @@ class TubServiceV2:
                 shutil.rmtree(tub.path)
 
     @classmethod
-    def gen_movie(cls, tub_name):
+    def get_movie_path(cls, tub_name):
+        return Path(settings.MOVIE_DIR) / f"{tub_name}.mp4"
+
+    @classmethod
+    def gen_movie(cls, tub_name, progress=None):
+        """
+        Render the movie of the tub with donkey makemovie unless it exists. It is written to a temporary file renamed
+        once complete, so an existing movie is always a complete one.
+        """
         tub_path = Path(settings.DATA_DIR) / tub_name
+        os.makedirs(settings.MOVIE_DIR, exist_ok=True)
 
-        # Create movie directory if not exists
-        if not os.path.exists(settings.MOVIE_DIR):
-            os.mkdir(settings.MOVIE_DIR)
+        movie_path = cls.get_movie_path(tub_name)
+        if movie_path.exists():
+            return movie_path
 
-        videoPath = Path(settings.MOVIE_DIR) / f"{tub_name}.mp4"
-        if not os.path.exists(videoPath):
-            command = [f'{settings.VENV_PATH}/donkey', 'makemovie', f'--tub={tub_path}', f'--out={videoPath}']
-            print(" ".join(command))
-            subprocess.check_output(command, cwd=settings.CARAPP_PATH)
-            return videoPath
-        return videoPath
+        command = [f'{settings.VENV_PATH}/donkey', 'makemovie', f'--tub={tub_path}',
+                   f'--out={get_temp_path(movie_path)}']
+        logger.debug(f"command  = {' '.join(command)}")
+        return render_movie(command, movie_path, progress or MovieProgress(tub_name), cwd=settings.CARAPP_PATH)
 
     @classmethod
-    def gen_histogram(cls, tub_path):
-        print("bing bing")
-        tub = DKTubV2(tub_path)
+    def get_movie(cls, tub_name):
+        """
+        (movie path, None) when the movie of the tub is rendered. Otherwise the movie is rendered in the background
+        and (None, progress) is returned.
+        """
+        movie_path = cls.get_movie_path(tub_name)
+        try:
+            touch_movie(movie_path)
+            return movie_path, None
+        except FileNotFoundError:
+            pass
 
-        if len(tub) == 0:
-            raise Exception("empty tub")
+        progress = cls.movie_jobs.submit(tub_name, lambda progress: cls.gen_movie(tub_name, progress))
+        return None, progress.to_dict()
+
+    @classmethod
+    def get_movie_progress(cls, tub_name):
+        return cls.movie_jobs.get_progress(tub_name)
 
-        histogram_name = os.path.basename(tub_path) + "_hist.png"
-        histogram_path = tub_path / histogram_name
+    @classmethod
+    def stream_playback(cls, tub_name, start=0, end=None, rate=1.0):
+        """
+        MJPEG parts of the camera images of the tub from record start to end, played at rate times the recording
+        speed, read lazily so the playback starts right away. Raises PlaybackBusy when PLAYBACK_MAX_STREAMS
+        playbacks are streaming already.
+        """
+        tub_path = Path(settings.DATA_DIR) / tub_name
+        manifest = cls.read_manifest(tub_path)
+        image_keys = [key for key, type_ in zip(manifest['inputs'], manifest['types']) if type_ == 'image_array']
+        if not image_keys:
+            raise ValueError(f"{tub_name} has no camera images")
+        return cls.playback_slots.stream(
+            iter_mjpeg(tub_path, iter_records(tub_path, manifest, start, end), image_keys[0], rate))
 
-        if not os.path.exists(histogram_path):
-            command = [f'{settings.VENV_PATH}/donkey', 'tubhist', f'--tub={tub_path}', f'--out={histogram_path}']
-            logger.debug(f"command  = {''.join(command)}")
+    @classmethod
+    def get_histogram_path(cls, tub_path, format='png'):
+        return Path(tub_path) / (os.path.basename(tub_path) + f"_hist.{format}")
 
-            subprocess.check_output(command, cwd=settings.CARAPP_PATH)
+    @classmethod
+    def compute_histograms(cls, tub_path):
+        """
+        Histogram bins of every float input of the tub, computed in-process from the catalogs
+        """
+        return compute_histograms(tub_path, cls.read_manifest(tub_path), bins=settings.HISTOGRAM_BINS)
 
-            return histogram_path
+    @classmethod
+    def gen_histogram(cls, tub_path):
+        """
+        Write the histogram of the tub both as PNG and as JSON bins
+        """
+        result = cls.compute_histograms(tub_path)
+        if result['records'] == 0:
+            raise EmptyTubError("empty tub")
+
+        # written under other names and renamed, so a half written histogram is never served. The JSON is renamed
+        # first, the PNG (which the cache checks against the manifest) last.
+        json_path = cls.get_histogram_path(tub_path, 'json')
+        histogram_path = cls.get_histogram_path(tub_path)
+        temp_json_path = json_path.with_name(json_path.name + ".part")
+        temp_path = histogram_path.with_name(histogram_path.name + ".part")
+        try:
+            with open(temp_json_path, 'w') as f:
+                json.dump(result, f, separators=(',', ':'))
+            render_png(result, temp_path)
+            os.replace(temp_json_path, json_path)
+            os.replace(temp_path, histogram_path)
+        finally:
+            for path in (temp_json_path, temp_path):
+                if path.exists():
+                    os.remove(path)
         return histogram_path
 
+    @classmethod
+    def get_histogram(cls, tub_path, format='png'):
+        """
+        Path of the histogram of the tub as png or json, None while it is being generated in the background.
+        It is generated again when the manifest changed.
+        """
+        return cls.histogram_jobs.get(cls.get_histogram_path(tub_path, format), [Path(tub_path) / 'manifest.json'],
+                                      lambda: cls.gen_histogram(tub_path))
+
     @classmethod
     def get_tub_by_name(cls, tub_name):
         tub_path = Path(cls.data_dir()) / tub_name
@@ -290,44 +500,123 @@ class TubServiceV2:
             meta = json.load(f)
             return 'uuid' in meta
 
+    @classmethod
+    def uploader(cls):
+        return ChunkedUploader(cls.UPLOAD_SESSIONS_URL)
+
+    @classmethod
+    def get_upload_fields(cls, transaction_uuid):
+        return {
+            'device_id': cls.vehicle_service.get_wlan_mac_address(),
+            'hostname': cls.vehicle_service.get_hostname(),
+            'transaction_uuid': transaction_uuid
+        }
+
+    @classmethod
+    def upload_tub(cls, tub_name, fields, progress=None):
+        """
+        Upload one tub and save the uuid HQ gave it in the tub meta.
+
+        Only the files HQ does not have yet are sent when HQ supports deduplicated uploads. Otherwise, or when HQ
+        cannot tell which files it is missing, the archive is sent in parts, and an upload interrupted earlier resumes
+        from the last part HQ acknowledged. HQs without upload sessions get the whole archive in one request.
+        """
+        tub_path = Path(cls.data_dir()) / tub_name
+        result = None
+        if settings.HQ_UPLOAD_DEDUP:
+            try:
+                if progress:
+                    progress.update(stage='hashing')
+                result = DedupUploader(cls.HQ_BASE_URL).upload(tub_path, cls.get_image_hashes(tub_path), fields,
+                                                               progress)
+            except DedupNotSupported:
+                logger.info("HQ does not support deduplicated uploads, sending the whole archive")
+            except DedupNegotiationError as e:
+                logger.warning(f"Deduplicated upload of {tub_name} failed, sending the whole archive: {e}")
+
+        if result is None:
+            try:
+                result = cls.uploader().upload(
+                    tub_name,
+                    cls.get_tub_signature(tub_path),
+                    lambda dir: write_tub_archive([tub_path], dir=dir),
+                    fields,
+                    progress)
+            except ChunkedUploadNotSupported:
+                logger.info("HQ does not support chunked uploads, posting the archive in one request")
+                result = cls.post_tub_archive(tub_name, fields, progress)
+
+        if not result.get('uuid'):
+            raise UploadError(f"HQ did not return a uuid for {tub_name}")
+        cls.update_meta(tub_name, {'uuid': result['uuid']})
+        return result['uuid']
+
+    @classmethod
+    def post_tub_archive(cls, tub_name, fields, progress=None):
+        """
+        Upload the archive of the tub in a single POST to UPLOAD_TUB_URL, without resume
+        """
+        tub_path = Path(cls.data_dir()) / tub_name
+        Path(settings.UPLOAD_DIR).mkdir(parents=True, exist_ok=True)
+        if progress:
+            progress.update(stage='archiving')
+        archive_path = write_tub_archive([tub_path], dir=settings.UPLOAD_DIR)
+        try:
+            size = os.path.getsize(archive_path)
+            if progress:
+                progress.update(stage='uploading', bytes_sent=0, total_bytes=size)
+            result = post_archive(cls.UPLOAD_TUB_URL, tub_name, archive_path, fields)
+            if progress:
+                progress.update(bytes_sent=size)
+            return result
+        finally:
+            remove_file(archive_path)
+
+    @classmethod
+    def get_image_hashes(cls, tub_path):
+        """
+        {name: sha256} of the images of the tub. The hashes are cached in the tub (IMAGE_HASHES_FILE), only new
+        images are read.
+        """
+        tub_path = Path(tub_path)
+        hashes, changed = update_image_hashes(tub_path / DKTubV2.images(), read_image_hashes(tub_path))
+        if changed:
+            write_image_hashes(tub_path, hashes)
+        return {name: value[0] for name, value in hashes.items()}
+
     @classmethod
     def upload_to_hq(cls, data):
-        device_id = cls.vehicle_service.get_wlan_mac_address()
-        hostname = cls.vehicle_service.get_hostname()
+        """
+        Upload the tubs in data['tub_names'] which were not uploaded yet, one after the other. Returns the lists
+        of failed and uploaded tub names.
+        """
+        fields = cls.get_upload_fields(str(uuid.uuid4()))
         fail = []
         success = []
-        transaction_uuid = str(uuid.uuid4())
         for tub_name in data['tub_names']:
-            tub_path = Path(cls.data_dir()) / tub_name
-            if not cls.check_uuid_exist(tub_path):
+            if not cls.check_uuid_exist(tub_name):
                 try:
-                    filename = cls.generate_tub_archive(tub_paths=[tub_path], add_config_file=False)
-                    mp_encoder = MultipartEncoder(
-                        fields={
-                            'tub_name': tub_name,
-                            'device_id': device_id,
-                            'hostname': hostname,
-                            'tub_archive_file': ('file.tar.gz', open(filename, 'rb'), 'application/gzip'),
-                            'transaction_uuid': transaction_uuid
-                        }
-                    )
-
-                    logger.debug('Posting tub to HQ')
-                    r = requests.post(
-                        cls.UPLOAD_TUB_URL,
-                        data=mp_encoder,  # The MultipartEncoder is posted as data, don't use files=...!
-                        # The MultipartEncoder provides the content-type header with the boundary:
-                        headers={'Content-Type': mp_encoder.content_type}
-                    )
-
-                    if r.status_code == status.HTTP_200_OK and r.json()['uuid']:
-                        cls.update_meta(tub_name, {'uuid': r.json()['uuid']})
-                        success.append(tub_name)
-                    else:
-                        fail.append(tub_name)
+                    cls.upload_tub(tub_name, fields)
+                    success.append(tub_name)
                 except Exception as e:
                     logger.error(e)
                     fail.append(tub_name)
             else:
                 success.append(tub_name)
         return fail, success
+
+    @classmethod
+    def start_upload(cls, tub_names):
+        """
+        Upload tub_names in the background and return the transaction uuid to follow their progress with
+        """
+        transaction_uuid = str(uuid.uuid4())
+        fields = cls.get_upload_fields(transaction_uuid)
+        cls.upload_jobs.submit(transaction_uuid, tub_names,
+                               lambda tub_name, progress: cls.upload_tub(tub_name, fields, progress),
+                               cls.check_uuid_exist)
+        return transaction_uuid
+
+    @classmethod
+    def get_upload_progress(cls, transaction_uuid):
+        return cls.upload_jobs.get_progress(transaction_uuid)
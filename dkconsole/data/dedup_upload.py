@@ -0,0 +1,190 @@
+import hashlib
+import json
+import logging
+import os
+import tempfile
+from pathlib import Path
+
+import requests
+from rest_framework import status
+
+from dkconsole.data.chunked_upload import UploadError
+from dkconsole.hq_client import hq_client
+
+logger = logging.getLogger(__name__)
+
+# cache of the image hashes in the tub folder, kept out of meta.json which is read for every tub of the listing
+IMAGE_HASHES_FILE = '.image_hashes.json'
+
+
+class DedupNegotiationError(UploadError):
+    pass
+
+
+class DedupNotSupported(DedupNegotiationError):
+    pass
+
+
+def hash_file(path):
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            sha256.update(block)
+    return sha256.hexdigest()
+
+
+def update_image_hashes(images_path, cached):
+    """
+    sha256 of every file in images_path, as {name: [sha256, size, mtime_ns]}.
+
+    Hashes in cached are reused for files with the same size and mtime, so only new or modified images are read.
+    Returns the hashes and whether they differ from cached.
+    """
+    hashes = {}
+    try:
+        with os.scandir(images_path) as it:
+            for entry in it:
+                if not entry.is_file():
+                    continue
+                stat = entry.stat()
+                cached_hash = cached.get(entry.name)
+                if cached_hash is not None and cached_hash[1:] == [stat.st_size, stat.st_mtime_ns]:
+                    hashes[entry.name] = cached_hash
+                else:
+                    hashes[entry.name] = [hash_file(entry.path), stat.st_size, stat.st_mtime_ns]
+    except FileNotFoundError:
+        pass
+    return hashes, hashes != cached
+
+
+def read_image_hashes(tub_path):
+    """
+    Image hashes cached in the tub by write_image_hashes, {} when there are none yet or they cannot be read
+    """
+    try:
+        with open(Path(tub_path) / IMAGE_HASHES_FILE) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        logger.warning(f"Ignoring unreadable image hashes of {tub_path}: {e}")
+        return {}
+
+
+def write_image_hashes(tub_path, hashes):
+    path = Path(tub_path) / IMAGE_HASHES_FILE
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=IMAGE_HASHES_FILE)
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(hashes, f)
+        os.replace(tmp_path, path)
+    except OSError:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+class DedupUploader():
+    """
+    Upload a tub to HQ as content addressed blobs, so files HQ already has are not sent again.
+
+    The protocol is:
+        POST {HQ}/data/blobs/missing       sha256 list, returns the ones HQ does not have
+        PUT  {HQ}/data/blobs/{sha256}      one blob
+        POST {HQ}/data/tub_manifests       the tub as {relative path: sha256}, returns the tub uuid
+
+    HQ answering 404 to the negotiation means it does not support deduplicated uploads, DedupNotSupported is
+    raised. Any other failure of the negotiation, including an answer naming blobs which were not asked for, raises
+    DedupNegotiationError. Nothing has been sent at that point, so the caller can fall back to sending the archive.
+    """
+    BATCH_SIZE = 500
+
+    def __init__(self, base_url):
+        self.missing_url = f"{base_url}/data/blobs/missing"
+        self.blobs_url = f"{base_url}/data/blobs"
+        self.manifests_url = f"{base_url}/data/tub_manifests"
+
+    def upload(self, tub_path, image_hashes, fields, progress=None):
+        """
+        Upload tub_path and return the response of the manifest call. image_hashes are the {name: sha256} of the
+        images folder, the other (small) files of the tub are hashed here.
+        """
+        tub_path = Path(tub_path)
+        files = self.get_files(tub_path, image_hashes)
+
+        paths = {}
+        for relative_path, sha256 in files.items():
+            paths.setdefault(sha256, tub_path / relative_path)
+
+        missing = self.get_missing(list(paths))
+        total_bytes = sum(os.path.getsize(paths[sha256]) for sha256 in missing)
+        logger.info(f"{tub_path.name}: {len(missing)}/{len(paths)} blobs missing on HQ, {total_bytes} bytes")
+
+        bytes_sent = 0
+        if progress:
+            progress.update(stage='uploading', bytes_sent=0, total_bytes=total_bytes)
+        for sha256 in missing:
+            bytes_sent += self.put_blob(sha256, paths[sha256])
+            if progress:
+                progress.update(bytes_sent=bytes_sent)
+
+        if progress:
+            progress.update(stage='completing')
+        r = hq_client.post(self.manifests_url, endpoint='data/tub_manifests',
+                           json={**fields, 'tub_name': tub_path.name, 'files': files})
+        self.check_response(r)
+        return r.json()
+
+    def get_files(self, tub_path, image_hashes):
+        """
+        {path relative to the tub: sha256} of every file of the tub
+        """
+        files = {}
+        for dirpath, dirnames, filenames in os.walk(tub_path):
+            relative_dir = Path(dirpath).relative_to(tub_path)
+            for name in filenames:
+                if relative_dir == Path('.') and name == IMAGE_HASHES_FILE:
+                    continue
+                relative_path = (relative_dir / name).as_posix()
+                if relative_dir == Path('images') and name in image_hashes:
+                    files[relative_path] = image_hashes[name]
+                else:
+                    files[relative_path] = hash_file(Path(dirpath) / name)
+        return files
+
+    def get_missing(self, hashes):
+        missing = []
+        for i in range(0, len(hashes), self.BATCH_SIZE):
+            batch = hashes[i:i + self.BATCH_SIZE]
+            try:
+                r = hq_client.post(self.missing_url, endpoint='data/blobs/missing', idempotent=True,
+                                   json={'hashes': batch})
+            except requests.RequestException as e:
+                raise DedupNegotiationError(f"POST {self.missing_url} failed: {e}") from e
+            if r.status_code == status.HTTP_404_NOT_FOUND:
+                raise DedupNotSupported("HQ does not support deduplicated uploads")
+            if r.status_code != status.HTTP_200_OK:
+                raise DedupNegotiationError(f"POST {r.url} failed with {r.status_code}")
+            try:
+                batch_missing = r.json()['missing']
+            except (ValueError, KeyError, TypeError):
+                raise DedupNegotiationError(f"POST {r.url} returned no list of missing blobs")
+
+            unknown = set(batch_missing) - set(batch)
+            if unknown:
+                raise DedupNegotiationError(
+                    f"HQ asked for blobs which are not in the tub: {', '.join(sorted(unknown))}")
+            missing += batch_missing
+        return missing
+
+    def put_blob(self, sha256, path):
+        with open(path, 'rb') as f:
+            data = f.read()
+        r = hq_client.put(f"{self.blobs_url}/{sha256}", endpoint='data/blobs', data=data,
+                          headers={'Content-Type': 'application/octet-stream'})
+        self.check_response(r)
+        return len(data)
+
+    def check_response(self, r):
+        if r.status_code not in (status.HTTP_200_OK, status.HTTP_201_CREATED):
+            raise UploadError(f"{r.request.method} {r.url} failed with {r.status_code}")
@@ -0,0 +1,119 @@
+import json
+import logging
+import math
+from pathlib import Path
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+logger = logging.getLogger(__name__)
+
+PLOT_WIDTH = 480
+PLOT_HEIGHT = 200
+MARGIN = 24
+BAR_COLOR = (31, 119, 180)
+
+
+def read_catalog(catalog_path):
+    """
+    Records of a catalog, parsed with a single json.loads. A catalog being written can end with a partial line,
+    it is then parsed line by line and the broken lines skipped.
+    """
+    with open(catalog_path) as f:
+        lines = [line for line in f.read().splitlines() if line.strip()]
+    try:
+        return json.loads('[' + ','.join(lines) + ']')
+    except ValueError:
+        records = []
+        for line in lines:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                logger.warning(f"Skipping a broken record of {catalog_path}")
+        return records
+
+
+def read_columns(tub_path, manifest, keys=None):
+    """
+    The float inputs of a v2 tub (or only keys) as NumPy arrays, without the deleted records. manifest is the
+    parsed manifest.json header, see TubServiceV2.read_manifest.
+    """
+    tub_path = Path(tub_path)
+    if keys is None:
+        keys = [key for key, type_ in zip(manifest['inputs'], manifest['types']) if type_ == 'float']
+
+    records = []
+    for catalog in manifest['catalog_metadata'].get('paths', []):
+        if (tub_path / catalog).exists():
+            records += read_catalog(tub_path / catalog)
+
+    deleted = np.array(manifest['catalog_metadata'].get('deleted_indexes', []), dtype=np.int64)
+    indexes = np.fromiter((record.get('_index', -1) for record in records), dtype=np.int64, count=len(records))
+    keep = ~np.isin(indexes, deleted)
+
+    columns = {}
+    for key in keys:
+        values = np.fromiter((value if isinstance(value, (int, float)) else math.nan
+                              for value in (record.get(key) for record in records)),
+                             dtype=np.float64, count=len(records))
+        columns[key] = values[keep]
+    return columns
+
+
+def compute_histograms(tub_path, manifest, bins=50, keys=None):
+    """
+    Histogram of every float input of the tub:
+
+        {"records": 318, "histograms": {"user/angle": {"min": -1.0, "max": 1.0, "counts": [...]}, ...}}
+
+    The bins split min..max evenly, so their edges are not sent.
+    """
+    columns = read_columns(tub_path, manifest, keys)
+    records = max([len(values) for values in columns.values()] or [0])
+    histograms = {}
+    for key, values in columns.items():
+        values = values[np.isfinite(values)]
+        if len(values) == 0:
+            histograms[key] = {'min': None, 'max': None, 'counts': []}
+            continue
+        low, high = float(values.min()), float(values.max())
+        if low == high:
+            # a constant column, e.g. a fixed throttle, still gets a visible bin around its value
+            low, high = low - 0.5, high + 0.5
+        counts, _ = np.histogram(values, bins=bins, range=(low, high))
+        histograms[key] = {'min': low, 'max': high, 'counts': counts.tolist()}
+    return {'records': records, 'histograms': histograms}
+
+
+def render_png(result, path):
+    """
+    Draw the histograms of compute_histograms() as bar charts stacked in one PNG
+    """
+    histograms = result['histograms']
+    image = Image.new('RGB', (PLOT_WIDTH, max(1, len(histograms)) * PLOT_HEIGHT), 'white')
+    draw = ImageDraw.Draw(image)
+
+    for row, (key, histogram) in enumerate(histograms.items()):
+        top = row * PLOT_HEIGHT
+        left, right = MARGIN, PLOT_WIDTH - MARGIN
+        bottom = top + PLOT_HEIGHT - MARGIN
+        draw.text((left, top + 4), key, fill='black')
+        draw.line([(left, bottom), (right, bottom)], fill='black')
+
+        counts = histogram['counts']
+        if not counts:
+            continue
+        draw.text((left, bottom + 4), f"{histogram['min']:.2f}", fill='black')
+        draw.text((right - 30, bottom + 4), f"{histogram['max']:.2f}", fill='black')
+        draw.text((right - 60, top + 4), f"max {max(counts)}", fill='black')
+
+        bar_width = (right - left) / len(counts)
+        plot_height = bottom - top - 2 * MARGIN
+        for i, count in enumerate(counts):
+            if count:
+                height = max(1, round(plot_height * count / max(counts)))
+                x0 = left + i * bar_width
+                x1 = max(x0, x0 + bar_width - 1)
+                draw.rectangle([x0, bottom - height, x1, bottom - 1], fill=BAR_COLOR)
+
+    image.save(path, format='PNG')
@@ -0,0 +1,86 @@
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+class EmptyTubError(Exception):
+    pass
+
+
+class HistogramError(Exception):
+    pass
+
+
+class HistogramNotSupported(Exception):
+    pass
+
+
+class HistogramJobs():
+    """
+    Tub histograms generated in the background on a pool of HISTOGRAM_WORKERS threads.
+
+    The histogram file is the cache: it is current while it is newer than every one of its source files (the tub
+    manifest), and generated again once a source changed. Requests for a histogram being generated share the
+    running job instead of queueing another one. The error of a failed job is reported to the next request only,
+    the request after it queues a new job.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.executor = None
+        self.active = set()
+        self.errors = {}
+
+    def get_executor(self):
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=max(1, settings.HISTOGRAM_WORKERS),
+                                               thread_name_prefix='histogram')
+        return self.executor
+
+    def is_current(self, histogram_path, sources):
+        try:
+            mtime_ns = os.stat(histogram_path).st_mtime_ns
+        except FileNotFoundError:
+            return False
+        return all(os.stat(source).st_mtime_ns <= mtime_ns for source in sources if os.path.exists(source))
+
+    def get(self, histogram_path, sources, generate):
+        """
+        Return histogram_path when the histogram is current. Otherwise queue generate() unless it is queued already
+        and return None, or raise the error of the job which generated it last.
+        """
+        key = str(histogram_path)
+        with self.lock:
+            if key in self.active:
+                return None
+            error = self.errors.pop(key, None)
+            if error is not None:
+                raise error
+            if self.is_current(histogram_path, sources):
+                return histogram_path
+
+            self.active.add(key)
+            self.get_executor().submit(self.run, key, generate)
+        return None
+
+    def run(self, key, generate):
+        try:
+            generate()
+        except EmptyTubError as e:
+            with self.lock:
+                self.errors[key] = e
+        except Exception as e:
+            logger.error(f"Failed to generate {key}: {e}")
+            with self.lock:
+                self.errors[key] = HistogramError(str(e))
+        finally:
+            with self.lock:
+                self.active.discard(key)
+
+
+histogram_jobs = HistogramJobs()
@@ -0,0 +1,128 @@
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+from pathlib import Path
+
+from PIL import Image
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+class ImageCache():
+    """
+    Disk cache of downscaled tub images, so list views can fetch small thumbnails and previews instead of full
+    camera frames.
+
+    Requested widths are rounded up to one of WIDTHS to keep the number of variants bounded. Cached files are
+    touched on every hit and the least recently used ones are evicted once the cache grows past
+    IMAGE_CACHE_MAX_SIZE.
+    """
+    WIDTHS = [64, 128, 160, 320, 640]
+    FORMATS = {'jpeg': '.jpg', 'webp': '.webp'}
+    QUALITY = 80
+
+    lock = threading.Lock()
+    cache_size = None
+
+    @classmethod
+    def cache_dir(cls):
+        return Path(settings.IMAGE_CACHE_DIR)
+
+    @classmethod
+    def get_variant_width(cls, width):
+        for variant_width in cls.WIDTHS:
+            if width <= variant_width:
+                return variant_width
+        return cls.WIDTHS[-1]
+
+    @classmethod
+    def get_resized(cls, image_path, width, format='jpeg'):
+        """
+        Return the path of image_path downscaled to (about) width pixels wide.
+
+        Images which are not wider than the requested width are only converted to format, and the original path is
+        returned when they are already in it.
+        """
+        stat = os.stat(image_path)
+        width = cls.get_variant_width(width)
+        key = f"{os.path.abspath(image_path)}:{stat.st_mtime_ns}:{stat.st_size}:{width}"
+        cached_path = cls.cache_dir() / f"{hashlib.sha1(key.encode()).hexdigest()}_{width}{cls.FORMATS[format]}"
+
+        try:
+            os.utime(cached_path)  # mark as recently used
+            return cached_path
+        except FileNotFoundError:
+            pass
+
+        with Image.open(image_path) as image:
+            if image.width <= width:
+                if image.format == format.upper():
+                    return Path(image_path)
+                resized = image.convert('RGB')
+            else:
+                height = max(1, round(image.height * width / image.width))
+                resized = image.convert('RGB').resize((width, height), Image.BILINEAR)
+
+        cls.cache_dir().mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=cls.cache_dir(), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                resized.save(f, format=format.upper(), quality=cls.QUALITY)
+            os.replace(tmp_path, cached_path)
+        except Exception:
+            os.remove(tmp_path)
+            raise
+
+        cls.add_to_cache_size(os.path.getsize(cached_path))
+        return cached_path
+
+    @classmethod
+    def add_to_cache_size(cls, size):
+        with cls.lock:
+            if cls.cache_size is None:
+                cls.cache_size = cls.get_cache_size()
+            else:
+                cls.cache_size += size
+
+            if cls.cache_size > settings.IMAGE_CACHE_MAX_SIZE:
+                cls.cache_size = cls.evict(int(settings.IMAGE_CACHE_MAX_SIZE * 0.9))
+
+    @classmethod
+    def get_cache_size(cls):
+        return sum(size for _, _, size in cls.list_cache())
+
+    @classmethod
+    def list_cache(cls):
+        entries = []
+        try:
+            with os.scandir(cls.cache_dir()) as it:
+                for entry in it:
+                    if entry.is_file() and not entry.name.endswith('.tmp'):
+                        stat = entry.stat()
+                        entries.append((stat.st_mtime, entry.path, stat.st_size))
+        except FileNotFoundError:
+            pass
+        return entries
+
+    @classmethod
+    def evict(cls, target_size):
+        """
+        Delete least recently used variants until the cache is below target_size. Returns the new cache size.
+        """
+        entries = sorted(cls.list_cache())
+        cache_size = sum(size for _, _, size in entries)
+
+        for _, path, size in entries:
+            if cache_size <= target_size:
+                break
+            try:
+                os.remove(path)
+                cache_size -= size
+            except FileNotFoundError:
+                pass
+
+        logger.debug(f"Image cache evicted down to {cache_size} bytes")
+        return cache_size
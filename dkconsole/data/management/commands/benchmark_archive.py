@@ -0,0 +1,29 @@
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from dkconsole.data.archive import CODECS, benchmark_codecs
+
+
+class Command(BaseCommand):
+    help = "Compare the tub archive codecs on tubs of DATA_DIR: time, size and throughput"
+
+    def add_arguments(self, parser):
+        parser.add_argument('tub_names', nargs='+')
+        parser.add_argument('--compression', action='append', choices=list(CODECS),
+                            help="codec to benchmark, can be repeated. Default is all of them")
+        parser.add_argument('--compresslevel', type=int)
+
+    def handle(self, *args, **options):
+        tub_paths = [Path(settings.DATA_DIR) / tub_name for tub_name in options['tub_names']]
+        for tub_path in tub_paths:
+            if not tub_path.is_dir():
+                raise CommandError(f"Tub {tub_path} does not exist")
+
+        results = benchmark_codecs(tub_paths, options['compression'], options['compresslevel'])
+
+        self.stdout.write(f"{'codec':<6} {'seconds':>8} {'size':>12} {'ratio':>6} {'MB/s':>8}")
+        for result in results:
+            self.stdout.write(f"{result['compression']:<6} {result['seconds']:>8.2f} {result['size']:>12} "
+                              f"{result['ratio']:>6.3f} {result['throughput']:>8.1f}")
@@ -0,0 +1,195 @@
+import logging
+import os
+import re
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# moviepy prints a tqdm bar on stderr: "t:  45%|####      | 450/1000 [00:12<00:15, 36.1it/s, now=None]"
+PROGRESS_RE = re.compile(rb'(\d+)/(\d+) \[')
+# movies of the training jobs, downloaded into MOVIE_DIR next to the tub movies
+JOB_MOVIE_RE = re.compile(r'job_\d+\.mp4')
+
+
+class MovieError(Exception):
+    pass
+
+
+class MovieProgress():
+    """
+    Where the rendering of one tub movie is at. stage goes queued -> rendering -> done, or failed.
+    """
+
+    def __init__(self, tub_name, stage='queued'):
+        self.lock = threading.Lock()
+        self.tub_name = tub_name
+        self.stage = stage
+        self.frames = 0
+        self.total_frames = None
+        self.error = None
+
+    def update(self, **kwargs):
+        with self.lock:
+            for key, value in kwargs.items():
+                setattr(self, key, value)
+
+    def to_dict(self):
+        with self.lock:
+            return {
+                'tub_name': self.tub_name,
+                'stage': self.stage,
+                'frames': self.frames,
+                'total_frames': self.total_frames,
+                'error': self.error,
+            }
+
+
+def get_temp_path(movie_path):
+    # makemovie picks the codec from the extension, so the temporary file still ends with .mp4
+    return movie_path.with_name(movie_path.stem + ".part" + movie_path.suffix)
+
+
+def render_movie(command, movie_path, progress, cwd=None):
+    """
+    Run the donkey makemovie command, which writes to get_temp_path(movie_path), and rename its output to
+    movie_path once it succeeded. The progress is read from the progress bar on stderr.
+    """
+    movie_path = Path(movie_path)
+    temp_path = get_temp_path(movie_path)
+    progress.update(stage='rendering')
+
+    try:
+        with subprocess.Popen(command, cwd=cwd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE) as process:
+            tail = b''
+            for chunk in iter(lambda: process.stderr.read1(4096), b''):
+                tail = (tail + chunk)[-4096:]
+                matches = PROGRESS_RE.findall(tail)
+                if matches:
+                    frames, total_frames = matches[-1]
+                    progress.update(frames=int(frames), total_frames=int(total_frames))
+            returncode = process.wait()
+        if returncode != 0:
+            lines = tail.decode('utf-8', 'replace').strip().splitlines()
+            raise MovieError(f"makemovie exited with {returncode}" + (f": {lines[-1]}" if lines else ""))
+
+        os.replace(temp_path, movie_path)
+    finally:
+        if temp_path.exists():
+            os.remove(temp_path)
+    return movie_path
+
+
+def evict_movies(movie_dir, quota, keep=()):
+    """
+    Delete the least recently used tub movies of movie_dir until they fit in quota bytes. The movies in keep and the
+    ones being rendered are never deleted. Movies are marked as used by touch_movie(), through their atime.
+
+    The movies of the training jobs (job_<id>.mp4) are neither counted nor evicted, they are downloaded once and
+    cannot be rendered again. Movies of tubs which were deleted since are evicted like the others.
+    """
+    movies = []
+    for entry in os.scandir(movie_dir):
+        if not entry.is_file() or not entry.name.endswith('.mp4') or entry.name.endswith('.part.mp4'):
+            continue
+        if JOB_MOVIE_RE.fullmatch(entry.name):
+            continue
+        stat = entry.stat()
+        movies.append((stat.st_atime, stat.st_size, Path(entry.path)))
+
+    total = sum(size for _, size, _ in movies)
+    keep = {Path(path) for path in keep}
+    evicted = []
+    for atime, size, path in sorted(movies, key=lambda movie: movie[0]):
+        if total <= quota:
+            break
+        if path in keep:
+            continue
+        try:
+            os.remove(path)
+            total -= size
+            evicted.append(path)
+            logger.info(f"Evicted {path.name} from the movie cache")
+        except FileNotFoundError:
+            total -= size
+    return evicted
+
+
+def touch_movie(movie_path):
+    """
+    Record that a movie was used, for evict_movies(). The atime is set explicitly as the SD card is usually mounted
+    with noatime / relatime. The mtime is kept.
+    """
+    stat = os.stat(movie_path)
+    os.utime(movie_path, ns=(time.time_ns(), stat.st_mtime_ns))
+
+
+class MovieJobs():
+    """
+    Tub movies rendered in the background on a pool of MOVIE_WORKERS threads.
+
+    A movie which is being rendered is not queued a second time. After every render the least recently used
+    tub movies are evicted so they stay under MOVIE_DIR_QUOTA_MB. The progress of the latest MAX_PROGRESS
+    renders is kept in memory.
+    """
+    MAX_PROGRESS = 50
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.executor = None
+        self.progress = {}
+
+    def get_executor(self):
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=max(1, settings.MOVIE_WORKERS),
+                                               thread_name_prefix='movie')
+        return self.executor
+
+    def submit(self, tub_name, render):
+        """
+        Queue render(progress) for the movie of tub_name and return its progress. A movie which is queued or
+        rendering is not queued again. A failed render is returned once, to report its error, and queued again by
+        the next submit.
+        """
+        with self.lock:
+            progress = self.progress.get(tub_name)
+            if progress is not None and progress.stage in ('queued', 'rendering'):
+                return progress
+            if progress is not None and progress.stage == 'failed':
+                del self.progress[tub_name]
+                return progress
+
+            progress = MovieProgress(tub_name)
+            self.progress.pop(tub_name, None)
+            self.progress[tub_name] = progress
+            while len(self.progress) > self.MAX_PROGRESS:
+                self.progress.pop(next(iter(self.progress)))
+            self.get_executor().submit(self.run, tub_name, progress, render)
+        return progress
+
+    def run(self, tub_name, progress, render):
+        try:
+            movie_path = render(progress)
+        except Exception as e:
+            logger.error(f"Failed to render the movie of {tub_name}: {e}")
+            progress.update(stage='failed', error=str(e))
+            return
+
+        progress.update(stage='done')
+        try:
+            evict_movies(Path(movie_path).parent, settings.MOVIE_DIR_QUOTA_MB * 1024 * 1024, keep=[movie_path])
+        except OSError as e:
+            logger.error(f"Failed to evict movies: {e}")
+
+    def get_progress(self, tub_name):
+        with self.lock:
+            progress = self.progress.get(tub_name)
+        return progress.to_dict() if progress is not None else None
+
+
+movie_jobs = MovieJobs()
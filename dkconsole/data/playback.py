@@ -0,0 +1,171 @@
+import json
+import logging
+import threading
+import time
+from pathlib import Path
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+BOUNDARY = 'frame'
+CONTENT_TYPE = f'multipart/x-mixed-replace; boundary={BOUNDARY}'
+# frame rate when the records have no timestamp, the default DRIVE_LOOP_HZ of donkeycar
+DEFAULT_FPS = 20
+# pauses in the recording longer than this are played as this many seconds
+MAX_FRAME_GAP = 0.5
+
+
+class PlaybackNotSupported(Exception):
+    pass
+
+
+class PlaybackBusy(Exception):
+    pass
+
+
+class PlaybackSlots():
+    """
+    Caps the playbacks streamed at the same time to PLAYBACK_MAX_STREAMS. A playback holds a server thread for as
+    long as it plays, so without a cap a few open players would leave no thread for the other requests.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.active = 0
+
+    def stream(self, parts):
+        """
+        Wrap the parts of a playback in a PlaybackStream holding one slot, PlaybackBusy when none is free
+        """
+        with self.lock:
+            if self.active >= settings.PLAYBACK_MAX_STREAMS:
+                raise PlaybackBusy(f"{self.active} playbacks are streaming already, try again later")
+            self.active += 1
+        return PlaybackStream(parts, self)
+
+    def release(self):
+        with self.lock:
+            self.active -= 1
+
+
+class PlaybackStream():
+    """
+    Iterator over the parts of a playback which gives its slot back once exhausted or closed. Django closes the
+    response when the client goes away, also when the stream was never started, which a generator would not notice.
+    """
+
+    def __init__(self, parts, slots):
+        self.parts = parts
+        self.slots = slots
+        self.closed = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            return next(self.parts)
+        except StopIteration:
+            self.close()
+            raise
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        if hasattr(self.parts, 'close'):
+            self.parts.close()
+        self.slots.release()
+
+
+def get_catalog_start(tub_path, catalog):
+    """
+    (first record index, byte length of each line) of a catalog, from its .catalog_manifest
+    """
+    try:
+        with open(Path(tub_path) / f"{catalog}_manifest") as f:
+            manifest = json.load(f)
+        return manifest.get('start_index', 0), manifest.get('line_lengths', [])
+    except (OSError, ValueError):
+        return 0, []
+
+
+def iter_records(tub_path, manifest, start=0, end=None):
+    """
+    Records of a v2 tub in record order from index start to end (excluded), read lazily, without the deleted ones.
+
+    Catalogs before start are skipped with their .catalog_manifest and the catalog holding start is entered with a
+    seek, so a seek costs the same anywhere in the tub.
+    """
+    tub_path = Path(tub_path)
+    catalog_metadata = manifest['catalog_metadata']
+    deleted = set(catalog_metadata.get('deleted_indexes', []))
+    catalogs = [(catalog, *get_catalog_start(tub_path, catalog)) for catalog in catalog_metadata.get('paths', [])]
+
+    for i, (catalog, start_index, line_lengths) in enumerate(catalogs):
+        if end is not None and start_index >= end:
+            return
+        if i + 1 < len(catalogs) and catalogs[i + 1][1] <= start:
+            continue
+
+        skip = min(max(0, start - start_index), len(line_lengths))
+        try:
+            f = open(tub_path / catalog, 'rb')
+        except FileNotFoundError:
+            continue
+        with f:
+            f.seek(sum(line_lengths[:skip]))
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # the last line of a catalog being written
+                    break
+                index = record.get('_index', -1)
+                if index < start or index in deleted:
+                    continue
+                if end is not None and index >= end:
+                    return
+                yield record
+
+
+def iter_mjpeg(tub_path, records, image_key, rate=1.0, sleep=time.sleep, clock=time.monotonic):
+    """
+    multipart/x-mixed-replace parts of the images of records, paced by their timestamps played at rate times the
+    recording speed. The JPEG files are sent as they are, without decoding them.
+    """
+    images_path = Path(tub_path) / 'images'
+    started = None
+    position = 0.0
+    last_timestamp = None
+
+    for record in records:
+        image_name = record.get(image_key)
+        if not image_name:
+            continue
+        try:
+            with open(images_path / image_name, 'rb') as f:
+                image = f.read()
+        except FileNotFoundError:
+            logger.warning(f"Missing image {image_name} in {tub_path}")
+            continue
+
+        timestamp = record.get('_timestamp_ms')
+        if started is None:
+            started = clock()
+        elif timestamp is not None and last_timestamp is not None:
+            position += min(max(0, timestamp - last_timestamp) / 1000, MAX_FRAME_GAP) / rate
+        else:
+            position += 1 / DEFAULT_FPS / rate
+        last_timestamp = timestamp
+
+        delay = started + position - clock()
+        if delay > 0:
+            sleep(delay)
+
+        yield (f"--{BOUNDARY}\r\nContent-Type: image/jpeg\r\nContent-Length: {len(image)}\r\n"
+               f"X-Record-Index: {record.get('_index')}\r\n\r\n").encode() + image + b"\r\n"
+
+
+playback_slots = PlaybackSlots()
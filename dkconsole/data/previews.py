@@ -0,0 +1,58 @@
+import threading
+
+
+def spread_positions(n, k):
+    """
+    k positions evenly spaced over range(n), first and last included. Fewer than k when n < k.
+    """
+    if n <= k:
+        return list(range(n))
+    if k == 1:
+        return [0]
+    return [round(i * (n - 1) / (k - 1)) for i in range(k)]
+
+
+def sample_record_indexes(current_index, deleted_indexes, k):
+    """
+    Pick k evenly spaced live record indexes of a datastore v2 tub, without reading its catalogs.
+
+    Records are numbered 0 .. current_index - 1 and deleted records are only flagged in the manifest, so the j-th
+    live record is found by skipping over the sorted deleted indexes. This is O(k + len(deleted_indexes)).
+    """
+    deleted = sorted(index for index in deleted_indexes if 0 <= index < current_index)
+    positions = spread_positions(current_index - len(deleted), k)
+
+    indexes = []
+    skipped = 0
+    for position in positions:
+        index = position + skipped
+        while skipped < len(deleted) and deleted[skipped] <= index:
+            skipped += 1
+            index = position + skipped
+        indexes.append(index)
+    return indexes
+
+
+class PreviewCache():
+    """
+    Sampled record indexes per tub, valid as long as the manifest of the tub is unchanged.
+
+    Deleting or restoring records rewrites the manifest, so the entries are keyed on the manifest mtime together
+    with current_index and the number of deleted indexes, which keeps a lookup O(1) however many records are deleted.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = {}
+
+    def get_record_indexes(self, tub_path, current_index, deleted_indexes, k, manifest_mtime_ns):
+        key = (current_index, len(deleted_indexes), k, manifest_mtime_ns)
+        with self.lock:
+            entry = self.entries.get(str(tub_path))
+        if entry is not None and entry[0] == key:
+            return entry[1]
+
+        indexes = sample_record_indexes(current_index, deleted_indexes, k)
+        with self.lock:
+            self.entries[str(tub_path)] = (key, indexes)
+        return indexes
@@ -1,5 +1,9 @@
 from rest_framework import serializers
 
+from dkconsole.data.archive import COMPRESSIONS
+from dkconsole.data.image_cache import ImageCache
+from dkconsole.data.tub_query import SORT_FIELDS
+
 
 class TubImageSerializer(serializers.Serializer):
     name = serializers.CharField(max_length=512)
@@ -35,3 +39,39 @@ class UploadTubSerializer(serializers.Serializer):
     # tub_paths = serializers.CharField(required=True, max_length=1000)
     tub_names = serializers.ListField(
         child=serializers.CharField(required=True, max_length=100), allow_empty=False)
+
+
+class TubQuerySerializer(serializers.Serializer):
+    """
+    query parameters of the tub listing
+    """
+    sort = serializers.ChoiceField(choices=SORT_FIELDS, default='created_at')
+    order = serializers.ChoiceField(choices=['asc', 'desc'], default='desc')
+    min_images = serializers.IntegerField(min_value=0, default=0)
+    name_prefix = serializers.CharField(max_length=100, required=False)
+
+
+class ImageQuerySerializer(serializers.Serializer):
+    """
+    query parameters of the tub image endpoint
+    """
+    w = serializers.IntegerField(min_value=1, required=False)
+    # not named format, DRF reserves that query parameter for content negotiation
+    fmt = serializers.ChoiceField(choices=list(ImageCache.FORMATS), default='jpeg')
+
+
+class ArchiveQuerySerializer(serializers.Serializer):
+    """
+    query parameters of the tub archive endpoint
+    """
+    compression = serializers.ChoiceField(choices=list(COMPRESSIONS), default='gz')
+    compresslevel = serializers.IntegerField(min_value=1, max_value=9, required=False)
+
+
+class PlaybackQuerySerializer(serializers.Serializer):
+    """
+    query parameters of the tub playback endpoint
+    """
+    start = serializers.IntegerField(min_value=0, default=0)
+    end = serializers.IntegerField(min_value=0, required=False)
+    rate = serializers.FloatField(min_value=0.1, max_value=16, default=1.0)
@@ -2,11 +2,8 @@ import errno
 import json
 import logging
 import os
-import random
 import shutil
 import subprocess
-import tarfile
-import tempfile
 from datetime import datetime
 from pathlib import Path
 
@@ -14,12 +11,47 @@ from PIL import Image
 from django.conf import settings
 from django.utils.timezone import make_aware
 
+from dkconsole.data.archive import iter_tub_archive, write_tub_archive
+from dkconsole.data.histogram_jobs import histogram_jobs, EmptyTubError, HistogramNotSupported
 from dkconsole.data.models import Meta, Tub, TubImage
+from dkconsole.data.movie_jobs import movie_jobs, get_temp_path, render_movie, touch_movie, MovieProgress
+from dkconsole.data.playback import PlaybackNotSupported
+from dkconsole.data.previews import spread_positions
+from dkconsole.data.tub_index import get_mtimes
+from dkconsole.data.tub_query import query_tubs
 
 logger = logging.getLogger(__name__)
 
 
+class TubScan():
+    """
+    Result of a single listing of a v3 tub folder
+    """
+
+    def __init__(self, jpgs, size):
+        """
+        jpgs - jpg names sorted by record index
+        size - size of the tub folder in MB
+        """
+        self.jpgs = jpgs
+        self.size = size
+
+    @property
+    def no_of_images(self):
+        return len(self.jpgs)
+
+    @property
+    def thumbnail_name(self):
+        if len(self.jpgs) != 0:
+            return self.jpgs[0]
+        else:
+            return None
+
+
 class TubService:
+    PREVIEW_COUNT = 5
+    histogram_jobs = histogram_jobs
+    movie_jobs = movie_jobs
 
     @classmethod
     def data_dir(cls):
@@ -48,36 +80,22 @@ class TubService:
             tub_path = Path(tub_path)
 
         meta_json_path = cls.get_meta_json_path(tub_path)
-        first_jpg_name = cls.get_thumbnail_name(tub_path)
-        width, height = cls.get_image_resolution(tub_path)
+        scan = cls.scan_tub(tub_path)
+        first_jpg_name = scan.thumbnail_name
+        width, height = cls.get_image_resolution(tub_path, first_jpg_name)
 
         with open(meta_json_path) as f:
             meta = json.load(f)
 
         created_at = make_aware(datetime.fromtimestamp(meta['start']))
 
-        if 'size' in meta:
-            size = meta['size']
-        else:
-            size = cls.get_size(tub_path)
-            cls.update_meta(tub_path.name, {"size": size})
-
-        # if 'no_of_images' in meta:
-        if False:
-            no_of_images = meta['no_of_images']
-        else:
-            no_of_images = cls.get_jpg_file_count_on_disk(tub_path)
-            cls.update_meta(tub_path.name, {"no_of_images": no_of_images})
-
-        jpgs = []
-        for f in os.listdir(tub_path):
-            if f.endswith('.jpg'):
-                jpgs.append(f)
+        # The folder is listed anyway, so size and no_of_images are always fresh
+        size = scan.size
+        no_of_images = scan.no_of_images
+        if meta.get('size') != size or meta.get('no_of_images') != no_of_images:
+            cls.update_meta(tub_path.name, {"size": size, "no_of_images": no_of_images})
 
-        if len(jpgs) > 0:
-            previews = random.sample(jpgs, 5)
-        else:
-            previews = []
+        previews = [scan.jpgs[i] for i in spread_positions(len(scan.jpgs), cls.PREVIEW_COUNT)]
 
         if 'rating' in meta:
             rating = meta['rating']
@@ -88,50 +106,83 @@ class TubService:
 
         return Tub(tub_path.name, tub_path, created_at, no_of_images, tub_image, size, rating, previews)
 
+    @classmethod
+    def scan_tub(cls, tub_path):
+        """
+        List the tub folder once. v3 tubs keep records and images side by side, so a single pass gives the jpgs,
+        their count, the tub size and the thumbnail.
+        """
+        jpgs = []
+        total_size = 0
+
+        with os.scandir(tub_path) as it:
+            for entry in it:
+                total_size += entry.stat(follow_symlinks=False).st_size
+                if entry.name.endswith('.jpg'):
+                    jpgs.append(entry.name)
+
+        jpgs.sort(key=cls.get_jpg_index)
+
+        return TubScan(jpgs, round(total_size / 1024 / 1024, 2))
+
+    @classmethod
+    def get_jpg_index(cls, jpg_name):
+        """
+        e.g. 12_cam-image_array_.jpg is record 12
+        """
+        return int(jpg_name.split('_')[0])
+
     @classmethod
     def get_size(cls, tub_path):
-        total_size = 0.0
-        for filename in Path(tub_path).iterdir():
-            total_size += os.path.getsize(filename)
-        total_size = total_size / 1024 / 1024
-        return round(total_size, 2)
+        return cls.scan_tub(tub_path).size
 
     @classmethod
-    def get_tubs(cls):
-        tubs = []
+    def get_tub_signature(cls, tub_path):
+        """
+        v3 tubs write records and images straight into the tub folder, so the folder mtime covers new records
+        """
+        return get_mtimes([tub_path, cls.get_meta_json_path(tub_path)])
 
-        for child in Path(cls.data_dir()).iterdir():
-            if child.is_dir():
-                try:
-                    tub = cls.get_tub(child)
-                    tubs.append(tub)
-                except Exception as e:
-                    print(e)
-                    pass
+    @classmethod
+    def get_created_at(cls, tub_path):
+        with open(cls.get_meta_json_path(Path(tub_path))) as f:
+            meta = json.load(f)
+        return meta['start']
 
-        tubs.sort(key=lambda x: x.created_at, reverse=True)
+    @classmethod
+    def get_tubs(cls, sort='created_at', reverse=True, name_prefix=None, min_images=0):
+        return list(cls.query_tubs(sort, reverse, name_prefix, min_images))
 
-        return tubs
+    @classmethod
+    def query_tubs(cls, sort='created_at', reverse=True, name_prefix=None, min_images=0):
+        """
+        Same as get_tubs, but tubs are only scanned when they are accessed. Used by the paginated listing.
+        """
+        return query_tubs(cls, sort, reverse, name_prefix, min_images)
 
     @classmethod
     def get_jpg_file_count_on_disk(cls, tub_path):
         logger.debug(f"get_jpg_file_count_on_disk {tub_path}")
-        return len([f for f in os.listdir(tub_path) if f.endswith('.jpg')])
+        return cls.scan_tub(tub_path).no_of_images
 
     @classmethod
     def generate_tub_archive(cls, tub_paths):
         print("generating tub archive")
-        f = tempfile.NamedTemporaryFile(mode='w+b', suffix='.tar.gz', delete=False)
-
-        with tarfile.open(fileobj=f, mode='w:gz') as tar:
-            for tub_path in tub_paths:
-                p = Path(tub_path)
-                tar.add(p, arcname=p.name)
-            tar.add(f"{settings.CARAPP_PATH}/myconfig.py", arcname="myconfig.py")
+        return write_tub_archive(tub_paths, cls.get_archive_extra_files())
 
-        f.close()
+    @classmethod
+    def stream_tub_archive(cls, tub_paths, add_config_file=True, compression='gz', compresslevel=None):
+        """
+        Same archive as generate_tub_archive, generated as a stream of chunks while the tar is being built
+        """
+        return iter_tub_archive(tub_paths, cls.get_archive_extra_files(add_config_file), compression, compresslevel)
 
-        return f.name
+    @classmethod
+    def get_archive_extra_files(cls, add_config_file=True):
+        config_path = Path(settings.CARAPP_PATH) / "myconfig.py"
+        if add_config_file and config_path.exists():
+            return [(config_path, "myconfig.py")]
+        return []
 
     @classmethod
     def delete_tub(cls, tub_path):
@@ -142,24 +193,16 @@ class TubService:
 
     @classmethod
     def get_thumbnail_name(cls, tub_path):
-        jpgs = []
-
-        for f in os.listdir(tub_path):
-            if f.endswith('.jpg'):
-                jpgs.append(f)
-
-        jpgs = sorted(jpgs, key=lambda d: int(d.split('_')[0]))
-
-        if len(jpgs) != 0:
-            return jpgs[0]
-        else:
-            return None
+        return cls.scan_tub(tub_path).thumbnail_name
 
     @classmethod
-    def get_image_resolution(cls, tub_path):
-        if cls.get_thumbnail_name(tub_path) is not None:
-            image = Image.open(Path(tub_path / cls.get_thumbnail_name(tub_path)))
-            return image.size
+    def get_image_resolution(cls, tub_path, thumbnail_name=None):
+        if thumbnail_name is None:
+            thumbnail_name = cls.get_thumbnail_name(tub_path)
+
+        if thumbnail_name is not None:
+            with Image.open(Path(tub_path) / thumbnail_name) as image:
+                return image.size
         else:
             width = 0
             heigh = 0
@@ -172,33 +215,85 @@ class TubService:
                 shutil.rmtree(tub.path)
 
     @classmethod
-    def gen_movie(cls, tub_name):
+    def get_movie_path(cls, tub_name):
+        return Path(settings.MOVIE_DIR) / f"{tub_name}.mp4"
+
+    @classmethod
+    def gen_movie(cls, tub_name, progress=None):
+        """
+        Render the movie of the tub with donkey makemovie unless it exists. It is written to a temporary file renamed
+        once complete, so an existing movie is always a complete one.
+        """
         tub_path = Path(settings.DATA_DIR) / tub_name
+        os.makedirs(settings.MOVIE_DIR, exist_ok=True)
+
+        movie_path = cls.get_movie_path(tub_name)
+        if movie_path.exists():
+            return movie_path
+
+        command = [f'{settings.VENV_PATH}/donkey', 'makemovie', f'--tub={tub_path}',
+                   f'--out={get_temp_path(movie_path)}']
+        logger.debug(f"command  = {' '.join(command)}")
+        return render_movie(command, movie_path, progress or MovieProgress(tub_name), cwd=settings.CARAPP_PATH)
+
+    @classmethod
+    def get_movie(cls, tub_name):
+        """
+        (movie path, None) when the movie of the tub is rendered. Otherwise the movie is rendered in the background
+        and (None, progress) is returned.
+        """
+        movie_path = cls.get_movie_path(tub_name)
+        try:
+            touch_movie(movie_path)
+            return movie_path, None
+        except FileNotFoundError:
+            pass
+
+        progress = cls.movie_jobs.submit(tub_name, lambda progress: cls.gen_movie(tub_name, progress))
+        return None, progress.to_dict()
 
-        # Create movie directory if not exists
-        if not os.path.exists(settings.MOVIE_DIR):
-            os.mkdir(settings.MOVIE_DIR)
+    @classmethod
+    def get_movie_progress(cls, tub_name):
+        return cls.movie_jobs.get_progress(tub_name)
+
+    @classmethod
+    def stream_playback(cls, tub_name, start=0, end=None, rate=1.0):
+        raise PlaybackNotSupported("playback needs a v2 tub")
 
-        videoPath = Path(settings.MOVIE_DIR) / f"{tub_name}.mp4"
-        if not os.path.exists(videoPath):
-            command = [f'{settings.VENV_PATH}/donkey', 'makemovie', f'--tub={tub_path}', f'--out={videoPath}']
-            subprocess.check_output(command, cwd=settings.CARAPP_PATH)
-            return videoPath
-        return videoPath
+    @classmethod
+    def get_histogram_path(cls, tub_path, format='png'):
+        return Path(tub_path) / (os.path.basename(tub_path) + f"_hist.{format}")
 
     @classmethod
     def gen_histogram(cls, tub_path):
         if cls.get_jpg_file_count_on_disk(tub_path) == 0:
-            raise Exception("empty tub")
-
-        histogram_name = os.path.basename(tub_path) + "_hist.png"
-        histogram_path = tub_path / histogram_name
-        if not os.path.exists(histogram_path):
-            command = [f'{settings.VENV_PATH}/donkey', 'tubhist', f'--tub={tub_path}', f'--out={histogram_path}']
-            subprocess.check_output(command, cwd=settings.CARAPP_PATH)
-            return histogram_path
+            raise EmptyTubError("empty tub")
+
+        histogram_path = cls.get_histogram_path(tub_path)
+        # written under another name and renamed, so a half written histogram is never served
+        temp_path = histogram_path.with_name(histogram_path.stem + ".part.png")
+        command = [f'{settings.VENV_PATH}/donkey', 'tubhist', f'--tub={tub_path}', f'--out={temp_path}']
+        try:
+            subprocess.check_output(command, cwd=settings.CARAPP_PATH, timeout=settings.HISTOGRAM_TIMEOUT)
+            os.replace(temp_path, histogram_path)
+            # the rename changed the mtime of the tub folder, which get_histogram compares the histogram with
+            os.utime(histogram_path)
+        finally:
+            if temp_path.exists():
+                os.remove(temp_path)
         return histogram_path
 
+    @classmethod
+    def get_histogram(cls, tub_path, format='png'):
+        """
+        Path of the histogram of the tub, None while it is being generated in the background.
+        v1 tubs have no manifest: the histogram is generated again when the tub folder changed, which is when records
+        were added or deleted. They only have a png histogram, drawn by donkey tubhist.
+        """
+        if format != 'png':
+            raise HistogramNotSupported(f"{format} histograms need a v2 tub")
+        return cls.histogram_jobs.get(cls.get_histogram_path(tub_path), [tub_path], lambda: cls.gen_histogram(tub_path))
+
     @classmethod
     def get_detail(cls, tub_name):
         raise Exception("get_detail no longer supported. Use get_tub_by_name")
@@ -0,0 +1,147 @@
+import gzip
+import io
+import os
+import tarfile
+import unittest
+import zlib
+from pathlib import Path
+
+from django.core.management import call_command
+from django.test import Client
+from django.urls import reverse
+from rest_framework import status
+
+from .archive import iter_tub_archive, write_tub_archive, ParallelGzipWriter, ChunkBuffer, CODECS, benchmark_codecs
+from .dedup_upload import IMAGE_HASHES_FILE
+from .testing import create_tub
+from ..testing import TempDirTestCase
+
+
+class TestArchive(TempDirTestCase):
+
+    def setUp(self):
+        self.data_dir = self.mkdtemp()
+        self.tub_name = "tub_1_21-01-01"
+        self.tub_path = self.data_dir / self.tub_name
+        create_tub(self.tub_path, 20)
+
+        self.config_path = self.data_dir / "myconfig.py"
+        with open(self.config_path, "w") as f:
+            f.write("DRIVE_LOOP_HZ = 20\n")
+
+        self.override_settings(DATA_DIR=self.data_dir, TUB_ARCHIVE_CHUNK_SIZE=1024)
+
+    def expected_names(self):
+        names = {self.tub_name}
+        for path in self.tub_path.rglob("*"):
+            names.add(str(path.relative_to(self.data_dir)))
+        return names
+
+    def test_iter_tub_archive_gz(self):
+        data = b"".join(iter_tub_archive([self.tub_path], [(self.config_path, "myconfig.py")]))
+
+        with tarfile.open(fileobj=io.BytesIO(data), mode="r:gz") as tar:
+            names = set(tar.getnames())
+            assert names == self.expected_names() | {"myconfig.py"}
+            assert tar.extractfile("myconfig.py").read() == b"DRIVE_LOOP_HZ = 20\n"
+
+    def test_iter_tub_archive_no_compression(self):
+        chunks = list(iter_tub_archive([self.tub_path], compression='none'))
+        # handed out while the tar is built, not in one piece at the end
+        assert len(chunks) > 1
+        data = b"".join(chunks)
+
+        with tarfile.open(fileobj=io.BytesIO(data), mode="r:") as tar:
+            assert set(tar.getnames()) == self.expected_names()
+            member = tar.extractfile(f"{self.tub_name}/images/0_cam_image_array_.jpg")
+            assert member.read() == (self.tub_path / "images" / "0_cam_image_array_.jpg").read_bytes()
+
+    def test_image_hashes_are_not_archived(self):
+        expected_names = self.expected_names()
+        (self.tub_path / IMAGE_HASHES_FILE).write_text("{}")
+
+        with tarfile.open(fileobj=io.BytesIO(b"".join(iter_tub_archive([self.tub_path]))), mode="r:gz") as tar:
+            assert set(tar.getnames()) == expected_names
+
+    def test_write_tub_archive(self):
+        archive_path = Path(write_tub_archive([self.tub_path]))
+        try:
+            with tarfile.open(archive_path, mode="r:gz") as tar:
+                assert set(tar.getnames()) == self.expected_names()
+        finally:
+            archive_path.unlink()
+
+    def test_parallel_gzip_writer(self):
+        data = os.urandom(50000) + b"donkey" * 100000
+        buffer = ChunkBuffer()
+        with ParallelGzipWriter(buffer, compresslevel=6, workers=3, block_size=16 * 1024) as writer:
+            for i in range(0, len(data), 10000):
+                writer.write(data[i:i + 10000])
+        compressed = buffer.pop()
+
+        assert gzip.decompress(compressed) == data
+        # one gzip member, readable by plain zlib as well
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        assert decompressor.decompress(compressed) == data
+        assert decompressor.eof and decompressor.unused_data == b""
+        assert len(compressed) < len(data) / 2
+
+    def test_iter_tub_archive_pgz(self):
+        data = b"".join(iter_tub_archive([self.tub_path], compression='pgz'))
+
+        with tarfile.open(fileobj=io.BytesIO(data), mode="r:gz") as tar:
+            assert set(tar.getnames()) == self.expected_names()
+            member = tar.extractfile(f"{self.tub_name}/images/3_cam_image_array_.jpg")
+            assert member.read() == (self.tub_path / "images" / "3_cam_image_array_.jpg").read_bytes()
+
+    @unittest.skipUnless('zst' in CODECS, "zstandard is not installed")
+    def test_iter_tub_archive_zst(self):
+        import zstandard
+
+        data = b"".join(iter_tub_archive([self.tub_path], compression='zst'))
+
+        tar_data = zstandard.ZstdDecompressor().stream_reader(io.BytesIO(data)).read()
+        with tarfile.open(fileobj=io.BytesIO(tar_data), mode="r:") as tar:
+            assert set(tar.getnames()) == self.expected_names()
+
+    def test_benchmark_codecs(self):
+        results = benchmark_codecs([self.tub_path], ['none', 'pgz'])
+
+        assert [result['compression'] for result in results] == ['none', 'pgz']
+        assert results[0]['ratio'] == 1
+        assert results[1]['size'] < results[0]['size']
+
+        out = io.StringIO()
+        call_command('benchmark_archive', self.tub_name, compression=['gz'], stdout=out)
+        assert "gz" in out.getvalue()
+
+    def test_tub_archive_view_pgz(self):
+        client = Client()
+
+        response = client.get(reverse('data:tub_archive', kwargs={'tub_name': self.tub_name}),
+                              {'compression': 'pgz'})
+
+        assert response.status_code == status.HTTP_200_OK
+        assert response['Content-Type'] == "application/gzip"
+        assert response['Content-Disposition'] == f"inline; filename={self.tub_name}.tar.gz"
+        with tarfile.open(fileobj=io.BytesIO(b"".join(response.streaming_content)), mode="r:gz") as tar:
+            assert f"{self.tub_name}/manifest.json" in tar.getnames()
+
+    def test_tub_archive_view(self):
+        client = Client()
+
+        response = client.get(reverse('data:tub_archive', kwargs={'tub_name': self.tub_name}),
+                              {'compression': 'none'})
+
+        assert response.status_code == status.HTTP_200_OK
+        assert response.streaming
+        assert response['Content-Disposition'] == f"inline; filename={self.tub_name}.tar"
+        with tarfile.open(fileobj=io.BytesIO(b"".join(response.streaming_content)), mode="r:") as tar:
+            assert f"{self.tub_name}/manifest.json" in tar.getnames()
+
+    def test_tub_archive_view_not_found(self):
+        client = Client()
+
+        response = client.get(reverse('data:tub_archive', kwargs={'tub_name': 'no_such_tub'}))
+
+        assert response.status_code == status.HTTP_404_NOT_FOUND
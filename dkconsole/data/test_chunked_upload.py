@@ -0,0 +1,92 @@
+import io
+import json
+import tarfile
+from pathlib import Path
+from unittest.mock import patch
+
+from django.test import override_settings
+
+from .chunked_upload import UploadJournal
+from .data_service_v2 import TubServiceV2
+from .testing import create_tub
+from ..testing import TempDirTestCase
+
+
+class TestChunkedUpload(TempDirTestCase):
+
+    def setUp(self):
+        self.data_dir = self.mkdtemp()
+        self.upload_dir = self.mkdtemp()
+        self.tub_name = "tub_1_21-01-01"
+        create_tub(self.data_dir / self.tub_name, 40)
+        with open(self.data_dir / self.tub_name / "meta.json", "w") as f:
+            json.dump({"no_of_images": 40}, f)
+
+        self.override_settings(DATA_DIR=self.data_dir, UPLOAD_DIR=self.upload_dir, HQ_UPLOAD_PART_SIZE=512,
+                               HQ_UPLOAD_DEDUP=False)
+
+        self.hq = self.start_hq()
+        self.start_patches(
+            patch.object(TubServiceV2, 'UPLOAD_SESSIONS_URL', self.hq.url('/data/upload_sessions')),
+            patch.object(TubServiceV2, 'UPLOAD_TUB_URL', self.hq.url('/data/upload_tub')),
+            patch.object(TubServiceV2.vehicle_service, 'get_wlan_mac_address', return_value="device"),
+        )
+
+    def part_puts(self):
+        return [path for method, path in self.hq.requests if method == 'PUT']
+
+    def assert_uploaded(self):
+        with tarfile.open(fileobj=io.BytesIO(self.hq.archives[self.tub_name]), mode="r:gz") as tar:
+            assert f"{self.tub_name}/manifest.json" in tar.getnames()
+        assert TubServiceV2.check_uuid_exist(self.tub_name)
+        # archive and journal are cleaned up
+        assert list(self.upload_dir.iterdir()) == []
+
+    def test_upload(self):
+        fail, success = TubServiceV2.upload_to_hq({'tub_names': [self.tub_name]})
+
+        assert fail == [] and success == [self.tub_name]
+        assert len(self.part_puts()) > 1
+        self.assert_uploaded()
+
+    def test_falls_back_to_single_post(self):
+        self.hq.upload_sessions = False
+
+        fail, success = TubServiceV2.upload_to_hq({'tub_names': [self.tub_name]})
+
+        assert fail == [] and success == [self.tub_name]
+        assert ('POST', '/data/upload_tub') in self.hq.requests
+        assert self.part_puts() == []
+        self.assert_uploaded()
+
+    def test_interrupted_upload_resumes(self):
+        self.hq.fail_parts = {2}
+
+        fail, success = TubServiceV2.upload_to_hq({'tub_names': [self.tub_name]})
+
+        assert fail == [self.tub_name]
+        entry = UploadJournal(self.tub_name).load()
+        assert entry['acked_parts'] == [0, 1]
+        assert Path(entry['archive_path']).exists()
+        no_of_parts = len(entry['part_checksums'])
+
+        self.hq.requests.clear()
+        fail, success = TubServiceV2.upload_to_hq({'tub_names': [self.tub_name]})
+
+        assert success == [self.tub_name]
+        # only the parts HQ did not acknowledge are sent again
+        assert len(self.part_puts()) == no_of_parts - 2
+        assert not self.part_puts()[0].endswith("/parts/0")
+        self.assert_uploaded()
+
+    def test_changed_tub_restarts_upload(self):
+        self.hq.fail_parts = {1}
+        TubServiceV2.upload_to_hq({'tub_names': [self.tub_name]})
+        first_entry = UploadJournal(self.tub_name).load()
+
+        create_tub(self.data_dir / self.tub_name, 5)  # more records, new manifest
+        fail, success = TubServiceV2.upload_to_hq({'tub_names': [self.tub_name]})
+
+        assert success == [self.tub_name]
+        assert not Path(first_entry['archive_path']).exists()
+        self.assert_uploaded()
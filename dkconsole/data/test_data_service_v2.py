@@ -12,7 +12,11 @@ import tarfile
 from datetime import datetime
 from django.utils.timezone import make_aware
 from donkeycar.parts.tub_v2 import Tub
-from dkconsole.data.data_service_v2 import TubServiceV2
+from dkconsole.data.data_service_v2 import TubServiceV2, TubView
+from dkconsole.data.testing import create_tub
+from dkconsole.testing import TempDirTestCase
+import json
+import numpy as np
 
 import shutil
 
@@ -20,16 +24,17 @@ import shutil
 # Create your tests here.
 
 
-class TestDataService(TestCase):
+class TestDataService(TempDirTestCase):
 
     def setUp(self):
-        self.data_dir = settings.DATA_DIR
+        self.fixture_data_dir = settings.DATA_DIR
+        self.data_dir = self.copy_fixture_data()
         self.tub_name = "tub_26_21-07-02"
         self.tub_path = self.data_dir / self.tub_name
 
         self.tub = Tub(self.tub_path)
 
-        self.temp_path = tempfile.mkdtemp()
+        self.temp_path = str(self.mkdtemp())
         self.temp_tub = Tub(self.temp_path)
 
         self.tub_service = TubServiceV2
@@ -37,7 +42,7 @@ class TestDataService(TestCase):
         # print(f"self.data_dir = ${self.data_dir}")
 
     def test_tub_path(self):
-        assert settings.DATA_DIR == settings.ROOT_DIR / "dkconsole" / "mycar4_test" / "data"
+        assert self.fixture_data_dir == settings.ROOT_DIR / "dkconsole" / "mycar4_test" / "data"
 
     def test_read_existing_tub(self):
 
@@ -107,6 +112,83 @@ class TestDataService(TestCase):
             self.tub_service.update_meta(self.tub_name, update_meta)
             assert mock_method.call_count == 0
 
-    def tearDown(self):
-        shutil.rmtree(self.temp_path)
-        pass
\ No newline at end of file
+
+class TestTubSize(TempDirTestCase):
+
+    def setUp(self):
+        self.data_dir = self.mkdtemp()
+        self.tub_name = "tub_1_21-01-01"
+        self.tub_path = self.data_dir / self.tub_name
+        create_tub(self.tub_path, 10)
+
+        self.override_settings(DATA_DIR=self.data_dir)
+
+    def walk_size(self):
+        total_size = 0
+        for dirpath, dirnames, filenames in os.walk(self.tub_path):
+            for filename in filenames:
+                total_size += os.path.getsize(os.path.join(dirpath, filename))
+        return round(total_size / 1024 / 1024, 2)
+
+    def test_get_size(self):
+        size = TubServiceV2.get_size(self.tub_path)
+        assert size == self.walk_size()
+
+        with open(self.tub_path / "meta.json") as f:
+            meta = json.load(f)
+        assert meta['size'] == size
+        assert meta['size_index'] == 10
+
+    def test_get_size_after_recording(self):
+        TubServiceV2.get_size(self.tub_path)
+
+        tub = Tub(str(self.tub_path))
+        for i in range(200):
+            tub.write_record({'cam/image_array': np.random.randint(0, 255, (120, 160, 3), dtype=np.uint8),
+                              'user/angle': 0.0, 'user/throttle': 0.0, 'user/mode': 'user'})
+        tub.close()
+
+        with patch.object(TubServiceV2, 'get_dir_size', wraps=TubServiceV2.get_dir_size) as mock_get_dir_size:
+            size = TubServiceV2.get_size(self.tub_path)
+            # only the top level of the tub is listed, new images are stat'ed by name
+            mock_get_dir_size.assert_called_once_with(self.tub_path)
+
+        assert size == self.walk_size()
+        with open(self.tub_path / "meta.json") as f:
+            assert json.load(f)['size_index'] == 210
+
+
+class TestTubView(TempDirTestCase):
+
+    def setUp(self):
+        self.data_dir = self.mkdtemp()
+        self.tub_path = self.data_dir / "tub_1_21-01-01"
+        create_tub(self.tub_path, 3, width=32, height=24)
+
+        self.override_settings(DATA_DIR=self.data_dir)
+
+    def test_tub_view(self):
+        with TubView(self.tub_path) as tub:
+            assert len(tub) == 3
+            assert tub.thumbnail_name == "0_cam_image_array_.jpg"
+            assert tub.image_resolution == (32, 24)
+
+    def test_get_tub_opens_tub_once(self):
+        with patch('dkconsole.data.data_service_v2.DKTubV2', wraps=Tub) as mock_tub:
+            tub = TubServiceV2.get_tub(self.tub_path)
+            assert mock_tub.call_count == 1
+
+        assert tub.no_of_images == 3
+        assert tub.thumbnail.name == "0_cam_image_array_.jpg"
+        assert (tub.thumbnail.width, tub.thumbnail.height) == (32, 24)
+        assert tub.previews == ["0_cam_image_array_.jpg", "1_cam_image_array_.jpg", "2_cam_image_array_.jpg"]
+
+    def test_get_previews_spread_over_tub(self):
+        shutil.rmtree(self.tub_path)
+        create_tub(self.tub_path, 101, deleted_indexes=[0, 1, 50])
+
+        tub = TubServiceV2.get_tub(self.tub_path)
+        assert tub.previews == ["2_cam_image_array_.jpg", "26_cam_image_array_.jpg", "51_cam_image_array_.jpg",
+                                "76_cam_image_array_.jpg", "100_cam_image_array_.jpg"]
+        for preview in tub.previews:
+            assert (self.tub_path / "images" / preview).is_file()
@@ -0,0 +1,125 @@
+import json
+import shutil
+from unittest.mock import patch
+
+from django.test import override_settings
+
+from . import dedup_upload
+from .data_service_v2 import TubServiceV2
+from .testing import create_tub
+from ..testing import TempDirTestCase
+
+
+class TestDedupUpload(TempDirTestCase):
+
+    def setUp(self):
+        self.data_dir = self.mkdtemp()
+        self.upload_dir = self.mkdtemp()
+        self.tub_name = "tub_1_21-01-01"
+        self.tub_path = self.data_dir / self.tub_name
+        create_tub(self.tub_path, 20)
+        self.write_meta(self.tub_path, {"no_of_images": 20})
+
+        self.override_settings(DATA_DIR=self.data_dir, UPLOAD_DIR=self.upload_dir, HQ_UPLOAD_DEDUP=True)
+
+        self.hq = self.start_hq()
+        self.start_patches(
+            patch.object(TubServiceV2, 'HQ_BASE_URL', self.hq.url('')),
+            patch.object(TubServiceV2, 'UPLOAD_SESSIONS_URL', self.hq.url('/data/upload_sessions')),
+            patch.object(TubServiceV2.vehicle_service, 'get_wlan_mac_address', return_value="device"),
+        )
+
+    def write_meta(self, tub_path, meta):
+        with open(tub_path / "meta.json", "w") as f:
+            json.dump(meta, f)
+
+    def blob_puts(self):
+        return [path for method, path in self.hq.requests if method == 'PUT' and path.startswith('/data/blobs/')]
+
+    def upload(self, tub_name):
+        fail, success = TubServiceV2.upload_to_hq({'tub_names': [tub_name]})
+        assert success == [tub_name]
+
+    def test_upload(self):
+        self.upload(self.tub_name)
+
+        files = self.hq.tubs[self.tub_name]
+        image_name = "images/0_cam_image_array_.jpg"
+        assert files[image_name] == (self.tub_path / image_name).read_bytes()
+        assert "manifest.json" in files
+        # the 20 frames of create_tub are all different
+        assert len(self.blob_puts()) >= 20
+        assert TubServiceV2.check_uuid_exist(self.tub_name)
+
+    def test_image_hashes_are_cached_in_tub(self):
+        hashes = TubServiceV2.get_image_hashes(self.tub_path)
+
+        with open(self.tub_path / dedup_upload.IMAGE_HASHES_FILE) as f:
+            assert len(json.load(f)) == 20
+        with open(self.tub_path / "meta.json") as f:
+            assert 'image_hashes' not in json.load(f)
+
+        with patch.object(dedup_upload, 'hash_file', wraps=dedup_upload.hash_file) as mock_hash_file:
+            assert TubServiceV2.get_image_hashes(self.tub_path) == hashes
+            mock_hash_file.assert_not_called()
+
+            create_tub(self.tub_path, 2)
+            TubServiceV2.get_image_hashes(self.tub_path)
+            assert mock_hash_file.call_count == 2
+
+    def test_copied_tub_is_not_sent_again(self):
+        self.upload(self.tub_name)
+
+        copy_name = "tub_2_21-01-02"
+        shutil.copytree(self.tub_path, self.data_dir / copy_name)
+        self.write_meta(self.data_dir / copy_name, {"no_of_images": 20})
+        self.hq.requests.clear()
+
+        self.upload(copy_name)
+
+        # same content as the first tub, down to meta.json, so nothing is sent
+        assert self.blob_puts() == []
+        assert self.hq.tubs[copy_name]["images/3_cam_image_array_.jpg"] == \
+            self.hq.tubs[self.tub_name]["images/3_cam_image_array_.jpg"]
+
+    def test_modified_tub_sends_delta(self):
+        self.upload(self.tub_name)
+
+        create_tub(self.tub_path, 3)
+        self.write_meta(self.tub_path, {"no_of_images": 23})
+        self.hq.requests.clear()
+
+        self.upload(self.tub_name)
+
+        sent = self.blob_puts()
+        # 3 new frames, at most the manifest, the catalogs and meta.json besides them
+        assert 3 <= len(sent) <= 3 + 5
+        # everything but the local hash cache
+        assert len(self.hq.tubs[self.tub_name]) == len([p for p in self.tub_path.rglob("*") if p.is_file()]) - 1
+        assert dedup_upload.IMAGE_HASHES_FILE not in self.hq.tubs[self.tub_name]
+
+    def test_falls_back_to_archive(self):
+        self.hq.dedup = False
+
+        self.upload(self.tub_name)
+
+        assert self.tub_name in self.hq.archives
+        assert self.blob_puts() == []
+
+    def test_falls_back_to_archive_when_negotiation_fails(self):
+        self.hq.get_missing_blobs = lambda handler, body: (500, {'error': 'database is down'})
+
+        self.upload(self.tub_name)
+
+        assert self.tub_name in self.hq.archives
+        assert self.blob_puts() == []
+
+    def test_unknown_missing_blob(self):
+        self.hq.get_missing_blobs = lambda handler, body: (200, {'missing': ["0" * 64]})
+
+        with self.assertRaisesRegex(dedup_upload.DedupNegotiationError, "blobs which are not in the tub: 0{64}"):
+            dedup_upload.DedupUploader(self.hq.url('')).upload(self.tub_path, {}, {})
+
+        self.upload(self.tub_name)
+        assert self.tub_name in self.hq.archives
+        assert self.blob_puts() == []
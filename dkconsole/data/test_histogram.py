@@ -0,0 +1,126 @@
+import json
+import os
+import time
+from unittest.mock import patch
+
+import numpy as np
+from PIL import Image
+from django.test import Client
+from django.test import override_settings
+from django.urls import reverse
+from rest_framework import status
+
+from .data_service_v2 import TubServiceV2
+from .histogram import compute_histograms, read_catalog, render_png
+from .histogram_jobs import EmptyTubError, HistogramJobs
+from .services import TubService
+from .testing import create_tub
+from ..testing import TempDirTestCase
+
+
+class TestHistogram(TempDirTestCase):
+
+    def setUp(self):
+        self.temp_dir = self.mkdtemp()
+        self.tub_path = self.temp_dir / "tub_1_21-01-01"
+        create_tub(self.tub_path, 42, deleted_indexes=[0, 1])
+
+    def test_compute_histograms(self):
+        result = compute_histograms(self.tub_path, TubServiceV2.read_manifest(self.tub_path), bins=21)
+
+        assert result['records'] == 40
+        angle = result['histograms']['user/angle']
+        assert (angle['min'], angle['max']) == (-1.0, 1.0)
+        # records 2..41 cycle through the 21 angles -1.0, -0.9, ... 1.0, the deleted ones are not counted
+        expected, _ = np.histogram([((i % 21) - 10) / 10 for i in range(2, 42)], bins=21, range=(-1, 1))
+        assert angle['counts'] == expected.tolist()
+        # the throttle is constant
+        assert sum(result['histograms']['user/throttle']['counts']) == 40
+        assert 'user/mode' not in result['histograms']
+
+    def test_partial_catalog_line(self):
+        catalog_path = self.tub_path / "catalog_0.catalog"
+        with open(catalog_path, "a") as f:
+            f.write('{"_index": 42, "user/an')
+
+        assert len(read_catalog(catalog_path)) == 42
+
+    def test_render_png(self):
+        result = compute_histograms(self.tub_path, TubServiceV2.read_manifest(self.tub_path))
+        render_png(result, self.temp_dir / "hist.png")
+
+        image = Image.open(self.temp_dir / "hist.png")
+        assert image.format == "PNG"
+        # one plot for the angle, one for the throttle
+        assert image.size == (480, 400)
+
+    def test_gen_histogram(self):
+        histogram_path = TubServiceV2.gen_histogram(self.tub_path)
+
+        assert histogram_path == self.tub_path / "tub_1_21-01-01_hist.png"
+        assert Image.open(histogram_path).format == "PNG"
+        with open(self.tub_path / "tub_1_21-01-01_hist.json") as f:
+            assert json.load(f)['records'] == 40
+        assert [path.name for path in self.tub_path.glob("*.part")] == []
+
+    def test_gen_histogram_empty_tub(self):
+        empty_tub_path = self.temp_dir / "empty_tub"
+        create_tub(empty_tub_path, 0)
+
+        with self.assertRaises(EmptyTubError):
+            TubServiceV2.gen_histogram(empty_tub_path)
+
+    def test_histogram_json_view(self):
+        client = Client()
+        url = reverse('data:histogram_json', kwargs={'tub_name': self.tub_path.name})
+
+        with override_settings(DATA_DIR=self.temp_dir):
+            with patch.object(TubServiceV2, 'histogram_jobs', HistogramJobs()):
+                response = client.get(url)
+                assert response.status_code == status.HTTP_202_ACCEPTED
+
+                TubServiceV2.histogram_jobs.executor.shutdown()
+                response = client.get(url)
+
+        assert response.status_code == status.HTTP_200_OK
+        assert response['Content-Type'] == "application/json"
+        result = json.loads(b"".join(response.streaming_content))
+        assert result['records'] == 40
+        assert len(result['histograms']['user/angle']['counts']) == 50
+
+    def test_v1_histogram_follows_tub_folder(self):
+        tub_path = self.temp_dir / "tub_2_20-03-30"
+        tub_path.mkdir()
+        Image.new('RGB', (32, 24)).save(tub_path / "1_cam-image_array_.jpg")
+        (tub_path / "record_1.json").write_text("{}")
+
+        def tubhist(command, **kwargs):
+            out = next(arg for arg in command if arg.startswith('--out='))
+            Image.new('RGB', (32, 24)).save(out[len('--out='):], format='PNG')
+
+        with patch.object(TubService, 'histogram_jobs', HistogramJobs()), \
+                patch('dkconsole.data.services.subprocess.check_output', side_effect=tubhist) as mock_tubhist:
+            assert TubService.get_histogram(tub_path) is None
+            TubService.histogram_jobs.executor.shutdown()
+            TubService.histogram_jobs.executor = None
+
+            histogram_path = TubService.get_histogram(tub_path)
+            assert histogram_path == TubService.get_histogram_path(tub_path)
+            assert TubService.get_histogram(tub_path) == histogram_path
+            assert mock_tubhist.call_count == 1
+
+            (tub_path / "record_2.json").write_text("{}")
+            later = time.time() + 10
+            os.utime(tub_path, (later, later))
+            assert TubService.get_histogram(tub_path) is None
+            TubService.histogram_jobs.executor.shutdown()
+            assert mock_tubhist.call_count == 2
+
+    def test_histogram_json_of_v1_tub(self):
+        url = reverse('data:histogram_json', kwargs={'tub_name': self.tub_path.name})
+
+        with override_settings(DATA_DIR=self.temp_dir), patch('dkconsole.data.views.tub_service', TubService):
+            response = Client().get(url)
+
+        assert response.status_code == status.HTTP_501_NOT_IMPLEMENTED
+        assert response.data['error'] == "json histograms need a v2 tub"
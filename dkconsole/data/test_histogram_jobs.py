@@ -0,0 +1,137 @@
+import os
+import threading
+import time
+from unittest.mock import patch
+
+from django.test import Client
+from django.urls import reverse
+from rest_framework import status
+
+from .data_service_v2 import TubServiceV2
+from .histogram_jobs import HistogramJobs, HistogramError, EmptyTubError
+from .testing import create_tub
+from ..testing import TempDirTestCase
+
+
+class TestHistogramJobs(TempDirTestCase):
+
+    def setUp(self):
+        self.temp_dir = self.mkdtemp()
+        self.histogram_path = self.temp_dir / "hist.png"
+        self.manifest_path = self.temp_dir / "manifest.json"
+        self.manifest_path.write_text("manifest")
+
+    def wait(self, jobs):
+        jobs.executor.shutdown()
+        jobs.executor = None
+
+    def test_requests_share_one_job(self):
+        jobs = HistogramJobs()
+        release = threading.Event()
+        calls = []
+
+        def generate():
+            calls.append(1)
+            release.wait(5)
+            self.histogram_path.write_bytes(b"png")
+
+        assert jobs.get(self.histogram_path, [self.manifest_path], generate) is None
+        assert jobs.get(self.histogram_path, [self.manifest_path], generate) is None
+
+        release.set()
+        self.wait(jobs)
+        assert calls == [1]
+        assert jobs.get(self.histogram_path, [self.manifest_path], generate) == self.histogram_path
+        assert calls == [1]
+
+    def test_regenerated_when_manifest_changes(self):
+        jobs = HistogramJobs()
+        self.histogram_path.write_bytes(b"png")
+        calls = []
+
+        def generate():
+            calls.append(1)
+            self.histogram_path.write_bytes(b"png")
+
+        assert jobs.get(self.histogram_path, [self.manifest_path], generate) == self.histogram_path
+
+        later = time.time() + 10
+        os.utime(self.manifest_path, (later, later))
+        assert jobs.get(self.histogram_path, [self.manifest_path], generate) is None
+        self.wait(jobs)
+        assert calls == [1]
+
+    def test_error_is_reported_once(self):
+        jobs = HistogramJobs()
+
+        def generate():
+            raise IOError("tubhist timed out")
+
+        jobs.get(self.histogram_path, [self.manifest_path], generate)
+        self.wait(jobs)
+
+        with self.assertRaises(HistogramError):
+            jobs.get(self.histogram_path, [self.manifest_path], generate)
+        # queued again
+        assert jobs.get(self.histogram_path, [self.manifest_path], generate) is None
+        self.wait(jobs)
+
+    def test_empty_tub(self):
+        jobs = HistogramJobs()
+
+        def generate():
+            raise EmptyTubError("empty tub")
+
+        jobs.get(self.histogram_path, [self.manifest_path], generate)
+        self.wait(jobs)
+
+        with self.assertRaises(EmptyTubError):
+            jobs.get(self.histogram_path, [self.manifest_path], generate)
+
+
+class TestHistogramView(TempDirTestCase):
+
+    def setUp(self):
+        self.data_dir = self.mkdtemp()
+        self.tub_name = "tub_1_21-01-01"
+        create_tub(self.data_dir / self.tub_name, 10)
+
+        self.override_settings(DATA_DIR=self.data_dir, HISTOGRAM_RETRY_AFTER=1)
+
+        def gen_histogram(tub_path):
+            path = TubServiceV2.get_histogram_path(tub_path)
+            path.write_bytes(b"png")
+            return path
+
+        self.start_patches(
+            patch.object(TubServiceV2, 'histogram_jobs', HistogramJobs()),
+            patch.object(TubServiceV2, 'gen_histogram', side_effect=gen_histogram),
+        )
+
+    def test_histogram(self):
+        client = Client()
+        url = reverse('data:histogram', kwargs={'tub_name': self.tub_name})
+
+        response = client.get(url)
+
+        assert response.status_code == status.HTTP_202_ACCEPTED
+        assert response['Retry-After'] == "1"
+
+        TubServiceV2.histogram_jobs.executor.shutdown()
+        response = client.get(url)
+
+        assert response.status_code == status.HTTP_200_OK
+        assert b"".join(response.streaming_content) == b"png"
+        TubServiceV2.gen_histogram.assert_called_once()
+
+    def test_histogram_failure_is_not_an_empty_tub(self):
+        TubServiceV2.gen_histogram.side_effect = IOError("tubhist timed out")
+        client = Client()
+        url = reverse('data:histogram', kwargs={'tub_name': self.tub_name})
+
+        client.get(url)
+        TubServiceV2.histogram_jobs.executor.shutdown()
+        response = client.get(url)
+
+        assert response.status_code == status.HTTP_500_INTERNAL_SERVER_ERROR
+        assert response.data['error'] == "tubhist timed out"
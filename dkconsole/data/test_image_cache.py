@@ -0,0 +1,104 @@
+import os
+import time
+
+from PIL import Image
+from django.conf import settings
+from django.test import Client
+from django.test import override_settings
+from django.urls import reverse
+from rest_framework import status
+
+from .image_cache import ImageCache
+from .testing import create_tub
+from ..testing import TempDirTestCase
+
+
+class TestImageCache(TempDirTestCase):
+
+    def setUp(self):
+        self.temp_dir = self.mkdtemp()
+        self.data_dir = self.temp_dir / "data"
+        self.cache_dir = self.temp_dir / "image_cache"
+        self.tub_name = "tub_1_21-01-01"
+        create_tub(self.data_dir / self.tub_name, 3, width=640, height=480)
+        self.image_path = self.data_dir / self.tub_name / "images" / "0_cam_image_array_.jpg"
+        # noise, so variant sizes grow with their width
+        Image.effect_noise((640, 480), 64).convert('RGB').save(self.image_path)
+
+        self.override_settings(DATA_DIR=self.data_dir, IMAGE_CACHE_DIR=self.cache_dir)
+        ImageCache.cache_size = None
+
+    def test_get_resized(self):
+        path = ImageCache.get_resized(self.image_path, 150)
+
+        assert path.parent == self.cache_dir
+        with Image.open(path) as image:
+            assert image.size == (160, 120)
+
+        # second request is served from the cache
+        mtime = os.path.getmtime(path)
+        assert ImageCache.get_resized(self.image_path, 160) == path
+        assert os.path.getmtime(path) >= mtime
+
+    def test_get_resized_webp(self):
+        path = ImageCache.get_resized(self.image_path, 64, 'webp')
+        with Image.open(path) as image:
+            assert image.format == 'WEBP'
+            assert image.size == (64, 48)
+
+    def test_small_image_is_not_cached(self):
+        assert ImageCache.get_resized(self.image_path, 4000) == self.image_path
+
+    def test_small_image_is_converted(self):
+        path = ImageCache.get_resized(self.image_path, 4000, 'webp')
+
+        assert path.parent == self.cache_dir
+        with Image.open(path) as image:
+            assert image.format == 'WEBP'
+            assert image.size == (640, 480)
+        assert ImageCache.get_resized(self.image_path, 4000, 'webp') == path
+
+    def test_eviction(self):
+        paths = [ImageCache.get_resized(self.image_path, width) for width in [64, 128, 160, 320]]
+        for i, path in enumerate(paths):
+            os.utime(path, (time.time() - 100 + i, time.time() - 100 + i))
+        ImageCache.get_resized(self.image_path, 64)  # touch, now the most recently used
+
+        with override_settings(IMAGE_CACHE_MAX_SIZE=os.path.getsize(paths[0]) + os.path.getsize(paths[1])):
+            ImageCache.cache_size = None
+            ImageCache.get_resized(self.image_path, 64, 'webp')
+
+            assert ImageCache.get_cache_size() <= settings.IMAGE_CACHE_MAX_SIZE
+
+        assert paths[0].exists()
+        assert not paths[1].exists()
+        assert not paths[2].exists()
+        assert not paths[3].exists()
+
+    def test_jpg_view_resized(self):
+        client = Client()
+
+        response = client.get(reverse('data:jpg', kwargs={'tub_name': self.tub_name,
+                                                          'filename': '0_cam_image_array_.jpg'}), {'w': 160})
+
+        assert response.status_code == status.HTTP_200_OK
+        assert int(response.get('Content-Length')) < os.path.getsize(self.image_path)
+
+    def test_jpg_view_conditional_get(self):
+        client = Client()
+        url = reverse('data:jpg', kwargs={'tub_name': self.tub_name, 'filename': '0_cam_image_array_.jpg'})
+
+        response = client.get(url)
+        assert response.status_code == status.HTTP_200_OK
+        assert "immutable" in response['Cache-Control']
+
+        response = client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        assert response.status_code == status.HTTP_304_NOT_MODIFIED
+
+    def test_jpg_view_invalid_width(self):
+        client = Client()
+
+        response = client.get(reverse('data:jpg', kwargs={'tub_name': self.tub_name,
+                                                          'filename': '0_cam_image_array_.jpg'}), {'w': 'big'})
+
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
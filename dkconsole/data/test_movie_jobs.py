@@ -0,0 +1,164 @@
+import os
+import sys
+import threading
+from unittest.mock import patch
+
+from django.test import Client
+from django.urls import reverse
+from rest_framework import status
+
+from .data_service_v2 import TubServiceV2
+from .movie_jobs import MovieJobs, MovieProgress, MovieError, evict_movies, get_temp_path, render_movie, touch_movie
+from .testing import create_tub
+from ..testing import TempDirTestCase
+
+# stands in for donkey makemovie: prints a moviepy progress bar and writes the movie
+FAKE_MAKEMOVIE = """
+import sys
+for i in range(0, 11):
+    sys.stderr.write(f"\\rt:  {i * 10}%|###| {i * 10}/100 [00:01<00:01, 36.1it/s, now=None]")
+    sys.stderr.flush()
+with open(sys.argv[1], "wb") as f:
+    f.write(b"mp4")
+sys.exit(int(sys.argv[2]))
+"""
+
+
+class TestMovieJobs(TempDirTestCase):
+
+    def setUp(self):
+        self.movie_dir = self.mkdtemp()
+        self.movie_path = self.movie_dir / "tub_1.mp4"
+
+    def makemovie(self, exit_code=0):
+        return [sys.executable, "-c", FAKE_MAKEMOVIE, str(get_temp_path(self.movie_path)), str(exit_code)]
+
+    def test_render_movie(self):
+        progress = MovieProgress("tub_1")
+
+        render_movie(self.makemovie(), self.movie_path, progress)
+
+        assert self.movie_path.read_bytes() == b"mp4"
+        assert not get_temp_path(self.movie_path).exists()
+        assert progress.to_dict()['frames'] == 100
+        assert progress.to_dict()['total_frames'] == 100
+
+    def test_failed_render_leaves_no_movie(self):
+        with self.assertRaises(MovieError):
+            render_movie(self.makemovie(exit_code=1), self.movie_path, MovieProgress("tub_1"))
+
+        assert not self.movie_path.exists()
+        assert not get_temp_path(self.movie_path).exists()
+
+    def test_evict_least_recently_used(self):
+        for i, name in enumerate(["a.mp4", "b.mp4", "c.mp4", "d.mp4"]):
+            (self.movie_dir / name).write_bytes(b"0" * 100)
+            os.utime(self.movie_dir / name, (1000 + i, 1000 + i))
+        touch_movie(self.movie_dir / "a.mp4")
+        (self.movie_dir / "e.part.mp4").write_bytes(b"0" * 100)
+
+        evicted = evict_movies(self.movie_dir, 200, keep=[self.movie_dir / "b.mp4"])
+
+        # b is older than c and d but kept, a was watched last
+        assert evicted == [self.movie_dir / "c.mp4", self.movie_dir / "d.mp4"]
+        assert sorted(path.name for path in self.movie_dir.iterdir()) == ["a.mp4", "b.mp4", "e.part.mp4"]
+
+    def test_training_movies_are_not_evicted(self):
+        # tub_0 was deleted, its movie is evicted all the same
+        for i, name in enumerate(["job_1.mp4", "tub_0.mp4", "tub_1.mp4", "tub_2.mp4"]):
+            (self.movie_dir / name).write_bytes(b"0" * 100)
+            os.utime(self.movie_dir / name, (1000 + i, 1000 + i))
+
+        evicted = evict_movies(self.movie_dir, 100)
+
+        # job_1 is the oldest but is not a tub movie, and does not count in the quota
+        assert evicted == [self.movie_dir / "tub_0.mp4", self.movie_dir / "tub_1.mp4"]
+        assert sorted(path.name for path in self.movie_dir.glob("*.mp4")) == ["job_1.mp4", "tub_2.mp4"]
+
+    def test_movie_is_not_queued_twice(self):
+        jobs = MovieJobs()
+        release = threading.Event()
+        renders = []
+
+        def render(progress):
+            renders.append(1)
+            release.wait(5)
+            self.movie_path.write_bytes(b"mp4")
+            return self.movie_path
+
+        first = jobs.submit("tub_1", render)
+        second = jobs.submit("tub_1", render)
+        release.set()
+        jobs.executor.shutdown()
+
+        assert first is second
+        assert renders == [1]
+        assert jobs.get_progress("tub_1")['stage'] == 'done'
+
+    def test_failure_is_reported_once(self):
+        jobs = MovieJobs()
+        renders = []
+
+        def render(progress):
+            renders.append(1)
+            raise MovieError("makemovie exited with 1")
+
+        jobs.submit("tub_1", render)
+        jobs.executor.shutdown()
+        jobs.executor = None
+
+        progress = jobs.submit("tub_1", render)
+        assert progress.stage == 'failed'
+        assert progress.error == "makemovie exited with 1"
+        assert renders == [1]
+
+        # queued again
+        jobs.submit("tub_1", render)
+        jobs.executor.shutdown()
+        assert renders == [1, 1]
+
+
+class TestMovieView(TempDirTestCase):
+
+    def setUp(self):
+        self.data_dir = self.mkdtemp()
+        self.movie_dir = self.mkdtemp()
+        self.tub_name = "tub_1_21-01-01"
+        create_tub(self.data_dir / self.tub_name, 10)
+
+        self.override_settings(DATA_DIR=self.data_dir, MOVIE_DIR=self.movie_dir, MOVIE_RETRY_AFTER=1)
+
+        def gen_movie(tub_name, progress=None):
+            path = TubServiceV2.get_movie_path(tub_name)
+            path.write_bytes(b"mp4")
+            return path
+
+        self.start_patches(
+            patch.object(TubServiceV2, 'movie_jobs', MovieJobs()),
+            patch.object(TubServiceV2, 'gen_movie', side_effect=gen_movie),
+        )
+
+    def test_stream_video(self):
+        client = Client()
+        url = reverse('data:stream_video', kwargs={'tub_name': self.tub_name})
+
+        response = client.get(url)
+
+        assert response.status_code == status.HTTP_202_ACCEPTED
+        assert response['Retry-After'] == "1"
+        assert response.json()['stage'] in ('queued', 'rendering', 'done')
+
+        TubServiceV2.movie_jobs.executor.shutdown()
+        response = client.get(reverse('data:movie_progress', kwargs={'tub_name': self.tub_name}))
+        assert response.data['stage'] == 'done'
+
+        response = client.get(url)
+
+        assert response.status_code == status.HTTP_200_OK
+        assert b"".join(response.streaming_content) == b"mp4"
+        TubServiceV2.gen_movie.assert_called_once()
+
+    def test_unknown_tub(self):
+        response = Client().get(reverse('data:stream_video', kwargs={'tub_name': "unknown"}))
+
+        assert response.status_code == status.HTTP_404_NOT_FOUND
@@ -0,0 +1,99 @@
+import re
+from pathlib import Path
+from unittest.mock import patch
+
+from django.test import Client
+from django.test import override_settings
+from django.urls import reverse
+from rest_framework import status
+
+from . import playback
+from .data_service_v2 import TubServiceV2
+from .playback import iter_mjpeg, iter_records
+from .services import TubService
+from .testing import create_tub
+from ..testing import TempDirTestCase
+
+
+class TestPlayback(TempDirTestCase):
+
+    def setUp(self):
+        self.data_dir = self.mkdtemp()
+        self.tub_name = "tub_1_21-01-01"
+        self.tub_path = self.data_dir / self.tub_name
+        # 4 catalogs of 10 records
+        create_tub(self.tub_path, 35, deleted_indexes=[12, 13], max_catalog_len=10)
+        self.manifest = TubServiceV2.read_manifest(self.tub_path)
+
+    def test_iter_records(self):
+        indexes = [record['_index'] for record in iter_records(self.tub_path, self.manifest)]
+
+        assert indexes == [i for i in range(0, 35) if i not in (12, 13)]
+
+    def test_seek(self):
+        with patch.object(playback, 'open', wraps=open, create=True) as mock_open:
+            indexes = [record['_index'] for record in iter_records(self.tub_path, self.manifest, start=11, end=25)]
+
+        assert indexes == [11] + list(range(14, 25))
+        # the first catalog is not read
+        opened = [Path(call[0][0]).name for call in mock_open.call_args_list]
+        assert "catalog_0.catalog" not in opened
+
+    def test_iter_mjpeg_pacing(self):
+        records = [{'_index': i, '_timestamp_ms': 1000 + i * 50, 'cam/image_array': f"{i}_cam_image_array_.jpg"}
+                   for i in range(0, 5)]
+        now = [0.0]
+        sleeps = []
+
+        def sleep(seconds):
+            sleeps.append(round(seconds, 3))
+            now[0] += seconds
+
+        parts = list(iter_mjpeg(self.tub_path, records, 'cam/image_array', rate=2, sleep=sleep, clock=lambda: now[0]))
+
+        assert len(parts) == 5
+        # 50ms between records, played twice as fast
+        assert sleeps == [0.025] * 4
+        image = (self.tub_path / "images" / "3_cam_image_array_.jpg").read_bytes()
+        assert parts[3] == (f"--frame\r\nContent-Type: image/jpeg\r\nContent-Length: {len(image)}\r\n"
+                            f"X-Record-Index: 3\r\n\r\n").encode() + image + b"\r\n"
+
+    def test_playback_view(self):
+        client = Client()
+
+        with override_settings(DATA_DIR=self.data_dir):
+            response = client.get(reverse('data:playback', kwargs={'tub_name': self.tub_name}),
+                                  {"start": 30, "rate": 16})
+            assert response.status_code == status.HTTP_200_OK
+            assert response['Content-Type'] == "multipart/x-mixed-replace; boundary=frame"
+            body = b"".join(response.streaming_content)
+
+            response = client.get(reverse('data:playback', kwargs={'tub_name': self.tub_name}), {"rate": 0})
+            assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+        assert re.findall(rb"X-Record-Index: (\d+)", body) == [b"30", b"31", b"32", b"33", b"34"]
+
+    def test_playbacks_are_capped(self):
+        url = reverse('data:playback', kwargs={'tub_name': self.tub_name})
+
+        with override_settings(DATA_DIR=self.data_dir, PLAYBACK_MAX_STREAMS=1), \
+                patch.object(TubServiceV2, 'playback_slots', playback.PlaybackSlots()):
+            first = Client().get(url, {"start": 30, "rate": 16})
+            assert first.status_code == status.HTTP_200_OK
+
+            response = Client().get(url)
+            assert response.status_code == status.HTTP_503_SERVICE_UNAVAILABLE
+
+            # the client went away before the stream started
+            first.close()
+            response = Client().get(url, {"start": 30, "rate": 16})
+            assert response.status_code == status.HTTP_200_OK
+            assert len(b"".join(response.streaming_content)) > 0
+            assert TubServiceV2.playback_slots.active == 0
+
+    def test_playback_of_v1_tub(self):
+        with override_settings(DATA_DIR=self.data_dir), patch('dkconsole.data.views.tub_service', TubService):
+            response = Client().get(reverse('data:playback', kwargs={'tub_name': self.tub_name}))
+
+        assert response.status_code == status.HTTP_501_NOT_IMPLEMENTED
+        assert response.data['error'] == "playback needs a v2 tub"
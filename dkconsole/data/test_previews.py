@@ -0,0 +1,35 @@
+from django.test import TestCase
+
+from .previews import spread_positions, sample_record_indexes, PreviewCache
+
+
+class TestPreviews(TestCase):
+
+    def test_spread_positions(self):
+        assert spread_positions(100, 5) == [0, 25, 50, 74, 99]
+        assert spread_positions(3, 5) == [0, 1, 2]
+        assert spread_positions(0, 5) == []
+        assert spread_positions(10, 1) == [0]
+
+    def test_sample_record_indexes(self):
+        assert sample_record_indexes(10, set(), 5) == [0, 2, 4, 7, 9]
+        # live records are 5..317
+        assert sample_record_indexes(318, {0, 1, 2, 3, 4}, 5) == [5, 83, 161, 239, 317]
+        assert sample_record_indexes(6, {1, 3}, 5) == [0, 2, 4, 5]
+        assert sample_record_indexes(3, {0, 1, 2}, 5) == []
+
+    def test_sampled_indexes_are_live(self):
+        deleted = set(range(0, 1000, 3)) | set(range(400, 600))
+        indexes = sample_record_indexes(1000, deleted, 20)
+
+        live = [i for i in range(1000) if i not in deleted]
+        assert indexes == [live[p] for p in spread_positions(len(live), 20)]
+
+    def test_preview_cache(self):
+        cache = PreviewCache()
+        assert cache.get_record_indexes("tub", 10, set(), 5, 1) == [0, 2, 4, 7, 9]
+        indexes = cache.get_record_indexes("tub", 10, {0}, 5, 2)
+        assert indexes == [1, 3, 5, 7, 9]
+        # same manifest, the deleted indexes are not compared
+        assert cache.get_record_indexes("tub", 10, {0}, 5, 2) is indexes
+        assert cache.get_record_indexes("tub", 10, {1}, 5, 3) == [0, 3, 5, 7, 9]
@@ -10,6 +10,9 @@ from django.conf import settings
 import tarfile
 from datetime import datetime
 from django.utils.timezone import make_aware
+from PIL import Image
+import json
+from dkconsole.testing import TempDirTestCase
 
 
 # Create your tests here.
@@ -115,3 +118,38 @@ class TestTubService(TestCase):
             meta = self.tub_service.update_meta("some_tub", {"b": 4, 'c': "asdfa", "d": 5})
             assert meta == {'a': 1, 'b': 4, 'c': 'asdfa', 'd': 5}
 
+
+class TestTubScan(TempDirTestCase):
+
+    def setUp(self):
+        self.data_dir = self.mkdtemp()
+        self.tub_path = self.data_dir / "tub_1_20-03-30"
+        self.tub_path.mkdir()
+
+        for i in [12, 3, 100, 7]:
+            Image.new('RGB', (32, 24)).save(self.tub_path / f"{i}_cam-image_array_.jpg")
+            with open(self.tub_path / f"record_{i}.json", "w") as f:
+                json.dump({"cam/image_array": f"{i}_cam-image_array_.jpg"}, f)
+        with open(self.tub_path / "meta.json", "w") as f:
+            json.dump({"start": 1554525538.338533}, f)
+
+        self.override_settings(DATA_DIR=self.data_dir)
+
+    def test_scan_tub(self):
+        scan = TubService.scan_tub(self.tub_path)
+
+        assert scan.jpgs == ["3_cam-image_array_.jpg", "7_cam-image_array_.jpg",
+                             "12_cam-image_array_.jpg", "100_cam-image_array_.jpg"]
+        assert scan.no_of_images == 4
+        assert scan.thumbnail_name == "3_cam-image_array_.jpg"
+        assert scan.size == round(sum(p.stat().st_size for p in self.tub_path.iterdir()) / 1024 / 1024, 2)
+
+    def test_get_tub_lists_folder_once(self):
+        with patch('os.scandir', wraps=os.scandir) as mock_scandir:
+            tub = TubService.get_tub(self.tub_path)
+            assert mock_scandir.call_count == 1
+
+        assert tub.no_of_images == 4
+        assert tub.thumbnail.name == "3_cam-image_array_.jpg"
+        assert (tub.thumbnail.width, tub.thumbnail.height) == (32, 24)
+        assert len(tub.previews) == 4
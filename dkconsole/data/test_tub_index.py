@@ -0,0 +1,65 @@
+import os
+import shutil
+from unittest.mock import patch
+
+from dkconsole.data.data_service_v2 import TubServiceV2
+from dkconsole.data.testing import create_tub
+from dkconsole.data.tub_index import TubIndex
+from dkconsole.testing import TempDirTestCase
+
+
+class TestTubIndex(TempDirTestCase):
+
+    def setUp(self):
+        self.data_dir = self.mkdtemp()
+        self.tub_name = "tub_1_21-01-01"
+        create_tub(self.data_dir / self.tub_name, 20, deleted_indexes=[0, 1])
+
+        self.override_settings(DATA_DIR=self.data_dir)
+
+    def test_index_is_written(self):
+        tubs = TubServiceV2.get_tubs()
+
+        assert len(tubs) == 1
+        assert (self.data_dir / TubIndex.FILENAME).is_file()
+
+        entries = TubIndex(self.data_dir).entries
+        assert entries[self.tub_name]['no_of_images'] == 18
+        assert entries[self.tub_name]['thumbnail']['name'] == "2_cam_image_array_.jpg"
+
+    def test_unchanged_tub_is_not_rescanned(self):
+        first = TubServiceV2.get_tubs()[0]
+
+        with patch.object(TubServiceV2, 'get_tub') as mock_get_tub:
+            second = TubServiceV2.get_tubs()[0]
+            mock_get_tub.assert_not_called()
+
+        assert second.name == first.name
+        assert second.created_at == first.created_at
+        assert second.no_of_images == first.no_of_images
+        assert second.thumbnail.width == first.thumbnail.width
+        assert second.previews == first.previews
+
+    def test_changed_tub_is_rescanned(self):
+        TubServiceV2.get_tubs()
+
+        manifest_path = self.data_dir / self.tub_name / "manifest.json"
+        stat = os.stat(manifest_path)
+        os.utime(manifest_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+
+        with patch.object(TubServiceV2, 'get_tub', wraps=TubServiceV2.get_tub) as mock_get_tub:
+            TubServiceV2.get_tubs()
+            assert mock_get_tub.call_count == 1
+
+    def test_deleted_tub_is_pruned(self):
+        TubServiceV2.get_tubs()
+        shutil.rmtree(self.data_dir / self.tub_name)
+
+        assert TubServiceV2.get_tubs() == []
+        assert TubIndex(self.data_dir).entries == {}
+
+    def test_corrupt_index_is_ignored(self):
+        with open(self.data_dir / TubIndex.FILENAME, "w") as f:
+            f.write("{not json")
+
+        assert len(TubServiceV2.get_tubs()) == 1
@@ -0,0 +1,93 @@
+from unittest.mock import patch
+
+from django.test import Client
+from django.test import override_settings
+from django.urls import reverse
+from rest_framework import status
+
+from dkconsole.data.data_service_v2 import TubServiceV2
+from dkconsole.data.testing import create_tub
+from dkconsole.data.tub_index import TubIndex
+from dkconsole.testing import TempDirTestCase
+
+
+class TestTubQuery(TempDirTestCase):
+
+    def setUp(self):
+        self.data_dir = self.mkdtemp()
+        # created in this order, so tub_3 is the latest
+        create_tub(self.data_dir / "tub_1_21-01-01", 30)
+        create_tub(self.data_dir / "tub_2_21-01-01", 5)
+        create_tub(self.data_dir / "tub_3_21-01-02", 12)
+
+        self.override_settings(DATA_DIR=self.data_dir)
+
+    def test_default_sort_is_latest_first(self):
+        tubs = TubServiceV2.get_tubs()
+        assert [tub.name for tub in tubs] == ["tub_3_21-01-02", "tub_2_21-01-01", "tub_1_21-01-01"]
+
+    def test_sort_by_no_of_images(self):
+        tubs = TubServiceV2.get_tubs(sort='no_of_images')
+        assert [tub.no_of_images for tub in tubs] == [30, 12, 5]
+
+        tubs = TubServiceV2.get_tubs(sort='no_of_images', reverse=False)
+        assert [tub.no_of_images for tub in tubs] == [5, 12, 30]
+
+    def test_filters(self):
+        assert [tub.name for tub in TubServiceV2.get_tubs(min_images=10)] == ["tub_3_21-01-02", "tub_1_21-01-01"]
+        assert [tub.name for tub in TubServiceV2.get_tubs(name_prefix="tub_2")] == ["tub_2_21-01-01"]
+
+    def test_only_accessed_tubs_are_scanned(self):
+        with patch.object(TubServiceV2, 'get_tub', wraps=TubServiceV2.get_tub) as mock_get_tub:
+            tubs = TubServiceV2.query_tubs()
+            assert len(tubs) == 3
+            mock_get_tub.assert_not_called()
+
+            page = tubs[0:2]
+            assert [tub.name for tub in page] == ["tub_3_21-01-02", "tub_2_21-01-01"]
+            assert mock_get_tub.call_count == 2
+
+    def test_parallel_scan_keeps_order(self):
+        with override_settings(TUB_SCAN_WORKERS=1):
+            serial = [tub.name for tub in TubServiceV2.get_tubs(sort='size')]
+
+        (self.data_dir / TubIndex.FILENAME).unlink()
+
+        with override_settings(TUB_SCAN_WORKERS=4):
+            parallel = [tub.name for tub in TubServiceV2.get_tubs(sort='size')]
+
+        assert parallel == serial
+
+    def test_broken_tub_is_skipped(self):
+        broken_tub_path = self.data_dir / "tub_4_21-01-03"
+        broken_tub_path.mkdir()
+        with open(broken_tub_path / "manifest.json", "w") as f:
+            f.write("not a manifest")
+
+        with override_settings(TUB_SCAN_WORKERS=4):
+            assert len(TubServiceV2.get_tubs()) == 3
+            assert len(TubServiceV2.get_tubs(sort='no_of_images')) == 3
+
+    def test_index_view_paginated(self):
+        client = Client()
+
+        response = client.get(reverse('data:index'), {'page': 2, 'page_size': 2, 'sort': 'no_of_images'})
+
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data['count'] == 3
+        assert [tub['name'] for tub in response.data['results']] == ["tub_2_21-01-01"]
+
+    def test_index_view_not_paginated(self):
+        client = Client()
+
+        response = client.get(reverse('data:index'), {'name_prefix': 'tub_1'})
+
+        assert response.status_code == status.HTTP_200_OK
+        assert len(response.data) == 1
+
+    def test_index_view_invalid_sort(self):
+        client = Client()
+
+        response = client.get(reverse('data:index'), {'sort': 'name'})
+
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
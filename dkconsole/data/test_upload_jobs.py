@@ -0,0 +1,108 @@
+import json
+import threading
+import time
+from unittest.mock import patch
+
+from django.test import Client
+from django.test import TestCase
+from django.urls import reverse
+from rest_framework import status
+
+from .data_service_v2 import TubServiceV2
+from .testing import create_tub
+from .upload_jobs import UploadJobs
+from ..testing import TempDirTestCase
+
+
+class TestUploadJobs(TestCase):
+
+    def test_tub_is_not_queued_twice(self):
+        jobs = UploadJobs()
+        release = threading.Event()
+        uploads = []
+
+        def upload(tub_name, progress):
+            uploads.append(tub_name)
+            release.wait(5)
+            return "uuid"
+
+        first = jobs.submit("t1", ["tub_1", "tub_2"], upload, lambda tub_name: tub_name == "tub_2")
+        second = jobs.submit("t2", ["tub_1"], upload, lambda tub_name: False)
+
+        assert second["tub_1"] is first["tub_1"]
+        assert jobs.get_progress("t1")[1]['stage'] == 'done'
+
+        release.set()
+        jobs.executor.shutdown()
+        assert uploads == ["tub_1"]
+        assert jobs.get_progress("t2") == [{'tub_name': "tub_1", 'stage': 'done', 'bytes_sent': 0,
+                                            'total_bytes': None, 'uuid': "uuid", 'error': None}]
+
+    def test_failed_upload(self):
+        jobs = UploadJobs()
+
+        def upload(tub_name, progress):
+            progress.update(stage='uploading')
+            raise IOError("network is unreachable")
+
+        jobs.submit("t1", ["tub_1"], upload, lambda tub_name: False)
+        jobs.executor.shutdown()
+
+        progress = jobs.get_progress("t1")[0]
+        assert progress['stage'] == 'failed'
+        assert progress['error'] == "network is unreachable"
+        assert jobs.active == {}
+
+
+class TestUploadView(TempDirTestCase):
+
+    def setUp(self):
+        self.data_dir = self.mkdtemp()
+        self.upload_dir = self.mkdtemp()
+        self.tub_names = ["tub_1_21-01-01", "tub_2_21-01-01"]
+        for tub_name in self.tub_names:
+            create_tub(self.data_dir / tub_name, 20)
+            with open(self.data_dir / tub_name / "meta.json", "w") as f:
+                json.dump({"no_of_images": 20}, f)
+
+        self.override_settings(DATA_DIR=self.data_dir, UPLOAD_DIR=self.upload_dir, HQ_UPLOAD_DEDUP=True)
+
+        self.hq = self.start_hq()
+        self.start_patches(
+            patch.object(TubServiceV2, 'HQ_BASE_URL', self.hq.url('')),
+            patch.object(TubServiceV2, 'upload_jobs', UploadJobs()),
+            patch.object(TubServiceV2.vehicle_service, 'get_wlan_mac_address', return_value="device"),
+        )
+
+    def test_upload_in_background(self):
+        client = Client()
+
+        response = client.post(reverse('data:upload_tub'), data=json.dumps({"tub_names": self.tub_names}),
+                               content_type='application/json')
+
+        assert response.status_code == status.HTTP_202_ACCEPTED
+        transaction_uuid = response.data['transaction_uuid']
+
+        progress_url = reverse('data:upload_progress', kwargs={'transaction_uuid': transaction_uuid})
+        deadline = time.time() + 10
+        while True:
+            response = client.get(progress_url)
+            assert response.status_code == status.HTTP_200_OK
+            if response.data['done'] or time.time() > deadline:
+                break
+            time.sleep(0.05)
+
+        tubs = response.data['tubs']
+        assert [tub['tub_name'] for tub in tubs] == self.tub_names
+        for tub in tubs:
+            assert tub['stage'] == 'done'
+            assert tub['bytes_sent'] == tub['total_bytes']
+            assert tub['uuid']
+        assert set(self.hq.tubs) == set(self.tub_names)
+
+    def test_upload_progress_unknown_transaction(self):
+        client = Client()
+
+        response = client.get(reverse('data:upload_progress', kwargs={'transaction_uuid': "unknown"}))
+
+        assert response.status_code == status.HTTP_404_NOT_FOUND
@@ -10,15 +10,20 @@ import re
 from unittest.mock import patch, ANY
 from django.core import serializers
 
+from .data_service_v2 import TubServiceV2
+from .upload_jobs import UploadJobs
+from ..testing import TempDirTestCase
+
 
 # from .views import *
 
 # Create your tests here.
 
 
-class TestDataView(TestCase):
+class TestDataView(TempDirTestCase):
 
     def setUp(self):
+        self.copy_fixture_data()
         self.data_dir = Path(__file__).parent.absolute() / "test_data"
 
     def test_index(self):
@@ -171,18 +176,27 @@ class TestDataView(TestCase):
         assert response.data['success'] is True
 
     def test_upload(self):
-        # with patch('dkconsole.data.data_service_v2.TubServiceV2.upload') as mock_method:
-        # mock_method.return_value = {'done': True, 'successful': ['tub_26_21-07-02', 'tub_27_21-07-02']}
+        tub_names = ['tub_26_21-07-02', 'tub_27_21-07-02']
         client = Client()
-        data = dict()
-        data["tub_names"] = ['tub_26_21-07-02', 'tub_27_21-07-02']
 
-        # r.return_value.status_code = 200
-        response = client.post(
-            reverse('data:upload_tub'),
-            data=json.dumps(data),
-            content_type='application/json'
-        )
-        print(response.data)
-        assert response.status_code, status.HTTP_200_OK
-        assert response.data['done'] is True
+        with patch.object(TubServiceV2, 'upload_jobs', UploadJobs()), \
+                patch.object(TubServiceV2, 'upload_tub', return_value="tub-uuid") as mock_upload_tub, \
+                patch.object(TubServiceV2, 'check_uuid_exist', return_value=False), \
+                patch.object(TubServiceV2.vehicle_service, 'get_wlan_mac_address', return_value="device"):
+            response = client.post(
+                reverse('data:upload_tub'),
+                data=json.dumps({"tub_names": tub_names}),
+                content_type='application/json'
+            )
+
+            assert response.status_code == status.HTTP_202_ACCEPTED
+            transaction_uuid = response.data['transaction_uuid']
+
+            TubServiceV2.upload_jobs.executor.shutdown()
+            response = client.get(reverse('data:upload_progress', kwargs={'transaction_uuid': transaction_uuid}))
+
+            assert response.status_code == status.HTTP_200_OK
+            assert response.data['done'] is True
+            assert [tub['tub_name'] for tub in response.data['tubs']] == tub_names
+            assert [tub['stage'] for tub in response.data['tubs']] == ['done', 'done']
+            assert mock_upload_tub.call_count == 2
@@ -0,0 +1,25 @@
+"""
+Helpers to build datastore v2 tubs on the fly for tests. The jpgs checked into mycar4_test are LFS pointers,
+so tests that need to open images build their own tub.
+"""
+import numpy as np
+from donkeycar.parts.tub_v2 import Tub as DKTubV2
+
+INPUTS = ['cam/image_array', 'user/angle', 'user/throttle', 'user/mode']
+TYPES = ['image_array', 'float', 'float', 'str']
+
+
+def create_tub(tub_path, no_of_records, width=160, height=120, deleted_indexes=(), max_catalog_len=1000):
+    tub = DKTubV2(str(tub_path), inputs=INPUTS, types=TYPES, max_catalog_len=max_catalog_len)
+    for i in range(no_of_records):
+        image = np.full((height, width, 3), i % 256, dtype=np.uint8)
+        angle = ((i % 21) - 10) / 10
+        tub.write_record({'cam/image_array': image, 'user/angle': angle, 'user/throttle': 0.5, 'user/mode': 'user'})
+    if deleted_indexes:
+        if hasattr(tub, 'delete_records'):
+            tub.delete_records(list(deleted_indexes))
+        else:
+            for index in deleted_indexes:  # donkeycar 4.1 only deletes one record at a time
+                tub.delete_record(index)
+    tub.close()
+    return tub_path
@@ -0,0 +1,132 @@
+import json
+import logging
+import os
+import tempfile
+import threading
+from datetime import datetime
+from pathlib import Path
+
+from django.utils.timezone import make_aware
+
+from dkconsole.data.models import Tub, TubImage
+
+logger = logging.getLogger(__name__)
+
+
+class TubIndex():
+    """
+    Persistent catalog of tub listings, stored as a JSON file under DATA_DIR.
+
+    Each entry is keyed by tub name and carries the signature (list of mtimes) the tub had when it
+    was scanned. A tub is only re-scanned when its current signature differs from the stored one.
+    """
+    FILENAME = '.tub_index.json'
+    VERSION = 1
+
+    def __init__(self, data_dir):
+        self.path = Path(data_dir) / self.FILENAME
+        self.lock = threading.Lock()
+        self.entries = self._load()
+        self.dirty = False
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                index = json.load(f)
+            if index.get('version') == self.VERSION:
+                return index['tubs']
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable tub index {self.path}: {e}")
+        return {}
+
+    def get_tub(self, tub_path, get_signature, get_tub):
+        """
+        Return the Tub for tub_path from the index, calling get_tub to rescan it when the signature has changed
+        """
+        tub_path = Path(tub_path)
+        entry = self.get_entry(tub_path, get_signature(tub_path))
+        if entry is not None:
+            return self._to_tub(tub_path, entry)
+
+        logger.debug(f"Tub index miss for {tub_path.name}")
+        tub = get_tub(tub_path)
+        # get_tub may write meta.json, so the signature is taken again once the scan is done
+        entry = self._to_entry(tub, get_signature(tub_path))
+        with self.lock:
+            self.entries[tub_path.name] = entry
+            self.dirty = True
+        return tub
+
+    def get_entry(self, tub_path, signature):
+        """
+        Return the raw index entry for tub_path, or None when it is missing or stale
+        """
+        with self.lock:
+            entry = self.entries.get(Path(tub_path).name)
+        if entry is not None and entry['signature'] == signature:
+            return entry
+        return None
+
+    def prune(self, tub_names):
+        """
+        Drop entries for tubs that are no longer on disk
+        """
+        with self.lock:
+            for name in set(self.entries) - set(tub_names):
+                del self.entries[name]
+                self.dirty = True
+
+    def save(self):
+        with self.lock:
+            if not self.dirty:
+                return
+            index = {'version': self.VERSION, 'tubs': self.entries}
+            try:
+                fd, tmp_path = tempfile.mkstemp(dir=self.path.parent, prefix=self.FILENAME)
+                with os.fdopen(fd, 'w') as f:
+                    json.dump(index, f)
+                os.replace(tmp_path, self.path)
+                self.dirty = False
+            except OSError as e:
+                logger.error(f"Failed to save tub index {self.path}: {e}")
+
+    @classmethod
+    def _to_entry(cls, tub, signature):
+        return {
+            'signature': signature,
+            'created_at': tub.created_at.timestamp(),
+            'no_of_images': tub.no_of_images,
+            'thumbnail': {
+                'name': tub.thumbnail.name,
+                'width': tub.thumbnail.width,
+                'height': tub.thumbnail.height,
+            },
+            'size': tub.size,
+            'rating': tub.rating,
+            'previews': tub.previews,
+            'uuid': tub.uuid,
+        }
+
+    @classmethod
+    def _to_tub(cls, tub_path, entry):
+        thumbnail = entry['thumbnail']
+        tub_image = TubImage(thumbnail['name'], thumbnail['width'], thumbnail['height'])
+        created_at = make_aware(datetime.fromtimestamp(entry['created_at']))
+
+        return Tub(tub_path.name, tub_path, created_at, entry['no_of_images'], tub_image, entry['size'],
+                   entry['rating'], entry['previews'], uuid=entry['uuid'])
+
+
+def get_mtimes(paths):
+    """
+    Signature helper: st_mtime_ns of each path, None when the path does not exist
+    """
+    mtimes = []
+    for path in paths:
+        try:
+            mtimes.append(os.stat(path).st_mtime_ns)
+        except FileNotFoundError:
+            mtimes.append(None)
+    return mtimes
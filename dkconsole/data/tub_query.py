@@ -0,0 +1,131 @@
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from django.conf import settings
+
+from dkconsole.data.tub_index import TubIndex
+
+logger = logging.getLogger(__name__)
+
+SORT_FIELDS = ['created_at', 'size', 'rating', 'no_of_images']
+
+# Sort keys which can be read without scanning the whole tub
+CHEAP_SORT_FIELDS = ['created_at']
+
+
+class LazyTubList():
+    """
+    Sequence of tubs which only scans the tubs that are actually accessed.
+
+    It supports len() and slicing, so it can be handed to a paginator and only the requested page gets
+    materialized. Tubs which fail to load are left out of the slice.
+    """
+
+    def __init__(self, tub_paths, index, service):
+        self.tub_paths = tub_paths
+        self.index = index
+        self.service = service
+
+    def __len__(self):
+        return len(self.tub_paths)
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return self._load(self.tub_paths[key])
+        return self._load([self.tub_paths[key]])[0]
+
+    def __iter__(self):
+        return iter(self[:])
+
+    def _load_tub(self, tub_path):
+        try:
+            return self.index.get_tub(tub_path, self.service.get_tub_signature, self.service.get_tub)
+        except Exception as e:
+            logger.error(f"Failed to load tub {tub_path}: {e}")
+            return None
+
+    def _load(self, tub_paths):
+        start = time.time()
+        tubs = [tub for tub in scan(self._load_tub, tub_paths) if tub is not None]
+        self.index.save()
+
+        if len(tub_paths) > 1:
+            logger.info(f"Loaded {len(tubs)}/{len(tub_paths)} tubs in {time.time() - start:.2f}s "
+                        f"with {scan_workers()} workers")
+        return tubs
+
+
+def scan_workers():
+    return max(1, settings.TUB_SCAN_WORKERS)
+
+
+def scan(func, tub_paths):
+    """
+    map func over tub_paths on a bounded thread pool, results are returned in the order of tub_paths.
+
+    Scanning a tub is mostly blocking file I/O, so threads overlap the reads on SD card storage.
+    func is expected to handle its own errors.
+    """
+    workers = min(scan_workers(), len(tub_paths))
+    if workers <= 1:
+        return [func(tub_path) for tub_path in tub_paths]
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='tub_scan') as executor:
+        return list(executor.map(func, tub_paths))
+
+
+def sort_value(value):
+    """
+    rating may be stored as a string in the tub meta
+    """
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 0
+
+
+def query_tubs(service, sort='created_at', reverse=True, name_prefix=None, min_images=0):
+    """
+    List the tubs in service.data_dir(), as a LazyTubList when the full scan can be deferred.
+
+    Filtering by name prefix and sorting by created_at only touch the manifest of each tub, so the full scan is
+    deferred to the tubs that get accessed. Sorting by size, rating or no_of_images or filtering on min_images need
+    the full tub details, these come from the tub index and only changed tubs are re-scanned.
+    """
+    if sort not in SORT_FIELDS:
+        raise ValueError(f"Unsupported sort field {sort}")
+
+    index = TubIndex(service.data_dir())
+    tub_paths = [child for child in Path(service.data_dir()).iterdir() if child.is_dir()]
+    index.prune([tub_path.name for tub_path in tub_paths])
+
+    if name_prefix:
+        tub_paths = [tub_path for tub_path in tub_paths if tub_path.name.startswith(name_prefix)]
+
+    if sort in CHEAP_SORT_FIELDS and not min_images:
+        def get_created_at(tub_path):
+            try:
+                entry = index.get_entry(tub_path, service.get_tub_signature(tub_path))
+                if entry is not None:
+                    return entry['created_at']
+                return service.get_created_at(tub_path)
+            except Exception as e:
+                logger.error(f"Failed to read tub {tub_path}: {e}")
+                return None
+
+        keys = dict(zip(tub_paths, scan(get_created_at, tub_paths)))
+        tub_paths = sorted([tub_path for tub_path in keys if keys[tub_path] is not None],
+                           key=lambda tub_path: keys[tub_path], reverse=reverse)
+        index.save()
+        return LazyTubList(tub_paths, index, service)
+
+    tubs = LazyTubList(tub_paths, index, service)[:]
+    tubs = [tub for tub in tubs if tub.no_of_images >= min_images]
+    if sort == 'created_at':
+        tubs.sort(key=lambda tub: tub.created_at, reverse=reverse)
+    else:
+        tubs.sort(key=lambda tub: sort_value(getattr(tub, sort)), reverse=reverse)
+
+    return tubs
@@ -0,0 +1,116 @@
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+class UploadProgress():
+    """
+    Where the upload of one tub is at. stage goes queued -> hashing or archiving -> uploading -> completing -> done,
+    or failed.
+    """
+
+    def __init__(self, tub_name, stage='queued'):
+        self.lock = threading.Lock()
+        self.tub_name = tub_name
+        self.stage = stage
+        self.bytes_sent = 0
+        self.total_bytes = None
+        self.uuid = None
+        self.error = None
+
+    def update(self, **kwargs):
+        with self.lock:
+            for key, value in kwargs.items():
+                setattr(self, key, value)
+
+    def to_dict(self):
+        with self.lock:
+            return {
+                'tub_name': self.tub_name,
+                'stage': self.stage,
+                'bytes_sent': self.bytes_sent,
+                'total_bytes': self.total_bytes,
+                'uuid': self.uuid,
+                'error': self.error,
+            }
+
+
+class UploadJobs():
+    """
+    Tub uploads running in the background on a small pool of HQ_UPLOAD_WORKERS threads.
+
+    Every tub is a job of its own, so the next tub gets archived while the previous one is being sent. Uploads are
+    grouped by transaction, the progress of the latest MAX_TRANSACTIONS transactions is kept in memory. A tub which
+    is already being uploaded is not queued a second time, the new transaction follows the running upload instead.
+    """
+    MAX_TRANSACTIONS = 50
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.executor = None
+        self.transactions = OrderedDict()
+        self.active = {}
+
+    def get_executor(self):
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=max(1, settings.HQ_UPLOAD_WORKERS),
+                                               thread_name_prefix='tub_upload')
+        return self.executor
+
+    def submit(self, transaction_uuid, tub_names, upload, is_uploaded):
+        """
+        Queue the upload of tub_names. upload(tub_name, progress) uploads a tub and returns its HQ uuid,
+        is_uploaded(tub_name) tells the tubs which do not need to be sent again.
+        """
+        transaction = OrderedDict()
+        with self.lock:
+            for tub_name in tub_names:
+                if tub_name in self.active:
+                    transaction[tub_name] = self.active[tub_name]
+                    continue
+
+                progress = UploadProgress(tub_name)
+                transaction[tub_name] = progress
+                try:
+                    uploaded = is_uploaded(tub_name)
+                except Exception as e:
+                    progress.update(stage='failed', error=str(e))
+                    continue
+
+                if uploaded:
+                    progress.update(stage='done')
+                else:
+                    self.active[tub_name] = progress
+                    self.get_executor().submit(self.run, tub_name, progress, upload)
+
+            self.transactions[transaction_uuid] = transaction
+            while len(self.transactions) > self.MAX_TRANSACTIONS:
+                self.transactions.popitem(last=False)
+
+        return transaction
+
+    def run(self, tub_name, progress, upload):
+        try:
+            uuid = upload(tub_name, progress)
+            progress.update(stage='done', uuid=uuid)
+        except Exception as e:
+            logger.error(f"Failed to upload tub {tub_name}: {e}")
+            progress.update(stage='failed', error=str(e))
+        finally:
+            with self.lock:
+                self.active.pop(tub_name, None)
+
+    def get_progress(self, transaction_uuid):
+        """
+        Progress of every tub of the transaction, None for an unknown transaction
+        """
+        with self.lock:
+            transaction = self.transactions.get(transaction_uuid)
+        if transaction is None:
+            return None
+        return [progress.to_dict() for progress in transaction.values()]
@@ -6,12 +6,17 @@ app_name = 'data'
 urlpatterns = [
     path('', views.index, name='index'),
     path('upload_tub', views.upload_tubs, name='upload_tub'),
+    path('upload_tub/<str:transaction_uuid>', views.upload_progress, name='upload_progress'),
     path('<str:tub_name>/tub_archive.tar.gz', views.tub_archive, name='tub_archive'),
     path('delete', views.delete, name='delete'),
     path('latest', views.latest, name='latest'),
     path('latest/hist.png', views.latest_histogram, name='latest_histogram'),
+    path('latest/hist.json', views.latest_histogram_json, name='latest_histogram_json'),
     path('<str:tub_name>/tub_movie.mp4', views.stream_video, name='stream_video'),
+    path('<str:tub_name>/tub_movie/progress', views.movie_progress, name='movie_progress'),
+    path('<str:tub_name>/playback.mjpg', views.playback, name='playback'),
     path('<str:tub_name>/hist.png', views.histogram, name='histogram'),
+    path('<str:tub_name>/hist.json', views.histogram_json, name='histogram_json'),
     path('<str:tub_name>/meta', views.show_meta, name='meta'),
     path('<str:tub_name>/update_meta', views.update_meta, name='update_meta'),
     path('<str:tub_name>/<str:filename>', views.jpg, name='jpg'),
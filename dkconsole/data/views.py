@@ -1,26 +1,51 @@
 from pathlib import Path
 
 from django.conf import settings
-from django.http import HttpResponse, Http404, FileResponse
+from django.http import HttpResponse, Http404, FileResponse, JsonResponse, StreamingHttpResponse
 from rest_framework import status
 from rest_framework.decorators import api_view
+from rest_framework.pagination import PageNumberPagination
 from rest_framework.response import Response
 
 from dkconsole.service_factory import factory
 from dkconsole.util import *
-from .serializers import TubSerializer, MetaSerializer, UploadTubSerializer
+from .archive import CODECS
+from .histogram_jobs import EmptyTubError, HistogramError, HistogramNotSupported
+from .image_cache import ImageCache
+from .playback import CONTENT_TYPE as PLAYBACK_CONTENT_TYPE, PlaybackBusy, PlaybackNotSupported
+from .serializers import TubSerializer, MetaSerializer, UploadTubSerializer, TubQuerySerializer, ImageQuerySerializer, \
+    ArchiveQuerySerializer, PlaybackQuerySerializer
 
 # Create your views here.
 
 tub_service = factory.create('tub_service')
 
 
+class TubPagination(PageNumberPagination):
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+
 @api_view(['GET'])
 def index(request):
+    """
+    http://localhost:8000/data/?sort=size&order=desc&min_images=100&name_prefix=tub_1&page=1&page_size=10
+
+    The response is only paginated when page or page_size is given, otherwise all tubs are returned as a list
+    """
+    query = TubQuerySerializer(data=request.query_params)
+    if not query.is_valid():
+        return Response(query.errors, status=status.HTTP_400_BAD_REQUEST)
 
-    # for name in os.listdir(tub_path()):
-    #     print(name)
-    tubs = tub_service.get_tubs()
+    params = query.validated_data
+    tubs = tub_service.query_tubs(sort=params['sort'], reverse=params['order'] == 'desc',
+                                  name_prefix=params.get('name_prefix'), min_images=params['min_images'])
+
+    if 'page' in request.query_params or 'page_size' in request.query_params:
+        paginator = TubPagination()
+        page = paginator.paginate_queryset(tubs, request)
+        serializer = TubSerializer(page, many=True)
+        return paginator.get_paginated_response(serializer.data)
 
     serializer = TubSerializer(tubs, many=True)
     return Response(serializer.data)
@@ -28,15 +53,28 @@ def index(request):
 
 @api_view(['GET'])
 def tub_archive(request, tub_name):
-    tub_paths = [Path(settings.DATA_DIR) / tub_name]
-    archive_path = tub_service.generate_tub_archive(tub_paths)
+    """
+    http://localhost:8000/data/tub_9_20-01-10/tub_archive.tar.gz?compression=none
+
+    The archive is streamed while it is built. compression is gz (default), pgz (gzip compressed on several
+    threads), zst (when zstandard is installed) or none. compresslevel is 1-9.
+    """
+    tub_path = Path(settings.DATA_DIR) / tub_name
+    if not tub_path.is_dir():
+        raise Http404
 
-    if os.path.exists(archive_path):
-        with open(archive_path, 'rb') as fh:
-            response = HttpResponse(fh.read(), content_type="application/gzip")
-            response['Content-Disposition'] = 'inline; filename=' + os.path.basename(archive_path)
-            return response
-    raise Http404
+    query = ArchiveQuerySerializer(data=request.query_params)
+    if not query.is_valid():
+        return Response(query.errors, status=status.HTTP_400_BAD_REQUEST)
+
+    compression = query.validated_data['compression']
+    chunks = tub_service.stream_tub_archive([tub_path], compression=compression,
+                                            compresslevel=query.validated_data.get('compresslevel'))
+
+    codec = CODECS[compression]
+    response = StreamingHttpResponse(chunks, content_type=codec.content_type)
+    response['Content-Disposition'] = 'inline; filename=' + tub_name + codec.extension
+    return response
 
 
 @api_view(['POST'])
@@ -56,17 +94,27 @@ def delete(request):
 def jpg(request, tub_name, filename):
     """
     http://localhost:8000/data/tub_9_20-01-10/1_cam-image_array_.jpg
+    http://localhost:8000/data/tub_9_20-01-10/1_cam-image_array_.jpg?w=160&fmt=webp
+
+    w returns a downscaled copy from the image cache, fmt is jpeg (default) or webp
     """
     try:
 
         image_path = tub_service.get_image_path(tub_name, filename)
         print(image_path)
 
+        query = ImageQuerySerializer(data=request.query_params)
+        if not query.is_valid():
+            return Response(query.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        if 'w' in query.validated_data:
+            image_path = ImageCache.get_resized(image_path, query.validated_data['w'], query.validated_data['fmt'])
+
         # image_file_path = Path(settings.DATA_DIR) / tub_name / filename
 #
         # 192.168.0.76
 
-        return FileResponse(open(image_path, 'rb'))
+        return file_response(request, image_path, max_age=IMMUTABLE_MAX_AGE, immutable=True)
 
         # with open(image_file_path, "rb") as f:
         #     return HttpResponse(f.read(), content_type="image/jpeg")
@@ -96,11 +144,75 @@ def delete_tubs(request):
 
 
 def stream_video(request, tub_name):
-    path = str(tub_service.gen_movie(tub_name))
-    resp = video_stream(request, path)
+    """
+    http://localhost:8000/data/tub_9_20-01-10/tub_movie.mp4
+
+    The movie of the tub. It is rendered in the background the first time: the answer is then 202 with Retry-After
+    and the rendering progress, or 500 with the error when the rendering failed.
+    """
+    if not (Path(settings.DATA_DIR) / tub_name).is_dir():
+        raise Http404
+
+    path, progress = tub_service.get_movie(tub_name)
+    if path is None:
+        if progress['stage'] == 'failed':
+            return JsonResponse(progress, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        resp = JsonResponse(progress, status=status.HTTP_202_ACCEPTED)
+        resp['Retry-After'] = settings.MOVIE_RETRY_AFTER
+        return resp
+
+    return video_stream(request, str(path))
+
+
+@api_view(['GET'])
+def playback(request, tub_name):
+    """
+    http://localhost:8000/data/tub_9_20-01-10/playback.mjpg?start=1000&rate=2
+
+    The camera images of the tub as an MJPEG stream, from record index start (to end), at rate times the recording
+    speed. Nothing is rendered beforehand: the images are sent as they are read.
+
+    Each playback holds a server thread until it ends or the client goes away, so at most PLAYBACK_MAX_STREAMS play
+    at the same time. Further requests are answered 503 until one of them finishes.
+    """
+    if not (Path(settings.DATA_DIR) / tub_name).is_dir():
+        raise Http404
+
+    query = PlaybackQuerySerializer(data=request.query_params)
+    if not query.is_valid():
+        return Response(query.errors, status=status.HTTP_400_BAD_REQUEST)
+
+    params = query.validated_data
+    try:
+        parts = tub_service.stream_playback(tub_name, start=params['start'], end=params.get('end'),
+                                            rate=params['rate'])
+    except PlaybackNotSupported as e:
+        return Response({"error": str(e)}, status=status.HTTP_501_NOT_IMPLEMENTED)
+    except PlaybackBusy as e:
+        return Response({"error": str(e)}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+    except ValueError as e:
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    resp = StreamingHttpResponse(parts, content_type=PLAYBACK_CONTENT_TYPE)
+    resp['Cache-Control'] = 'no-cache'
+    # nginx would otherwise buffer the stream
+    resp['X-Accel-Buffering'] = 'no'
     return resp
 
 
+@api_view(['GET'])
+def movie_progress(request, tub_name):
+    """
+    http://localhost:8000/data/tub_9_20-01-10/tub_movie/progress
+
+    Progress of the rendering of the movie of the tub, without starting it
+    """
+    progress = tub_service.get_movie_progress(tub_name)
+    if progress is None:
+        return Response(status=status.HTTP_404_NOT_FOUND)
+    return Response(progress)
+
+
 @api_view(['GET'])
 def detail(requst, tub_name):
     tub = tub_service.get_tub_by_name(tub_name)
@@ -117,33 +229,77 @@ def latest(requst):
     return Response(serializer.data)
 
 
-@api_view(['GET'])
-def histogram(requst, tub_name):
+def histogram_response(request, tub_name, format='png'):
     """
-    http://localhost:8000/data/tub_9_20-01-10/tub_9_20-01-10_hist.png
+    The histogram when it is current, 202 with Retry-After while it is being generated, no_image.png (or an empty
+    JSON histogram) for an empty or missing tub, 501 for a format the tub does not have and 500 when it could not
+    be generated
     """
+    tub_path = Path(settings.DATA_DIR) / tub_name if tub_name else None
     try:
-        tub_service.gen_histogram(Path(settings.DATA_DIR) / tub_name)
-        histogram_name = tub_name + "_hist.png"
-        image_file_path = Path(settings.DATA_DIR) / tub_name / histogram_name
-        return FileResponse(open(image_file_path, 'rb'))
-    except:
+        if tub_path is None or not tub_path.is_dir():
+            raise EmptyTubError("no tub")
+        histogram_path = tub_service.get_histogram(tub_path, format)
+    except EmptyTubError:
+        if format == 'json':
+            return Response({"records": 0, "histograms": {}})
         return FileResponse(open(get_no_image_path(), 'rb'))
+    except HistogramNotSupported as e:
+        return Response({"error": str(e)}, status=status.HTTP_501_NOT_IMPLEMENTED)
+    except HistogramError as e:
+        return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+    if histogram_path is None:
+        resp = Response({"status": "pending"}, status=status.HTTP_202_ACCEPTED)
+        resp['Retry-After'] = settings.HISTOGRAM_RETRY_AFTER
+        return resp
+
+    # regenerated when the tub changes, so clients have to revalidate
+    return file_response(request, histogram_path)
+
+
+def latest_histogram_response(request, format='png'):
+    try:
+        latest = tub_service.get_latest()
+    except (ValueError, FileNotFoundError):
+        # no tub at all
+        latest = None
+    return histogram_response(request, latest.name if latest else None, format)
 
 
 @api_view(['GET'])
-def latest_histogram(requst):
+def histogram(request, tub_name):
     """
-    http://localhost:8000/data/tub_9_20-01-10/tub_9_20-01-10_hist.png
+    http://localhost:8000/data/tub_9_20-01-10/hist.png
     """
-    try:
-        latest = tub_service.get_latest()
-        tub_service.gen_histogram(Path(settings.DATA_DIR) / latest.name)
-        histogram_name = latest.name + "_hist.png"
-        image_file_path = Path(settings.DATA_DIR) / latest.name / histogram_name
-        return FileResponse(open(image_file_path, 'rb'))
-    except:
-        return FileResponse(open(get_no_image_path(), 'rb'))
+    return histogram_response(request, tub_name)
+
+
+@api_view(['GET'])
+def histogram_json(request, tub_name):
+    """
+    http://localhost:8000/data/tub_9_20-01-10/hist.json
+
+    The bins of the histogram of every float input, for the app to draw itself:
+    {"records": 318, "histograms": {"user/angle": {"min": -1.0, "max": 1.0, "counts": [...]}, ...}}
+    """
+    return histogram_response(request, tub_name, 'json')
+
+
+@api_view(['GET'])
+def latest_histogram(request):
+    """
+    http://localhost:8000/data/latest/hist.png
+    """
+    return latest_histogram_response(request)
+
+
+@api_view(['GET'])
+def latest_histogram_json(request):
+    """
+    http://localhost:8000/data/latest/hist.json
+    """
+    return latest_histogram_response(request, 'json')
 
 
 @api_view(['GET'])
@@ -174,20 +330,28 @@ def update_meta(request, tub_name):
 def upload_tubs(request):
     """
     endpoint for mobile app
+
+    The tubs are uploaded in the background, the response carries the transaction_uuid to poll upload_progress with
     """
-    try:
-        print(request.data)
-        serializer = UploadTubSerializer(data=request.data)
-        if serializer.is_valid():
-            # tub_names = request.data['tub_names']
-            fail, success = tub_service.upload_to_hq(request.data)
-
-            if len(fail) > 0:
-                return Response({'fail': fail, 'success': success}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-
-            return Response({'fail': fail, 'success': success}, status=status.HTTP_200_OK)
-        else:
-            return Response(status=status.HTTP_400_BAD_REQUEST)
-    except Exception as e:
-        print(e)
-        return Response(status=status.HTTP_400_BAD_REQUEST)
+    serializer = UploadTubSerializer(data=request.data)
+    if not serializer.is_valid():
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+    transaction_uuid = tub_service.start_upload(serializer.validated_data['tub_names'])
+    return Response({'transaction_uuid': transaction_uuid}, status=status.HTTP_202_ACCEPTED)
+
+
+@api_view(['GET'])
+def upload_progress(request, transaction_uuid):
+    """
+    stage, bytes_sent and total_bytes of each tub of an upload transaction
+    """
+    progress = tub_service.get_upload_progress(transaction_uuid)
+    if progress is None:
+        raise Http404
+
+    return Response({
+        'transaction_uuid': transaction_uuid,
+        'done': all(tub['stage'] in ('done', 'failed') for tub in progress),
+        'tubs': progress,
+    })
@@ -0,0 +1,161 @@
+import logging
+import random
+import threading
+import time
+from collections import deque
+from urllib.parse import urlparse
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+
+class EndpointMetrics():
+    """
+    Request count, errors, retries and latency of one HQ endpoint. Percentiles are over the last SAMPLES requests.
+    """
+    SAMPLES = 100
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.retries = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+        self.latencies = deque(maxlen=self.SAMPLES)
+
+    def record(self, seconds, error=False):
+        self.count += 1
+        self.errors += int(error)
+        self.total_seconds += seconds
+        self.max_seconds = max(self.max_seconds, seconds)
+        self.latencies.append(seconds)
+
+    def percentile(self, p):
+        if not self.latencies:
+            return None
+        latencies = sorted(self.latencies)
+        return latencies[min(len(latencies) - 1, int(len(latencies) * p))]
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'errors': self.errors,
+            'retries': self.retries,
+            'avg_seconds': self.total_seconds / self.count if self.count else None,
+            'p50_seconds': self.percentile(0.5),
+            'p95_seconds': self.percentile(0.95),
+            'max_seconds': self.max_seconds,
+        }
+
+
+class HQClient():
+    """
+    The HTTP client every call to HQ goes through.
+
+    One pooled requests.Session keeps connections to HQ alive across requests and threads. Every request gets
+    connect/read timeouts, so a slow HQ cannot hold a gunicorn thread forever. Connection errors, timeouts and
+    RETRY_STATUSES are retried with exponential backoff and full jitter. POSTs are only retried when the caller
+    says they are idempotent, and never with a streamed body which cannot be sent twice.
+
+    Latency is recorded per endpoint, see get_metrics().
+    """
+    RETRY_STATUSES = {429, 502, 503, 504}
+    IDEMPOTENT_METHODS = {'GET', 'HEAD', 'PUT', 'DELETE', 'OPTIONS'}
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self._session = None
+        self.metrics = {}
+
+    @property
+    def session(self):
+        with self.lock:
+            if self._session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=settings.HQ_POOL_SIZE)
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                self._session = session
+            return self._session
+
+    def close(self):
+        with self.lock:
+            if self._session is not None:
+                self._session.close()
+                self._session = None
+
+    def get_metrics(self):
+        with self.lock:
+            return {endpoint: metrics.to_dict() for endpoint, metrics in self.metrics.items()}
+
+    def get_endpoint_metrics(self, endpoint):
+        with self.lock:
+            return self.metrics.setdefault(endpoint, EndpointMetrics())
+
+    def backoff(self, attempt):
+        """
+        Seconds to wait before retry number attempt (0 based): random between 0 and the exponential backoff
+        """
+        return random.uniform(0, min(settings.HQ_BACKOFF_MAX, settings.HQ_BACKOFF * (2 ** attempt)))
+
+    def request(self, method, url, endpoint=None, idempotent=None, retries=None, timeout=None, **kwargs):
+        """
+        Send a request to HQ and return the response, whatever its status code.
+
+        endpoint names the metrics bucket, the url path by default. idempotent defaults to True for every method
+        but POST. The last error is raised when every attempt failed with a connection error or timeout.
+        """
+        method = method.upper()
+        endpoint = endpoint or urlparse(url).path
+        if idempotent is None:
+            idempotent = method in self.IDEMPOTENT_METHODS
+        if retries is None:
+            retries = settings.HQ_RETRIES
+        if not idempotent or hasattr(kwargs.get('data'), 'read'):
+            retries = 0
+        timeout = timeout or (settings.HQ_CONNECT_TIMEOUT, settings.HQ_READ_TIMEOUT)
+        metrics = self.get_endpoint_metrics(endpoint)
+
+        attempt = 0
+        while True:
+            start = time.perf_counter()
+            try:
+                response = self.session.request(method, url, timeout=timeout, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                self.record(metrics, time.perf_counter() - start, error=True)
+                if attempt >= retries:
+                    logger.error(f"HQ {method} {endpoint} failed after {attempt + 1} attempts: {e}")
+                    raise
+                logger.warning(f"HQ {method} {endpoint} failed: {e}, retrying")
+            else:
+                seconds = time.perf_counter() - start
+                self.record(metrics, seconds, error=response.status_code >= 500)
+                logger.debug(f"HQ {method} {endpoint} {response.status_code} in {seconds:.3f}s")
+                if response.status_code not in self.RETRY_STATUSES or attempt >= retries:
+                    return response
+                logger.warning(f"HQ {method} {endpoint} answered {response.status_code}, retrying")
+                response.close()
+
+            with self.lock:
+                metrics.retries += 1
+            time.sleep(self.backoff(attempt))
+            attempt += 1
+
+    def record(self, metrics, seconds, error=False):
+        with self.lock:
+            metrics.record(seconds, error)
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def put(self, url, **kwargs):
+        return self.request('PUT', url, **kwargs)
+
+
+hq_client = HQClient()
@@ -3,8 +3,12 @@ from django.db import models
 
 # Create your models here.
 class MLModel():
-    def __init__(self, name, path, created, rating):
+    def __init__(self, name, path, created, rating, format=None, size=None, architecture=None, input_shape=None):
         self.name = name
         self.path = path
         self.created = created
         self.rating = rating
+        self.format = format
+        self.size = size
+        self.architecture = architecture
+        self.input_shape = input_shape
@@ -0,0 +1,201 @@
+import json
+import logging
+import os
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+from pathlib import Path
+
+from django.conf import settings
+
+from .models import MLModel
+
+try:
+    # installed along with tensorflow, only used for .h5 models without a .json next to them
+    import h5py
+except ImportError:
+    h5py = None
+
+logger = logging.getLogger(__name__)
+
+# model formats manage.py drive accepts
+MODEL_FORMATS = ('h5', 'tflite', 'json', 'uff')
+
+
+def get_architecture(model_config):
+    """
+    (architecture summary, input shape) of a keras model config, as saved in model.to_json() or the h5 attributes
+    """
+    try:
+        config = model_config['config']
+        layers = config['layers']
+    except (KeyError, TypeError):
+        return None, None
+
+    counts = Counter(layer.get('class_name') for layer in layers)
+    summary = f"{model_config.get('class_name', 'Model')} with {len(layers)} layers: " + \
+        ", ".join(f"{count} {class_name}" for class_name, count in counts.items())
+
+    input_shape = None
+    for layer in layers:
+        if layer.get('class_name') == 'InputLayer':
+            shape = layer.get('config', {}).get('batch_input_shape')
+            input_shape = list(shape[1:]) if shape else None
+            break
+    return summary, input_shape
+
+
+class ModelEntry():
+    """
+    What the registry knows about one model file, along with the mtime and size it was read at
+    """
+
+    def __init__(self, path, format, mtime_ns, size):
+        self.path = path
+        self.format = format
+        self.mtime_ns = mtime_ns
+        self.size = size
+        self.architecture = None
+        self.input_shape = None
+        self.rating = None
+
+    def to_mlmodel(self):
+        return MLModel(self.path.name, self.path, datetime.fromtimestamp(self.mtime_ns / 1e9), self.rating,
+                       format=self.format, size=self.size, architecture=self.architecture,
+                       input_shape=self.input_shape)
+
+
+class ModelRegistry():
+    """
+    Catalog of the models in MODEL_DIR, newest first.
+
+    The directory is only scanned again when its mtime changed, i.e. when a file was added, removed or renamed, and
+    only the files whose mtime or size changed are read again. A .json next to a model of the same name is its
+    sidecar (architecture and rating), a .json with a .weights file of the same name is a keras architecture and its
+    weights, any other .json is ignored. Call invalidate() after a file was modified in place, e.g. a sidecar.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.model_dir = None
+        self.dir_mtime_ns = None
+        self.entries = {}
+        self.models = []
+
+    def invalidate(self):
+        with self.lock:
+            self.dir_mtime_ns = None
+
+    def get_models(self, model_dir=None):
+        model_dir = Path(model_dir or settings.MODEL_DIR)
+        with self.lock:
+            dir_mtime_ns = model_dir.stat().st_mtime_ns
+            # a change in the same clock tick as the last scan would not change the mtime again
+            recent = time.time_ns() - dir_mtime_ns < 2 * 10 ** 9
+            if model_dir != self.model_dir or dir_mtime_ns != self.dir_mtime_ns or recent:
+                self.scan(model_dir)
+                self.model_dir = model_dir
+                self.dir_mtime_ns = dir_mtime_ns
+            return list(self.models)
+
+    def scan(self, model_dir):
+        stats = {}
+        with os.scandir(model_dir) as it:
+            for entry in it:
+                if entry.is_file():
+                    stats[entry.name] = entry.stat()
+
+        # a sidecar changes the model it belongs to
+        def signature(name, stat):
+            stem = os.path.splitext(name)[0]
+            parts = [stat.st_mtime_ns, stat.st_size]
+            for extension in ('.json', '.weights'):
+                if stem + extension in stats and stem + extension != name:
+                    sidecar = stats[stem + extension]
+                    parts += [sidecar.st_mtime_ns, sidecar.st_size]
+            return tuple(parts)
+
+        entries = {}
+        for name, stat in stats.items():
+            stem, extension = os.path.splitext(name)
+            format = extension[1:]
+            if format not in MODEL_FORMATS:
+                continue
+            if format == 'json' and any(f"{stem}.{other}" in stats for other in MODEL_FORMATS if other != 'json'):
+                continue
+            if format == 'json' and f"{stem}.weights" not in stats:
+                # a sidecar whose model is gone, not a keras architecture
+                continue
+
+            key = (name, signature(name, stat))
+            entry = self.entries.get(key)
+            if entry is None:
+                entry = self.read_entry(model_dir / name, format, stat, stats)
+            entries[key] = entry
+
+        self.entries = entries
+        self.models = [entry.to_mlmodel()
+                       for entry in sorted(entries.values(), key=lambda e: e.mtime_ns, reverse=True)]
+        logger.debug(f"Scanned {len(self.models)} models in {model_dir}")
+
+    def read_entry(self, path, format, stat, stats):
+        size = stat.st_size
+        weights_name = path.stem + '.weights'
+        if format == 'json' and weights_name in stats:
+            size += stats[weights_name].st_size
+
+        entry = ModelEntry(path, format, stat.st_mtime_ns, size)
+
+        meta = None
+        meta_path = path.with_suffix('.json')
+        if meta_path.name in stats:
+            try:
+                with open(meta_path) as f:
+                    meta = json.load(f)
+            except (OSError, ValueError) as e:
+                logger.warning(f"Could not read {meta_path}: {e}")
+
+        if meta is not None:
+            # as before the registry: None when the sidecar has no rating, 0 for a .h5 without sidecar
+            entry.rating = meta.get('rating') if isinstance(meta, dict) else None
+            entry.architecture, entry.input_shape = get_architecture(meta)
+            if entry.architecture is None and format == 'h5':
+                # e.g. a sidecar holding only the rating
+                entry.architecture, entry.input_shape = self.read_h5_architecture(path)
+        elif format == 'h5':
+            entry.rating = 0
+            entry.architecture, entry.input_shape = self.read_h5_architecture(path)
+
+        return entry
+
+    def read_h5_architecture(self, path):
+        if h5py is None:
+            return None, None
+        try:
+            with h5py.File(path, 'r') as f:
+                model_config = f.attrs.get('model_config')
+            if model_config is None:
+                return None, None
+            if isinstance(model_config, bytes):
+                model_config = model_config.decode('utf-8')
+            return get_architecture(json.loads(model_config))
+        except (OSError, ValueError) as e:
+            logger.warning(f"Could not read the architecture of {path}: {e}")
+            return None, None
+
+
+def get_sidecar_paths(model_path):
+    """
+    The .json and .weights files which go with model_path and are deleted along with it, unless another model of
+    the same name still uses them
+    """
+    model_path = Path(model_path)
+    others = [model_path.with_suffix(f".{format}") for format in MODEL_FORMATS if format != 'json']
+    if any(other != model_path and other.exists() for other in others):
+        return []
+    sidecars = [model_path.with_suffix('.json'), model_path.with_suffix('.weights')]
+    return [sidecar for sidecar in sidecars if sidecar != model_path and sidecar.exists()]
+
+
+model_registry = ModelRegistry()
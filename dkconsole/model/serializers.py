@@ -5,4 +5,8 @@ class MLModelSerializer(serializers.Serializer):
     name = serializers.CharField(max_length=100)
     path = serializers.CharField(max_length=512)
     created = serializers.DateTimeField()
-    rating = serializers.FloatField()
\ No newline at end of file
+    rating = serializers.FloatField()
+    format = serializers.CharField(max_length=10)
+    size = serializers.IntegerField()
+    architecture = serializers.CharField(max_length=2000)
+    input_shape = serializers.ListField(child=serializers.IntegerField(allow_null=True))
\ No newline at end of file
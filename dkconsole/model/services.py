@@ -3,8 +3,7 @@ import errno
 from pathlib import Path
 
 from django.conf import settings
-from .models import MLModel
-from datetime import datetime
+from .registry import model_registry, get_sidecar_paths
 import json
 import fnmatch
 import re
@@ -22,41 +21,22 @@ class MLModelService():
 
     @classmethod
     def get_mlmodels(cls):
-        models = []
-        model_dir = cls.model_dir()
-        modelFile = None
-
-        paths = sorted(Path(model_dir).iterdir(), key=os.path.getmtime, reverse=True)
-
-        for path in paths:
-            if path.is_file() and path.name.endswith(".h5"):
-                modelFile = path
-                model_meta_path = cls.get_meta_json(os.path.splitext(modelFile)[0])
-                if os.path.exists(model_meta_path):
-                    with open(model_meta_path) as f:
-                        meta = json.load(f)
-                        if "rating" in meta:
-                            rating = meta['rating']
-                        else:
-                            rating = None
-
-                    if modelFile is not None:
-                        model = MLModel(modelFile.name, modelFile, datetime.fromtimestamp(
-                            modelFile.stat().st_mtime), rating)
-                        models.append(model)
-                else:
-                    if modelFile is not None:
-                        model = MLModel(modelFile.name, modelFile, datetime.fromtimestamp(modelFile.stat().st_mtime), 0)
-                        models.append(model)
-
-        return models
+        """
+        Models of every format manage.py drive accepts, newest first, from the model registry
+        """
+        return model_registry.get_models(cls.model_dir())
 
     @classmethod
     def delete_model(cls, model_path):
         models = []
 
         if os.path.exists(model_path):
+            # a sidecar left behind would show up in the listing as a model of its own
+            sidecar_paths = get_sidecar_paths(model_path)
             os.remove(model_path)
+            for sidecar_path in sidecar_paths:
+                os.remove(sidecar_path)
+            model_registry.invalidate()
         else:
             raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT), model_path)
 
@@ -91,6 +71,8 @@ class MLModelService():
 
         output = open(target_json, "w+")
         json.dump(update, output)
-        output.close
+        output.close()
+        # the sidecar is rewritten in place, which does not change the mtime of the directory
+        model_registry.invalidate()
 
         return update
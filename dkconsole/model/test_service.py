@@ -1,8 +1,13 @@
-from django.test import TestCase
+from django.test import TestCase, override_settings
 from .services import MLModelService
 from django.conf import settings
 from pathlib import Path
 from unittest.mock import patch
+from .registry import ModelRegistry
+import os
+import shutil
+import tempfile
+import time
 
 
 # Create your tests here.
@@ -26,4 +31,98 @@ class TestTubService(TestCase):
         update = MLModelService.update_meta("job_120", ['rating:1'])
         assert update['rating'] == '1'
 
+    def test_get_models_formats(self):
+        models = {model.name: model for model in MLModelService.get_mlmodels()}
 
+        # job_120.json is the sidecar of job_120.h5, job_176.json a model of its own with job_176.weights
+        assert "job_120.json" not in models
+        assert models["job_176.json"].format == "json"
+        assert models["job_120.h5"].input_shape == [120, 160, 3]
+        assert models["job_120.h5"].architecture.startswith("Model with 19 layers: 1 InputLayer")
+        assert models["dummy_model.h5"].rating == 0
+
+
+class TestModelRegistry(TestCase):
+
+    def setUp(self):
+        self.model_dir = Path(tempfile.mkdtemp())
+        shutil.copy(Path(settings.MODEL_DIR) / "job_120.json", self.model_dir / "pilot.json")
+        (self.model_dir / "pilot.weights").write_bytes(b"weights")
+        (self.model_dir / "pilot.tflite").write_bytes(b"tflite")
+        (self.model_dir / "pilot.uff").write_bytes(b"uff")
+        (self.model_dir / "notes.txt").write_bytes(b"notes")
+
+    def test_get_models(self):
+        registry = ModelRegistry()
+
+        models = registry.get_models(self.model_dir)
+
+        # pilot.json is the sidecar of the tflite and uff models
+        assert sorted(model.name for model in models) == ["pilot.tflite", "pilot.uff"]
+        for model in models:
+            assert model.input_shape == [120, 160, 3]
+            assert float(model.rating) == 1
+
+    def test_only_changed_models_are_read_again(self):
+        registry = ModelRegistry()
+        registry.get_models(self.model_dir)
+
+        with patch.object(registry, 'read_entry', wraps=registry.read_entry) as mock_read_entry:
+            (self.model_dir / "new.h5").write_bytes(b"h5")
+            models = registry.get_models(self.model_dir)
+
+            mock_read_entry.assert_called_once()
+            assert models[0].name == "new.h5"
+            assert models[0].size == 2
+
+    def test_unchanged_directory_is_not_scanned(self):
+        registry = ModelRegistry()
+        registry.get_models(self.model_dir)
+        old = time.time() - 60
+        os.utime(self.model_dir, (old, old))
+        registry.get_models(self.model_dir)
+
+        with patch.object(registry, 'scan') as mock_scan:
+            registry.get_models(self.model_dir)
+            mock_scan.assert_not_called()
+
+            registry.invalidate()
+            registry.get_models(self.model_dir)
+            mock_scan.assert_called_once()
+
+    def test_sidecar_without_model_is_not_listed(self):
+        (self.model_dir / "job_1.h5").write_bytes(b"h5")
+        (self.model_dir / "job_1.json").write_text('{"rating": "3"}')
+
+        with override_settings(MODEL_DIR=self.model_dir):
+            MLModelService.delete_model(self.model_dir / "job_1.h5")
+            assert not (self.model_dir / "job_1.json").exists()
+
+            # a sidecar left behind by an earlier delete
+            (self.model_dir / "job_2.json").write_text('{"rating": "3"}')
+            names = [model.name for model in MLModelService.get_mlmodels()]
+
+        assert "job_1.json" not in names
+        assert "job_2.json" not in names
+
+    def test_shared_sidecar_is_kept(self):
+        with override_settings(MODEL_DIR=self.model_dir):
+            MLModelService.delete_model(self.model_dir / "pilot.uff")
+
+        assert (self.model_dir / "pilot.json").exists()
+        assert (self.model_dir / "pilot.weights").exists()
+
+    def test_rated_h5_keeps_its_architecture(self):
+        (self.model_dir / "job_1.h5").write_bytes(b"h5")
+        (self.model_dir / "job_1.json").write_text('{"rating": "3"}')
+        registry = ModelRegistry()
+
+        with patch.object(registry, 'read_h5_architecture', return_value=("Model with 2 layers", [120, 160, 3])):
+            models = {model.name: model for model in registry.get_models(self.model_dir)}
+
+        assert models["job_1.h5"].rating == "3"
+        assert models["job_1.h5"].architecture == "Model with 2 layers"
+        assert models["job_1.h5"].input_shape == [120, 160, 3]
+
+    def tearDown(self):
+        shutil.rmtree(self.model_dir)
@@ -0,0 +1,76 @@
+from unittest.mock import Mock, patch
+
+import requests
+from django.test import TestCase, override_settings
+
+from dkconsole.hq_client import HQClient
+
+
+def response(status_code):
+    r = Mock()
+    r.status_code = status_code
+    return r
+
+
+@override_settings(HQ_RETRIES=3, HQ_BACKOFF=0, HQ_CONNECT_TIMEOUT=2, HQ_READ_TIMEOUT=7)
+class TestHQClient(TestCase):
+
+    def setUp(self):
+        self.client = HQClient()
+        self.client._session = Mock()
+
+    def test_timeouts(self):
+        self.client._session.request.return_value = response(200)
+
+        self.client.get("http://hq/train/job")
+
+        self.client._session.request.assert_called_once_with('GET', "http://hq/train/job", timeout=(2, 7))
+
+    def test_retry_with_backoff(self):
+        self.client._session.request.side_effect = [response(503), requests.ConnectionError(), response(200)]
+
+        with patch.object(self.client, 'backoff', return_value=0) as mock_backoff:
+            r = self.client.put("http://hq/data/blobs/abc", endpoint='data/blobs', data=b"x")
+
+        assert r.status_code == 200
+        assert [call.args[0] for call in mock_backoff.call_args_list] == [0, 1]
+        metrics = self.client.get_metrics()['data/blobs']
+        assert metrics['count'] == 3
+        assert metrics['errors'] == 2
+        assert metrics['retries'] == 2
+
+    def test_gives_up(self):
+        self.client._session.request.side_effect = requests.Timeout()
+
+        with self.assertRaises(requests.Timeout):
+            self.client.get("http://hq/train/job")
+
+        assert self.client._session.request.call_count == 4
+
+    def test_post_is_not_retried(self):
+        self.client._session.request.return_value = response(503)
+
+        r = self.client.post("http://hq/train/submit_job")
+
+        assert r.status_code == 503
+        assert self.client._session.request.call_count == 1
+
+        self.client.post("http://hq/train/refresh_job_statuses", idempotent=True)
+        assert self.client._session.request.call_count == 5
+
+    def test_backoff_is_bounded(self):
+        with override_settings(HQ_BACKOFF=0.5, HQ_BACKOFF_MAX=8):
+            for attempt in range(10):
+                assert 0 <= self.client.backoff(attempt) <= min(8, 0.5 * 2 ** attempt)
+
+    def test_metrics_per_endpoint(self):
+        self.client._session.request.return_value = response(200)
+
+        self.client.get("http://hq/train/job")
+        self.client.get("http://hq/train/job")
+        self.client.get("http://hq/data/tub")
+
+        metrics = self.client.get_metrics()
+        assert metrics['/train/job']['count'] == 2
+        assert metrics['/data/tub']['count'] == 1
+        assert metrics['/train/job']['p95_seconds'] is not None
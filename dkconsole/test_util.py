@@ -0,0 +1,157 @@
+import os
+import shutil
+import tempfile
+from pathlib import Path
+
+from django.test import TestCase, RequestFactory, override_settings
+from django.utils.http import http_date
+
+from dkconsole.util import file_response, parse_range_header, video_stream, IMMUTABLE_MAX_AGE
+
+
+class TestFileResponse(TestCase):
+
+    def setUp(self):
+        self.temp_dir = Path(tempfile.mkdtemp())
+        self.path = self.temp_dir / "1_cam_image_array_.jpg"
+        with open(self.path, "wb") as f:
+            f.write(b"x" * 100)
+        self.factory = RequestFactory()
+
+    def test_headers(self):
+        response = file_response(self.factory.get("/"), self.path, max_age=IMMUTABLE_MAX_AGE, immutable=True)
+
+        assert response.status_code == 200
+        assert response['ETag']
+        assert response['Last-Modified'] == http_date(int(os.path.getmtime(self.path)))
+        assert f"max-age={IMMUTABLE_MAX_AGE}" in response['Cache-Control']
+        assert "immutable" in response['Cache-Control']
+        response.close()
+
+    def test_if_none_match(self):
+        etag = file_response(self.factory.get("/"), self.path)['ETag']
+
+        response = file_response(self.factory.get("/", HTTP_IF_NONE_MATCH=etag), self.path)
+        assert response.status_code == 304
+        assert response['ETag'] == etag
+        assert "no-cache" in response['Cache-Control']
+
+        with open(self.path, "ab") as f:
+            f.write(b"y")
+        response = file_response(self.factory.get("/", HTTP_IF_NONE_MATCH=etag), self.path)
+        assert response.status_code == 200
+        response.close()
+
+    def test_if_modified_since(self):
+        last_modified = http_date(int(os.path.getmtime(self.path)))
+
+        response = file_response(self.factory.get("/", HTTP_IF_MODIFIED_SINCE=last_modified), self.path)
+        assert response.status_code == 304
+
+        earlier = http_date(int(os.path.getmtime(self.path)) - 60)
+        response = file_response(self.factory.get("/", HTTP_IF_MODIFIED_SINCE=earlier), self.path)
+        assert response.status_code == 200
+        response.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+
+class TestVideoStream(TestCase):
+
+    def setUp(self):
+        self.temp_dir = Path(tempfile.mkdtemp())
+        self.path = self.temp_dir / "tub_1.mp4"
+        self.data = bytes(range(256)) * 4
+        self.path.write_bytes(self.data)
+        self.factory = RequestFactory()
+
+    def get(self, range_header=None):
+        request = self.factory.get("/", HTTP_RANGE=range_header) if range_header else self.factory.get("/")
+        response = video_stream(request, self.path)
+        body = b"".join(response.streaming_content) if response.streaming else response.content
+        response.close()
+        return response, body
+
+    def test_whole_file(self):
+        response, body = self.get()
+
+        assert response.status_code == 200
+        assert response['Content-Type'] == "video/mp4"
+        assert response['Content-Length'] == str(len(self.data))
+        assert response['Accept-Ranges'] == "bytes"
+        assert body == self.data
+
+    def test_range(self):
+        response, body = self.get("bytes=100-199")
+
+        assert response.status_code == 206
+        assert response['Content-Range'] == "bytes 100-199/1024"
+        assert response['Content-Length'] == "100"
+        assert body == self.data[100:200]
+
+    def test_open_and_suffix_ranges(self):
+        response, body = self.get("bytes=1000-")
+        assert response['Content-Range'] == "bytes 1000-1023/1024"
+        assert body == self.data[1000:]
+
+        response, body = self.get("bytes=-10")
+        assert response['Content-Range'] == "bytes 1014-1023/1024"
+        assert body == self.data[-10:]
+
+        # clamped to the end of the file
+        response, body = self.get("bytes=1000-5000")
+        assert response['Content-Range'] == "bytes 1000-1023/1024"
+
+    def test_multiple_ranges(self):
+        response, body = self.get("bytes=0-9, 20-29")
+
+        assert response.status_code == 206
+        assert response['Content-Type'].startswith("multipart/byteranges; boundary=")
+        boundary = response['Content-Type'].split("boundary=")[1]
+        assert body == (f"--{boundary}\r\nContent-Type: video/mp4\r\nContent-Range: bytes 0-9/1024\r\n\r\n".encode()
+                        + self.data[0:10] + b"\r\n"
+                        + f"--{boundary}\r\nContent-Type: video/mp4\r\nContent-Range: bytes 20-29/1024\r\n\r\n"
+                        .encode() + self.data[20:30] + b"\r\n"
+                        + f"--{boundary}--\r\n".encode())
+
+    def test_unsatisfiable_range(self):
+        for range_header in ("bytes=1024-", "bytes=200-100"):
+            response, body = self.get(range_header)
+
+            assert response.status_code == 416
+            assert response['Content-Range'] == "bytes */1024"
+
+    def test_parse_range_header(self):
+        assert parse_range_header(None, 100) is None
+        assert parse_range_header("items=0-1", 100) is None
+        assert parse_range_header("bytes=a-b", 100) is None
+        assert parse_range_header("bytes=" + ",".join(["0-1"] * 17), 100) is None
+        assert parse_range_header("bytes=0-1,200-300", 100) == [(0, 1)]
+        assert parse_range_header("bytes=-0", 100) == []
+
+    @override_settings(SENDFILE_BACKEND="x-accel-redirect", SENDFILE_URL="/protected/")
+    def test_x_accel_redirect(self):
+        with override_settings(SENDFILE_ROOT=str(self.temp_dir)):
+            response, body = self.get("bytes=0-9")
+
+        assert response.status_code == 200
+        assert response['X-Accel-Redirect'] == "/protected/tub_1.mp4"
+        assert response['Content-Type'] == "video/mp4"
+        assert body == b""
+
+        # outside of SENDFILE_ROOT
+        with override_settings(SENDFILE_ROOT=str(self.temp_dir / "movies")):
+            response, body = self.get()
+        assert 'X-Accel-Redirect' not in response
+        assert body == self.data
+
+    @override_settings(SENDFILE_BACKEND="x-sendfile")
+    def test_x_sendfile(self):
+        with override_settings(SENDFILE_ROOT=str(self.temp_dir)):
+            response, body = self.get()
+
+        assert response['X-Sendfile'] == str(self.path)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
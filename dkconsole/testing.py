@@ -0,0 +1,281 @@
+"""
+Test support shared by the apps.
+
+TempDirTestCase gives a test temporary folders and settings which are undone after it, and FakeHQ is a local stand-in
+for the HQ endpoints the console talks to.
+"""
+import hashlib
+import json
+import re
+import shutil
+import tempfile
+import threading
+import uuid
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+from django.conf import settings
+from django.test import TestCase, override_settings
+
+
+class TempDirTestCase(TestCase):
+    """
+    TestCase for tests which write files. What the helpers below set up is undone after tearDown, in reverse order,
+    so tearDown is only needed for what they do not cover.
+
+        def setUp(self):
+            self.data_dir = self.mkdtemp()
+            self.override_settings(DATA_DIR=self.data_dir)
+    """
+
+    fixture_copy_dir = None
+
+    @classmethod
+    def tearDownClass(cls):
+        if cls.fixture_copy_dir is not None:
+            shutil.rmtree(cls.fixture_copy_dir, ignore_errors=True)
+            cls.fixture_copy_dir = None
+        super().tearDownClass()
+
+    def mkdtemp(self):
+        path = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, path, ignore_errors=True)
+        return path
+
+    def override_settings(self, **kwargs):
+        settings_override = override_settings(**kwargs)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def copy_fixture_data(self):
+        """
+        Point DATA_DIR at a copy of the checked-in tubs, for tests which change them. Like the fixtures, the copy is
+        shared by the tests of the class and removed after the last one.
+        """
+        cls = type(self)
+        if cls.fixture_copy_dir is None:
+            cls.fixture_copy_dir = Path(tempfile.mkdtemp())
+            shutil.copytree(settings.DATA_DIR, cls.fixture_copy_dir / "data")
+        data_dir = cls.fixture_copy_dir / "data"
+        self.override_settings(DATA_DIR=data_dir)
+        return data_dir
+
+    def start_patches(self, *patches):
+        for p in patches:
+            p.start()
+            self.addCleanup(p.stop)
+
+    def start_hq(self):
+        hq = FakeHQ().__enter__()
+        self.addCleanup(hq.__exit__, None, None, None)
+        return hq
+
+
+class FakeHQ():
+    """
+    HQ server running on a local port, implementing the upload protocols of ChunkedUploader and DedupUploader.
+
+    Uploads are kept in memory. Part numbers in fail_parts are answered with a 500 once, to simulate a connection
+    dropping in the middle of an upload. Setting dedup to False makes it an HQ without the blob endpoints, and
+    upload_sessions to False one which only takes whole archives on /data/upload_tub. Every request is logged in
+    requests as (method, path).
+
+    It also serves the bytes in artifacts at /artifacts/<name>, with Range support and an md5 ETag.
+    drop_artifacts[name] = n sends only the first n bytes once and closes the connection.
+
+        with FakeHQ() as hq:
+            TubServiceV2.UPLOAD_SESSIONS_URL = hq.url('/data/upload_sessions')
+    """
+
+    def __init__(self):
+        self.uploads = {}
+        self.archives = {}
+        self.requests = []
+        self.fail_parts = set()
+        self.dedup = True
+        self.upload_sessions = True
+        self.blobs = {}
+        self.tubs = {}
+        self.artifacts = {}
+        self.drop_artifacts = {}
+        self.ranges = []
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), self.handler_class())
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def url(self, path):
+        host, port = self.server.server_address
+        return f"http://{host}:{port}{path}"
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def handler_class(self):
+        hq = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                hq.handle(self, 'GET')
+
+            def do_POST(self):
+                hq.handle(self, 'POST')
+
+            def do_PUT(self):
+                hq.handle(self, 'PUT')
+
+        return Handler
+
+    def routes(self):
+        return [
+            ('POST', r'/data/upload_tub', self.post_archive),
+            ('GET', r'/artifacts/(?P<name>.+)', self.get_artifact),
+        ] + ([
+            ('POST', r'/data/upload_sessions', self.create_upload),
+            ('GET', r'/data/upload_sessions/(?P<upload_id>[^/]+)', self.get_upload),
+            ('PUT', r'/data/upload_sessions/(?P<upload_id>[^/]+)/parts/(?P<part_no>\d+)', self.put_part),
+            ('POST', r'/data/upload_sessions/(?P<upload_id>[^/]+)/complete', self.complete_upload),
+        ] if self.upload_sessions else []) + ([
+            ('POST', r'/data/blobs/missing', self.get_missing_blobs),
+            ('PUT', r'/data/blobs/(?P<sha256>[0-9a-f]{64})', self.put_blob),
+            ('POST', r'/data/tub_manifests', self.create_tub),
+        ] if self.dedup else [])
+
+    def handle(self, handler, method):
+        length = int(handler.headers.get('Content-Length') or 0)
+        body = handler.rfile.read(length)
+        with self.lock:
+            self.requests.append((method, handler.path))
+
+        for route_method, pattern, view in self.routes():
+            match = re.fullmatch(pattern, handler.path)
+            if route_method == method and match:
+                result = view(handler, body, **match.groupdict())
+                if result is None:  # the view answered itself
+                    return
+                code, response = result
+                break
+        else:
+            code, response = 404, {'error': 'not found'}
+
+        data = json.dumps(response).encode()
+        handler.send_response(code)
+        handler.send_header('Content-Type', 'application/json')
+        handler.send_header('Content-Length', str(len(data)))
+        handler.end_headers()
+        handler.wfile.write(data)
+
+    def create_upload(self, handler, body):
+        upload_id = str(uuid.uuid4())
+        with self.lock:
+            self.uploads[upload_id] = {'fields': json.loads(body), 'parts': {}}
+        return 201, {'upload_id': upload_id}
+
+    def get_upload(self, handler, body, upload_id):
+        if upload_id not in self.uploads:
+            return 404, {'error': 'unknown upload'}
+        parts = self.uploads[upload_id]['parts']
+        return 200, {'parts': {part_no: hashlib.sha256(data).hexdigest() for part_no, data in parts.items()}}
+
+    def put_part(self, handler, body, upload_id, part_no):
+        part_no = int(part_no)
+        with self.lock:
+            if part_no in self.fail_parts:
+                self.fail_parts.remove(part_no)
+                return 500, {'error': 'connection lost'}
+        if upload_id not in self.uploads:
+            return 404, {'error': 'unknown upload'}
+
+        checksum = hashlib.sha256(body).hexdigest()
+        if checksum != handler.headers.get('X-Checksum-Sha256'):
+            return 400, {'error': 'checksum mismatch'}
+        with self.lock:
+            self.uploads[upload_id]['parts'][part_no] = body
+        return 200, {'part_no': part_no, 'sha256': checksum}
+
+    def complete_upload(self, handler, body, upload_id):
+        if upload_id not in self.uploads:
+            return 404, {'error': 'unknown upload'}
+        upload = self.uploads[upload_id]
+        fields = upload['fields']
+
+        if sorted(upload['parts']) != list(range(fields['no_of_parts'])):
+            return 400, {'error': 'missing parts'}
+        archive = b''.join(upload['parts'][part_no] for part_no in sorted(upload['parts']))
+        if hashlib.sha256(archive).hexdigest() != fields['sha256']:
+            return 400, {'error': 'checksum mismatch'}
+
+        with self.lock:
+            self.archives[fields['tub_name']] = archive
+            del self.uploads[upload_id]
+        return 200, {'uuid': str(uuid.uuid4())}
+
+    def post_archive(self, handler, body):
+        message = BytesParser(policy=HTTP).parsebytes(
+            f"Content-Type: {handler.headers['Content-Type']}\r\n\r\n".encode() + body)
+        fields = {part.get_param('name', header='content-disposition'): part.get_payload(decode=True)
+                  for part in message.iter_parts()}
+
+        with self.lock:
+            self.archives[fields['tub_name'].decode()] = fields['tub_archive_file']
+        return 200, {'uuid': str(uuid.uuid4())}
+
+    def get_missing_blobs(self, handler, body):
+        hashes = json.loads(body)['hashes']
+        return 200, {'missing': [sha256 for sha256 in hashes if sha256 not in self.blobs]}
+
+    def put_blob(self, handler, body, sha256):
+        if hashlib.sha256(body).hexdigest() != sha256:
+            return 400, {'error': 'checksum mismatch'}
+        with self.lock:
+            self.blobs[sha256] = body
+        return 201, {'sha256': sha256}
+
+    def create_tub(self, handler, body):
+        fields = json.loads(body)
+        missing = [path for path, sha256 in fields['files'].items() if sha256 not in self.blobs]
+        if missing:
+            return 400, {'error': 'missing blobs', 'missing': missing}
+
+        with self.lock:
+            self.tubs[fields['tub_name']] = {path: self.blobs[sha256] for path, sha256 in fields['files'].items()}
+        return 200, {'uuid': str(uuid.uuid4())}
+
+    def get_artifact(self, handler, body, name):
+        if name not in self.artifacts:
+            return 404, {'error': 'unknown artifact'}
+        data = self.artifacts[name]
+        start = 0
+        range_header = handler.headers.get('Range')
+        self.ranges.append(range_header)
+        if range_header:
+            start = int(re.fullmatch(r'bytes=(\d+)-', range_header).group(1))
+            if start >= len(data):
+                return 416, {'error': 'range not satisfiable'}
+
+        handler.send_response(206 if range_header else 200)
+        handler.send_header('Content-Type', 'application/octet-stream')
+        handler.send_header('Content-Length', str(len(data) - start))
+        handler.send_header('ETag', f'"{hashlib.md5(data).hexdigest()}"')
+        if range_header:
+            handler.send_header('Content-Range', f'bytes {start}-{len(data) - 1}/{len(data)}')
+        handler.end_headers()
+
+        with self.lock:
+            drop = self.drop_artifacts.pop(name, None)
+        if drop is not None:
+            handler.wfile.write(data[start:drop])
+            handler.wfile.flush()
+            handler.close_connection = True
+            return None
+        handler.wfile.write(data[start:])
+        return None
@@ -0,0 +1,198 @@
+import fcntl
+import hashlib
+import logging
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import requests
+from django.conf import settings
+from django.db import close_old_connections
+from rest_framework import status
+
+from dkconsole.hq_client import hq_client
+from .models import Job, DownloadStatus
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 256 * 1024
+# downloaded_bytes is saved on the job every PROGRESS_STEP bytes
+PROGRESS_STEP = 4 * 1024 * 1024
+
+
+class DownloadError(Exception):
+    pass
+
+
+class DownloadInProgress(DownloadError):
+    pass
+
+
+def hash_file(path, algorithm):
+    h = hashlib.new(algorithm)
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def get_etag_md5(response):
+    """
+    md5 of the content when the ETag is one, as S3 does for objects which were not uploaded in parts
+    """
+    etag = response.headers.get('ETag', '').strip('"')
+    if re.fullmatch(r'[0-9a-f]{32}', etag):
+        return etag
+    return None
+
+
+def download_file(url, target_path, expected_sha256=None, on_progress=None):
+    """
+    Download url to target_path.
+
+    The content goes to target_path + '.part' first and is only renamed to target_path once its size and hash are
+    verified, so target_path is either missing or complete. A .part file left by an interrupted download is resumed
+    with a Range request. The size is checked against Content-Length / Content-Range, the content against
+    expected_sha256 and against the ETag when it is an md5. A .part which fails verification is deleted.
+    """
+    target_path = Path(target_path)
+    part_path = target_path.with_name(target_path.name + '.part')
+    target_path.parent.mkdir(parents=True, exist_ok=True)
+
+    with open(part_path, 'ab') as f:
+        try:
+            # another console process may be downloading the same file
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            raise DownloadInProgress(f"{part_path} is being downloaded already")
+
+        offset = f.tell()
+        headers = {'Range': f'bytes={offset}-'} if offset else {}
+        r = hq_client.get(url, endpoint='train/artifacts', headers=headers, stream=True)
+        try:
+            if r.status_code == status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE:
+                # the .part is not a prefix of the file any more
+                f.truncate(0)
+                raise DownloadError(f"Range not satisfiable for {url}, restarting from scratch next time")
+            if r.status_code == status.HTTP_206_PARTIAL_CONTENT:
+                total_size = int(r.headers['Content-Range'].rsplit('/', 1)[1])
+                logger.info(f"Resuming download of {target_path.name} at {offset}/{total_size}")
+            elif r.status_code == status.HTTP_200_OK:
+                f.truncate(0)
+                offset = 0
+                total_size = int(r.headers['Content-Length']) if 'Content-Length' in r.headers else None
+            else:
+                raise DownloadError(f"GET {url} failed with {r.status_code}")
+
+            size = offset
+            try:
+                for chunk in r.iter_content(CHUNK_SIZE):
+                    f.write(chunk)
+                    size += len(chunk)
+                    if on_progress:
+                        on_progress(size, total_size)
+            except requests.RequestException as e:
+                # what was received is kept in the .part and resumed next time
+                raise DownloadError(f"Download of {target_path.name} interrupted at {size} bytes: {e}")
+            finally:
+                f.flush()
+            os.fsync(f.fileno())
+        finally:
+            r.close()
+
+        try:
+            if total_size is not None and size != total_size:
+                raise DownloadError(f"{target_path.name} is {size} bytes instead of {total_size}")
+            if expected_sha256 and hash_file(part_path, 'sha256') != expected_sha256:
+                raise DownloadError(f"sha256 of {target_path.name} does not match")
+            md5 = get_etag_md5(r)
+            if md5 and hash_file(part_path, 'md5') != md5:
+                raise DownloadError(f"md5 of {target_path.name} does not match its ETag")
+        except DownloadError:
+            os.remove(part_path)
+            raise
+
+        os.replace(part_path, target_path)
+    return size
+
+
+class ModelDownloads():
+    """
+    Downloads of the artifacts of completed jobs, on a pool of TRAIN_DOWNLOAD_WORKERS threads.
+
+    A job is downloaded once at a time and artifacts already on disk are not downloaded again. The state of the
+    download is recorded on the Job (download_status, downloaded_bytes, download_error).
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.executor = None
+        self.active = set()
+
+    def get_executor(self):
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=max(1, settings.TRAIN_DOWNLOAD_WORKERS),
+                                               thread_name_prefix='model_download')
+        return self.executor
+
+    def submit(self, job):
+        """
+        Queue the download of job, returns False when it is queued or running already
+        """
+        with self.lock:
+            if job.id in self.active:
+                return False
+            self.active.add(job.id)
+            Job.objects.filter(id=job.id).update(download_status=DownloadStatus.PENDING, download_error=None)
+            self.get_executor().submit(self.run, job.id)
+        return True
+
+    def get_artifacts(self, job):
+        """
+        (url, target path, expected sha256) of each artifact of the job
+        """
+        artifacts = [
+            (job.model_url, Path(settings.MODEL_DIR) / f"job_{job.id}.h5", job.model_sha256),
+            (job.model_accuracy_url, Path(settings.MODEL_DIR) / f"job_{job.id}.png", None),
+            (job.model_movie_url, Path(settings.MOVIE_DIR) / f"job_{job.id}.mp4", None),
+        ]
+        return [artifact for artifact in artifacts if artifact[0]]
+
+    def run(self, job_id):
+        close_old_connections()
+        try:
+            job = Job.objects.get(id=job_id)
+            Job.objects.filter(id=job_id).update(download_status=DownloadStatus.DOWNLOADING)
+
+            downloaded_bytes = 0
+            for url, target_path, expected_sha256 in self.get_artifacts(job):
+                if target_path.exists():
+                    downloaded_bytes += target_path.stat().st_size
+                    continue
+
+                saved = [0]
+
+                def on_progress(size, total_size, done=downloaded_bytes):
+                    if size - saved[0] >= PROGRESS_STEP:
+                        saved[0] = size
+                        Job.objects.filter(id=job_id).update(downloaded_bytes=done + size)
+
+                downloaded_bytes += download_file(url, target_path, expected_sha256, on_progress=on_progress)
+
+            Job.objects.filter(id=job_id).update(download_status=DownloadStatus.COMPLETED,
+                                                 downloaded_bytes=downloaded_bytes)
+            logger.info(f"Downloaded the artifacts of job {job_id}")
+        except DownloadInProgress as e:
+            logger.info(f"Job {job_id}: {e}")
+        except Exception as e:
+            logger.error(f"Failed to download the artifacts of job {job_id}: {e}")
+            Job.objects.filter(id=job_id).update(download_status=DownloadStatus.FAILED, download_error=str(e)[:2000])
+        finally:
+            with self.lock:
+                self.active.discard(job_id)
+            close_old_connections()
+
+
+model_downloads = ModelDownloads()
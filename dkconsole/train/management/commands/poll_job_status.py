@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from dkconsole.train.poller import JobStatusPoller
+
+
+class Command(BaseCommand):
+    help = "Refresh the status of outstanding training jobs from HQ, in a loop or --once"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help="poll once and exit")
+
+    def handle(self, *args, **options):
+        poller = JobStatusPoller()
+        if options['once']:
+            interval = poller.poll_once()
+            self.stdout.write(f"Next poll in {interval}s")
+            return
+
+        poller.run()
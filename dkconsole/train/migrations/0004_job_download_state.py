@@ -0,0 +1,33 @@
+# Generated by Django 3.0.4 on 2026-10-18 12:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('train', '0003_job_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='job',
+            name='download_error',
+            field=models.CharField(blank=True, max_length=2000, null=True),
+        ),
+        migrations.AddField(
+            model_name='job',
+            name='download_status',
+            field=models.CharField(blank=True, max_length=20, null=True),
+        ),
+        migrations.AddField(
+            model_name='job',
+            name='downloaded_bytes',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='job',
+            name='model_sha256',
+            field=models.CharField(blank=True, max_length=64, null=True),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 3.0.4 on 2026-10-18 12:49
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('train', '0004_job_download_state'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='job',
+            name='created_at',
+            field=models.DateTimeField(db_index=True, default=django.utils.timezone.now),
+        ),
+        migrations.AlterField(
+            model_name='job',
+            name='status',
+            field=models.CharField(db_index=True, max_length=20),
+        ),
+    ]
@@ -18,20 +18,39 @@ class JobStatus():   # A subclass of Enum
     OS_STATUSES = [SCHEDULED, TRAINING]
 
 
+class DownloadStatus():
+    """
+    State of the download of the artifacts (model, accuracy plot and movie) of a completed job
+    """
+    PENDING = "PENDING"
+    DOWNLOADING = "DOWNLOADING"
+    COMPLETED = "COMPLETED"
+    FAILED = "FAILED"
+
+    # resumed automatically, e.g. after a restart. FAILED downloads are only retried on request, as a checksum
+    # mismatch or a 404 would fail again on every poll
+    UNFINISHED_STATUSES = [PENDING, DOWNLOADING]
+
+
 # Create your models here.
 class Job(models.Model):
     tub_paths = models.CharField(max_length=2000)
     status = models.CharField(
         max_length=20,
+        db_index=True,
         #   choices=[(tag, tag.value) for tag in JobStatus]  # Choices is a list of Tuple
     )
-    created_at = models.DateTimeField(default=timezone.now)
+    created_at = models.DateTimeField(default=timezone.now, db_index=True)
     updated_at = models.DateTimeField(auto_now=True)
     model_size = models.FloatField(null=True, blank=True)
     model_url = models.CharField(max_length=2000, null = True)
     model_accuracy_url = models.CharField(max_length=2000, null = True)
     model_movie_url = models.CharField(max_length=2000, null = True)
     uuid = models.UUIDField(null=True, blank=True)
+    model_sha256 = models.CharField(max_length=64, null=True, blank=True)
+    download_status = models.CharField(max_length=20, null=True, blank=True)
+    download_error = models.CharField(max_length=2000, null=True, blank=True)
+    downloaded_bytes = models.BigIntegerField(default=0)
 
     class Meta:
         ordering = ['-created_at']
@@ -0,0 +1,106 @@
+import fcntl
+import logging
+import os
+import threading
+
+from django.conf import settings
+from django.db import close_old_connections
+
+logger = logging.getLogger(__name__)
+
+
+class PollLock():
+    """
+    Exclusive lock on TRAIN_POLL_LOCK_FILE, so only one thread of one console process talks to HQ about jobs at a
+    time. It does not wait: entering returns whether the lock was acquired.
+
+        with PollLock() as acquired:
+            if acquired:
+                ...
+    """
+
+    def __init__(self, path=None):
+        self.path = path or settings.TRAIN_POLL_LOCK_FILE
+        self.fd = None
+        self.acquired = False
+
+    def __enter__(self):
+        self.fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(self.fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            self.acquired = True
+        except BlockingIOError:
+            self.acquired = False
+        return self.acquired
+
+    def __exit__(self, type, value, traceback):
+        if self.acquired:
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
+        os.close(self.fd)
+        self.fd = None
+        self.acquired = False
+
+
+class JobStatusPoller():
+    """
+    Background thread refreshing the status of outstanding training jobs from HQ. Unfinished model downloads are
+    resumed on every poll as well.
+
+    The interval adapts: TRAIN_POLL_MIN_INTERVAL right after a job changed, doubled every time nothing changed, up
+    to TRAIN_POLL_MAX_INTERVAL, which is also used while there is no outstanding job. wake() polls right away, e.g.
+    after a job got submitted.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.wake_event = threading.Event()
+        self.thread = None
+        self.interval = None
+
+    def start(self):
+        with self.lock:
+            if self.thread is not None and self.thread.is_alive():
+                return
+            self.thread = threading.Thread(target=self.run, name='job_status_poller', daemon=True)
+            self.thread.start()
+        logger.info("Job status poller started")
+
+    def wake(self):
+        self.interval = None
+        self.wake_event.set()
+
+    def run(self):
+        while True:
+            interval = self.poll_once()
+            self.wake_event.wait(interval)
+            self.wake_event.clear()
+
+    def poll_once(self):
+        """
+        Refresh the outstanding jobs once and return the number of seconds to wait before the next poll
+        """
+        from .services import TrainService
+
+        close_old_connections()
+        try:
+            TrainService.resume_downloads()
+            if TrainService.count_outstanding_jobs() == 0:
+                self.interval = None
+                return settings.TRAIN_POLL_MAX_INTERVAL
+
+            changed = TrainService.refresh_all_job_status()
+            if changed or self.interval is None:
+                self.interval = settings.TRAIN_POLL_MIN_INTERVAL
+            else:
+                self.interval = min(self.interval * 2, settings.TRAIN_POLL_MAX_INTERVAL)
+        except Exception as e:
+            logger.error(f"Failed to refresh job status: {e}")
+            self.interval = min((self.interval or settings.TRAIN_POLL_MIN_INTERVAL) * 2,
+                                settings.TRAIN_POLL_MAX_INTERVAL)
+        finally:
+            close_old_connections()
+
+        return self.interval
+
+
+job_status_poller = JobStatusPoller()
@@ -1,15 +1,21 @@
+import os
+
 from django.conf import settings
 from rest_framework import serializers
 
 from .models import Job
-from .services import TrainService
 
 
 class JobSerializer(serializers.ModelSerializer):
+    """
+    Pass TrainService.get_artifact_names() as context when serializing many jobs, otherwise the artifacts of every
+    job are looked up on disk one by one
+    """
     name = serializers.SerializerMethodField()
     train_duration = serializers.SerializerMethodField()
     model_path = serializers.SerializerMethodField()
     model_movie_path = serializers.SerializerMethodField()
+    model_downloaded = serializers.SerializerMethodField()
 
     def get_name(self, job):
         return f"Job #{job.id}"
@@ -19,18 +25,30 @@ class JobSerializer(serializers.ModelSerializer):
 
     def get_model_path(self, job):
         if job.model_url is not None:
-            return settings.MODEL_DIR + f"/job_{job.id}.h5"
+            return f"{settings.MODEL_DIR}/job_{job.id}.h5"
         else:
             return None
 
     def get_model_movie_path(self, job):
-        return TrainService.get_model_movie_path(job.id)
+        if self.has_artifact('movie_files', settings.MOVIE_DIR, f"job_{job.id}.mp4"):
+            return f"{settings.MOVIE_DIR}/job_{job.id}.mp4"
+        else:
+            return None
+
+    def get_model_downloaded(self, job):
+        return self.has_artifact('model_files', settings.MODEL_DIR, f"job_{job.id}.h5")
+
+    def has_artifact(self, key, directory, name):
+        if key in self.context:
+            return name in self.context[key]
+        return os.path.isfile(os.path.join(directory, name))
 
     class Meta:
         model = Job
 
         fields = ['id', 'name', 'uuid', 'tub_paths', 'status', 'created_at',
-                  'model_url', 'model_accuracy_url', 'model_path', 'model_movie_path', 'train_duration']
+                  'model_url', 'model_accuracy_url', 'model_path', 'model_movie_path', 'model_downloaded',
+                  'download_status', 'downloaded_bytes', 'train_duration']
 
         ordering = ['-created']
 
@@ -1,19 +1,21 @@
 import json
 import logging
 import os
-import subprocess
 import uuid
 from pathlib import Path
 
-import requests
 from django.conf import settings
+from django.utils import timezone
 from requests_toolbelt.multipart.encoder import MultipartEncoder
 from rest_framework import status
 
 # DI
+from dkconsole.hq_client import hq_client
 from dkconsole.service_factory import factory
 from dkconsole.vehicle.vehicle_service import VehicleService
-from .models import Job, JobStatus
+from .downloads import model_downloads, download_file
+from .models import Job, JobStatus, DownloadStatus
+from .poller import PollLock, job_status_poller
 
 vehicle_service: VehicleService = factory.create('vehicle_service')
 
@@ -21,24 +23,26 @@ logger = logging.getLogger(__name__)
 
 
 class TrainService():
-    refresh_lock = False
     MODEL_DIR = settings.MODEL_DIR
     MOVIE_DIR = settings.MOVIE_DIR
     REFRESH_JOB_STATUS_URL = f'{settings.HQ_BASE_URL}/train/refresh_job_statuses'
     SUBMIT_JOB_URL = f'{settings.HQ_BASE_URL}/train/submit_job'
+    # Job fields refreshed from the job statuses sent by HQ
+    REFRESH_FIELDS = ('status', 'model_url', 'model_accuracy_url', 'model_movie_url', 'model_sha256')
 
     vehicle_service = factory.create('vehicle_service')
     tub_service = factory.create('tub_service')
 
     @classmethod
     def get_jobs(cls):
-        try:
-            cls.refresh_all_job_status()
-        except Exception as e:
-            print(e)
+        """
+        Jobs as stored, their status is kept up to date by the job status poller
+        """
+        return Job.objects.all()
 
-        jobs = Job.objects.all()
-        return jobs
+    @classmethod
+    def count_outstanding_jobs(cls):
+        return Job.objects.filter(status__in=JobStatus.OS_STATUSES, uuid__isnull=False).count()
 
     @classmethod
     def create_job(cls, tub_paths):
@@ -62,22 +66,24 @@ class TrainService():
 
         filename = cls.tub_service.generate_tub_archive(tub_paths)
 
-        mp_encoder = MultipartEncoder(
-            fields={
-                'device_id': cls.vehicle_service.get_wlan_mac_address(),
-                'hostname': cls.vehicle_service.get_hostname(),
-                'tub_archive_file': ('file.tar.gz', open(filename, 'rb'), 'application/gzip'),
-                'donkeycar_version': str(vehicle_service.get_donkeycar_version())
-            }
-        )
-
-        logger.debug("Posting job to HQ")
-        r = requests.post(
-            cls.SUBMIT_JOB_URL,
-            data=mp_encoder,  # The MultipartEncoder is posted as data, don't use files=...!
-            # The MultipartEncoder provides the content-type header with the boundary:
-            headers={'Content-Type': mp_encoder.content_type}
-        )
+        with open(filename, 'rb') as f:
+            mp_encoder = MultipartEncoder(
+                fields={
+                    'device_id': cls.vehicle_service.get_wlan_mac_address(),
+                    'hostname': cls.vehicle_service.get_hostname(),
+                    'tub_archive_file': ('file.tar.gz', f, 'application/gzip'),
+                    'donkeycar_version': str(vehicle_service.get_donkeycar_version())
+                }
+            )
+
+            logger.debug("Posting job to HQ")
+            r = hq_client.post(
+                cls.SUBMIT_JOB_URL,
+                endpoint='train/submit_job',
+                data=mp_encoder,  # The MultipartEncoder is posted as data, don't use files=...!
+                # The MultipartEncoder provides the content-type header with the boundary:
+                headers={'Content-Type': mp_encoder.content_type}
+            )
 
         if r.status_code == status.HTTP_200_OK:
             if "job_uuid" in r.json():
@@ -86,6 +92,7 @@ class TrainService():
                     uuid.UUID(r.json()['job_uuid'], version=4)
                     job.uuid = r.json()['job_uuid']
                     job.save()
+                    job_status_poller.wake()
                 except Exception as e:
                     print(e)
                     raise Exception("Failed to call submit job")
@@ -101,32 +108,35 @@ class TrainService():
         filename = f"{settings.CARAPP_PATH}/myconfig.py"
 
         try:
-            data = [
-                ('myconfig_file', ('myconfig.py', open(filename, 'rb'), 'text/plain')),
-                ('device_id', cls.vehicle_service.get_wlan_mac_address()),
-                ('hostname', cls.vehicle_service.get_hostname()),
-                ('donkeycar_version', str(vehicle_service.get_donkeycar_version())),
-            ]
-            for _ in tub_uuids:
-                data.append(('tub_uuids', _))
-
-            mp_encoder = MultipartEncoder(
-                fields=data
-            )
-
-            logger.debug("Posting job to HQ")
-            r = requests.post(
-                cls.SUBMIT_JOB_URL,
-                data=mp_encoder,  # The MultipartEncoder is posted as data, don't use files=...!
-                # The MultipartEncoder provides the content-type header with the boundary:
-                headers={'Content-Type': mp_encoder.content_type}
-            )
+            with open(filename, 'rb') as f:
+                data = [
+                    ('myconfig_file', ('myconfig.py', f, 'text/plain')),
+                    ('device_id', cls.vehicle_service.get_wlan_mac_address()),
+                    ('hostname', cls.vehicle_service.get_hostname()),
+                    ('donkeycar_version', str(vehicle_service.get_donkeycar_version())),
+                ]
+                for _ in tub_uuids:
+                    data.append(('tub_uuids', _))
+
+                mp_encoder = MultipartEncoder(
+                    fields=data
+                )
+
+                logger.debug("Posting job to HQ")
+                r = hq_client.post(
+                    cls.SUBMIT_JOB_URL,
+                    endpoint='train/submit_job',
+                    data=mp_encoder,  # The MultipartEncoder is posted as data, don't use files=...!
+                    # The MultipartEncoder provides the content-type header with the boundary:
+                    headers={'Content-Type': mp_encoder.content_type}
+                )
 
             if r.status_code == status.HTTP_200_OK:
                 if "job_uuid" in r.json():
                     uuid.UUID(r.json()['job_uuid'], version=4)
                     job.uuid = r.json()['job_uuid']
                     job.save()
+                    job_status_poller.wake()
                 else:
                     raise Exception("Failed to call submit job")
             else:
@@ -144,56 +154,85 @@ class TrainService():
 
     @classmethod
     def refresh_all_job_status(cls):
-        if cls.refresh_lock is False:
-            try:
-                cls.refresh_lock = True  # lock this function to prevent other thread calling the same time. E.g. mobile app user pull-to-refresh twice accidentally
-                jobs = Job.objects.filter(status__in=JobStatus.OS_STATUSES)
-                print([job.uuid for job in jobs])
-                if len(jobs) > 0:
-                    job_uuids = [str(job.uuid) for job in jobs if job.uuid is not None]
-                    updated_jobs = cls.get_latest_job_status_from_hq(job_uuids)
-
-                    for result in updated_jobs:
-                        if ("uuid" in result):
-                            job = Job.objects.get(uuid=result['uuid'])
-                            job.status = result['status']
-                            job.model_url = result['model_url']
-                            job.model_accuracy_url = result['model_accuracy_url']
-                            job.model_movie_url = result['model_movie_url']
-                            job.save()
-
-                            # Background download h5, model accuracy url and etc
-                            if job.status == JobStatus.COMPLETED:
-                                cls.download_model(job)
-
-            finally:
-                cls.refresh_lock = False
+        """
+        Update the outstanding jobs from HQ and return how many changed status.
+
+        The status of every outstanding job is asked for in one request and the changed fields of the changed jobs
+        are written back with one bulk_update, so a refresh costs the same whatever the number of jobs in history.
+
+        Nothing is done when another thread or process is refreshing already (PollLock).
+        """
+        with PollLock() as acquired:
+            if not acquired:
+                logger.debug("Job status refresh already running")
+                return 0
+
+            jobs = {str(job.uuid): job
+                    for job in Job.objects.filter(status__in=JobStatus.OS_STATUSES, uuid__isnull=False)}
+            if not jobs:
+                return 0
+
+            updated_jobs = cls.get_latest_job_status_from_hq(list(jobs))
+
+            changed = 0
+            changed_jobs = []
+            changed_fields = set()
+            for result in updated_jobs:
+                job = jobs.get(str(result.get('uuid')).lower())
+                if job is None:
+                    continue
+
+                if job.status != result.get('status', job.status):
+                    changed += 1
+                fields = [field for field in cls.REFRESH_FIELDS
+                          if field in result and getattr(job, field) != result[field]]
+                for field in fields:
+                    setattr(job, field, result[field])
+                if fields:
+                    changed_jobs.append(job)
+                    changed_fields.update(fields)
+
+            if changed_jobs:
+                # bulk_update does not touch auto_now fields
+                now = timezone.now()
+                for job in changed_jobs:
+                    job.updated_at = now
+                Job.objects.bulk_update(changed_jobs, sorted(changed_fields) + ['updated_at'])
+
+            # Background download h5, model accuracy url and etc
+            for job in changed_jobs:
+                if job.status == JobStatus.COMPLETED:
+                    cls.download_model(job)
+
+            return changed
 
     @classmethod
     def download_model(cls, job):
-        print(type(cls.MODEL_DIR))
-        cls.download_file(job.model_url, f"{cls.MODEL_DIR}/job_{job.id}.h5")
-        cls.download_file(job.model_accuracy_url, f"{cls.MODEL_DIR}/job_{job.id}.png")
-        # cls.download_file(job.model_myconfig_url, f"{cls.MODEL_DIR}/job_{job.id}.myconfig.py")
+        """
+        Download the model, accuracy plot and movie of a completed job in the background
+        """
+        return model_downloads.submit(job)
 
-        if not os.path.isdir(cls.MOVIE_DIR):
-            logger.info(f"Creating movie folder {cls.MOVIE_DIR}")
-            os.mkdir(cls.MOVIE_DIR)
-
-        cls.download_file(job.model_movie_url, f"{cls.MOVIE_DIR}/job_{job.id}.mp4")
-        # cls.download_file()
+    @classmethod
+    def resume_downloads(cls):
+        """
+        Queue the downloads which were interrupted, e.g. by a restart. Failed downloads are retried with
+        download_model only.
+        """
+        jobs = Job.objects.filter(status=JobStatus.COMPLETED, download_status__in=DownloadStatus.UNFINISHED_STATUSES)
+        return len([job for job in jobs if cls.download_model(job)])
 
     @classmethod
     def download_file(cls, url, target_path):
         logger.debug(f"Downloading file from {url} to {target_path}")
-        command = ["curl", "--fail", url, "--output", target_path]
-        proc = subprocess.Popen(command)
+        return download_file(url, target_path)
 
     @classmethod
     def get_latest_job_status_from_hq(cls, job_uuids):
         print(f"Getting lastest job status for uuid {job_uuids}")
         # job_uuids = [job_uuid for job_uuid in job_uuids if job_uuid]
-        response = requests.post(cls.REFRESH_JOB_STATUS_URL, data={"job_uuids": job_uuids})
+        response = hq_client.post(cls.REFRESH_JOB_STATUS_URL, endpoint='train/refresh_job_statuses', idempotent=True,
+                                  data={"job_uuids": job_uuids})
         if response.status_code == status.HTTP_200_OK:
             return response.json()
         else:
@@ -207,11 +246,26 @@ class TrainService():
             jobWillDelete = Job.objects.get(id=id)
             jobWillDelete.delete()
 
+    @classmethod
+    def get_artifact_names(cls):
+        """
+        Names of the files in MODEL_DIR and MOVIE_DIR, each read with a single scandir, so the job list can tell
+        which artifacts are on disk without a stat per job
+        """
+        names = {}
+        for key, directory in (('model_files', settings.MODEL_DIR), ('movie_files', settings.MOVIE_DIR)):
+            try:
+                with os.scandir(directory) as entries:
+                    names[key] = {entry.name for entry in entries}
+            except FileNotFoundError:
+                names[key] = set()
+        return names
+
     @classmethod
     def get_model_movie_path(cls, job_id):
         job = Job.objects.get(id=job_id)
 
-        model_movie_path = settings.MOVIE_DIR + f"/job_{job.id}.mp4"
+        model_movie_path = f"{settings.MOVIE_DIR}/job_{job.id}.mp4"
 
         if os.path.isfile(model_movie_path):
             return model_movie_path
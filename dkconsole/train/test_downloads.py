@@ -0,0 +1,117 @@
+import hashlib
+import os
+import uuid
+from unittest.mock import patch
+
+from dkconsole.testing import TempDirTestCase
+from .downloads import download_file, DownloadError, ModelDownloads
+from .models import Job, JobStatus, DownloadStatus
+from .services import TrainService
+
+
+class TestDownloadFile(TempDirTestCase):
+
+    def setUp(self):
+        self.target_dir = self.mkdtemp()
+        self.target_path = self.target_dir / "job_1.h5"
+        self.part_path = self.target_dir / "job_1.h5.part"
+        self.data = os.urandom(1024 * 1024)
+
+        self.hq = self.start_hq()
+        self.hq.artifacts["job_1.h5"] = self.data
+        self.url = self.hq.url("/artifacts/job_1.h5")
+
+    def test_download(self):
+        size = download_file(self.url, self.target_path, hashlib.sha256(self.data).hexdigest())
+
+        assert size == len(self.data)
+        assert self.target_path.read_bytes() == self.data
+        assert not self.part_path.exists()
+
+    def test_interrupted_download_is_resumed(self):
+        self.hq.drop_artifacts["job_1.h5"] = 512 * 1024
+
+        with self.assertRaises(DownloadError):
+            download_file(self.url, self.target_path)
+
+        # the target is never left half written
+        assert not self.target_path.exists()
+        assert self.part_path.stat().st_size == 512 * 1024
+
+        download_file(self.url, self.target_path)
+
+        assert self.hq.ranges == [None, f"bytes={512 * 1024}-"]
+        assert self.target_path.read_bytes() == self.data
+        assert not self.part_path.exists()
+
+    def test_corrupted_download_is_discarded(self):
+        with self.assertRaises(DownloadError):
+            download_file(self.url, self.target_path, hashlib.sha256(b"something else").hexdigest())
+
+        assert not self.target_path.exists()
+        assert not self.part_path.exists()
+
+    def test_stale_part_does_not_match_etag(self):
+        self.part_path.write_bytes(os.urandom(1024))
+
+        with self.assertRaises(DownloadError):
+            download_file(self.url, self.target_path)
+
+        assert not self.target_path.exists()
+        assert not self.part_path.exists()
+
+
+class TestModelDownloads(TempDirTestCase):
+
+    def setUp(self):
+        self.model_dir = self.mkdtemp()
+        self.movie_dir = self.mkdtemp()
+        self.override_settings(MODEL_DIR=self.model_dir, MOVIE_DIR=self.movie_dir)
+
+        self.hq = self.start_hq()
+        self.hq.artifacts = {"model.h5": b"model" * 1000, "accuracy.png": b"png", "movie.mp4": b"mp4" * 1000}
+        self.job = Job(uuid="19460b57-27fa-4e7d-8a79-9434af0f9629", status=JobStatus.COMPLETED,
+                       model_url=self.hq.url("/artifacts/model.h5"),
+                       model_accuracy_url=self.hq.url("/artifacts/accuracy.png"),
+                       model_movie_url=self.hq.url("/artifacts/movie.mp4"),
+                       model_sha256=hashlib.sha256(b"model" * 1000).hexdigest())
+        self.job.save()
+
+    def test_run(self):
+        ModelDownloads().run(self.job.id)
+
+        job = Job.objects.get(id=self.job.id)
+        assert job.download_status == DownloadStatus.COMPLETED
+        assert job.downloaded_bytes == sum(len(data) for data in self.hq.artifacts.values())
+        assert (self.model_dir / f"job_{self.job.id}.h5").read_bytes() == self.hq.artifacts["model.h5"]
+        assert (self.model_dir / f"job_{self.job.id}.png").read_bytes() == b"png"
+        assert (self.movie_dir / f"job_{self.job.id}.mp4").read_bytes() == self.hq.artifacts["movie.mp4"]
+
+    def test_existing_artifacts_are_not_downloaded_again(self):
+        (self.model_dir / f"job_{self.job.id}.h5").write_bytes(self.hq.artifacts["model.h5"])
+
+        ModelDownloads().run(self.job.id)
+
+        assert ('GET', '/artifacts/model.h5') not in self.hq.requests
+        assert Job.objects.get(id=self.job.id).download_status == DownloadStatus.COMPLETED
+
+    def test_failed_download(self):
+        self.job.model_sha256 = hashlib.sha256(b"something else").hexdigest()
+        self.job.save()
+
+        ModelDownloads().run(self.job.id)
+
+        job = Job.objects.get(id=self.job.id)
+        assert job.download_status == DownloadStatus.FAILED
+        assert "sha256" in job.download_error
+        assert not (self.model_dir / f"job_{self.job.id}.h5").exists()
+
+    def test_failed_download_is_not_resumed(self):
+        Job.objects.filter(id=self.job.id).update(download_status=DownloadStatus.FAILED)
+        pending = Job(uuid=uuid.uuid4(), status=JobStatus.COMPLETED, download_status=DownloadStatus.PENDING)
+        pending.save()
+
+        with patch.object(TrainService, 'download_model', return_value=True) as mock_download_model:
+            assert TrainService.resume_downloads() == 1
+
+        assert mock_download_model.call_args[0][0].id == pending.id
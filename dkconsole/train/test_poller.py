@@ -0,0 +1,66 @@
+from unittest.mock import patch
+
+from django.test import TestCase, override_settings
+
+from .models import Job, JobStatus
+from .poller import PollLock, JobStatusPoller
+from .services import TrainService
+
+
+@override_settings(TRAIN_POLL_MIN_INTERVAL=30, TRAIN_POLL_MAX_INTERVAL=600)
+class TestJobStatusPoller(TestCase):
+    job_uuid = "19460b57-27fa-4e7d-8a79-9434af0f9629"
+
+    def hq_result(self, status):
+        return [{"uuid": self.job_uuid, "status": status, "model_url": None, "model_accuracy_url": None,
+                 "model_movie_url": None}]
+
+    def test_lock_is_exclusive(self):
+        with PollLock() as first:
+            with PollLock() as second:
+                assert first is True
+                assert second is False
+
+        with PollLock() as again:
+            assert again is True
+
+    def test_idle_without_outstanding_jobs(self):
+        poller = JobStatusPoller()
+
+        with patch.object(TrainService, 'get_latest_job_status_from_hq') as mock_get_latest_job_status_from_hq:
+            assert poller.poll_once() == 600
+            mock_get_latest_job_status_from_hq.assert_not_called()
+
+    def test_adaptive_interval(self):
+        Job(uuid=self.job_uuid, status=JobStatus.SCHEDULED).save()
+        poller = JobStatusPoller()
+
+        with patch.object(TrainService, 'get_latest_job_status_from_hq') as mock_get_latest_job_status_from_hq:
+            mock_get_latest_job_status_from_hq.return_value = self.hq_result(JobStatus.SCHEDULED)
+            assert poller.poll_once() == 30
+            assert poller.poll_once() == 60
+            assert poller.poll_once() == 120
+
+            mock_get_latest_job_status_from_hq.return_value = self.hq_result(JobStatus.TRAINING)
+            assert poller.poll_once() == 30
+
+            poller.wake()
+            mock_get_latest_job_status_from_hq.return_value = self.hq_result(JobStatus.TRAINING)
+            assert poller.poll_once() == 30
+
+        assert Job.objects.get(uuid=self.job_uuid).status == JobStatus.TRAINING
+
+    def test_hq_error_backs_off(self):
+        Job(uuid=self.job_uuid, status=JobStatus.SCHEDULED).save()
+        poller = JobStatusPoller()
+
+        with patch.object(TrainService, 'get_latest_job_status_from_hq', side_effect=Exception("HQ is down")):
+            assert poller.poll_once() == 60
+            assert poller.poll_once() == 120
+
+    def test_get_jobs_does_not_call_hq(self):
+        Job(uuid=self.job_uuid, status=JobStatus.SCHEDULED).save()
+
+        with patch.object(TrainService, 'get_latest_job_status_from_hq') as mock_get_latest_job_status_from_hq:
+            assert len(TrainService.get_jobs()) == 1
+            mock_get_latest_job_status_from_hq.assert_not_called()
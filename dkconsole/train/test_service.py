@@ -6,9 +6,9 @@ import pytest
 from unittest import skip
 from unittest.mock import patch, ANY
 from .models import Job, JobStatus
+from .poller import PollLock
 from datetime import timedelta
 from django.utils import timezone
-import time
 import uuid
 
 
@@ -33,7 +33,7 @@ class TestTrainService(TestCase):
     def test_submit_job(self):
         with patch('dkconsole.train.services.TrainService.create_job') as mock_create_job:
             with patch('dkconsole.data.services.TubService.generate_tub_archive', return_value=self.tub_archive_path) as mock_generate_tub_archive:
-                with patch('requests.post') as mock_post:
+                with patch('dkconsole.train.services.hq_client.post') as mock_post:
                     # type(mock_post.return_value).status_code =
                     # PropertyMock(return_value=200)
                     mock_post.return_value.status_code = 200
@@ -68,41 +68,66 @@ class TestTrainService(TestCase):
         # exception case, uuid is none
         Job(uuid=None, status=JobStatus.SCHEDULED).save()
 
-        with patch('dkconsole.train.services.TrainService.get_latest_job_status_from_hq') as mock_get_latest_job_status_from_hq:
-            with patch('dkconsole.train.services.TrainService.download_file') as mock_download_file:
-                mock_return_value = [{"uuid": uuid, "status": JobStatus.COMPLETED, "model_url": "some-url", "model_accuracy_url": "some-url"} for uuid in job_uuids]
+        with patch.object(TrainService, 'get_latest_job_status_from_hq') as mock_get_latest_job_status_from_hq:
+            with patch.object(TrainService, 'download_model') as mock_download_model:
+                mock_return_value = [{"uuid": uuid, "status": JobStatus.COMPLETED, "model_url": "some-url",
+                                      "model_accuracy_url": "some-url"} for uuid in job_uuids]
                 mock_get_latest_job_status_from_hq.return_value = mock_return_value
 
                 TrainService.refresh_all_job_status()
                 mock_get_latest_job_status_from_hq.assert_called_once_with(job_uuids)
-                assert mock_download_file.call_count == 2
+                mock_download_model.assert_called_once()
+                assert str(mock_download_model.call_args[0][0].uuid) == job_uuids[0]
 
                 mock_get_latest_job_status_from_hq.return_value = []
                 TrainService.refresh_all_job_status()
-                assert mock_download_file.call_count == 2
+                mock_download_model.assert_called_once()
 
         jobs = Job.objects.filter(uuid__in=job_uuids)
         for job in jobs:
             assert job.status == JobStatus.COMPLETED
 
-    def test_refresh_job_status_lock(self):
-        TrainService.refresh_lock = True
-
-        with patch('dkconsole.train.services.TrainService.get_latest_job_status_from_hq') as mock_get_latest_job_status_from_hq:
-            TrainService.refresh_all_job_status()
-            mock_get_latest_job_status_from_hq.assert_not_called() # when refresh is locked, do not send request again
-
-        TrainService.refresh_lock = False
+    def test_refresh_job_status_queries(self):
+        job_uuids = [str(uuid.uuid4()) for i in range(0, 50)]
+        for job_uuid in job_uuids:
+            Job(uuid=job_uuid, status=JobStatus.SCHEDULED).save()
+        for i in range(0, 50):
+            Job(uuid=str(uuid.uuid4()), status=JobStatus.COMPLETED).save()
+
+        with patch.object(TrainService, 'get_latest_job_status_from_hq') as mock_get_latest_job_status_from_hq:
+            with patch.object(TrainService, 'download_model') as mock_download_model:
+                mock_get_latest_job_status_from_hq.return_value = \
+                    [{"uuid": job_uuid, "status": JobStatus.TRAINING} for job_uuid in job_uuids[:10]] + \
+                    [{"uuid": job_uuid, "status": JobStatus.COMPLETED, "model_url": "some-url"}
+                     for job_uuid in job_uuids[10:20]] + \
+                    [{"uuid": job_uuid, "status": JobStatus.SCHEDULED} for job_uuid in job_uuids[20:]]
+
+                # one select and one bulk update, whatever the number of jobs
+                with self.assertNumQueries(2):
+                    assert TrainService.refresh_all_job_status() == 20
+
+                mock_get_latest_job_status_from_hq.assert_called_once()
+                assert sorted(mock_get_latest_job_status_from_hq.call_args[0][0]) == sorted(job_uuids)
+                assert mock_download_model.call_count == 10
+
+        assert Job.objects.filter(status=JobStatus.TRAINING).count() == 10
+        assert Job.objects.filter(model_url="some-url").count() == 10
+
+    def test_refresh_job_status_without_outstanding_jobs(self):
+        Job(uuid=None, status=JobStatus.SCHEDULED).save()
 
-    def test_download_file(self):
-        url = "https://www.google.com/robots.txt"
-        target_path = "some_download_file_for_test.txt"
-        TrainService.download_file(url, target_path)
+        with patch.object(TrainService, 'get_latest_job_status_from_hq') as mock_get_latest_job_status_from_hq:
+            assert TrainService.refresh_all_job_status() == 0
+            mock_get_latest_job_status_from_hq.assert_not_called()
 
-        time.sleep(1)
+    def test_refresh_job_status_lock(self):
+        Job(uuid="19460b57-27fa-4e7d-8a79-9434af0f9629", status=JobStatus.SCHEDULED).save()
 
-        my_file = Path(target_path)
-        assert my_file.is_file() is True
+        with PollLock() as acquired:
+            assert acquired
+            with patch('dkconsole.train.services.TrainService.get_latest_job_status_from_hq') as mock_get_latest_job_status_from_hq:
+                TrainService.refresh_all_job_status()
+                mock_get_latest_job_status_from_hq.assert_not_called() # when refresh is locked, do not send request again
 
     def test_delete_jobs(self):
         job_ids = []
@@ -9,6 +9,9 @@ import tarfile
 import re
 from unittest.mock import patch
 from dkconsole.train.models import Job
+from django.test import override_settings
+import shutil
+import tempfile
 
 # Create your tests here.
 
@@ -82,3 +85,39 @@ class TestTrainView(TestCase):
         assert response.status_code == status.HTTP_200_OK
         assert len(response.data) == 1
         assert response.data[0]["status"] == "Some status"
+
+    def test_index_artifacts(self):
+        model_dir = Path(tempfile.mkdtemp())
+        movie_dir = Path(tempfile.mkdtemp())
+        jobs = [Job(status="COMPLETED", model_url="some-url") for i in range(0, 5)]
+        for job in jobs:
+            job.save()
+        (model_dir / f"job_{jobs[0].id}.h5").write_bytes(b"model")
+        (movie_dir / f"job_{jobs[0].id}.mp4").write_bytes(b"movie")
+
+        try:
+            with override_settings(MODEL_DIR=str(model_dir), MOVIE_DIR=str(movie_dir)):
+                # one query for the jobs, whatever their number
+                with self.assertNumQueries(1):
+                    response = Client().get(reverse('train:index'))
+
+            assert response.status_code == status.HTTP_200_OK
+            assert len(response.data) == 5
+            for data in response.data:
+                downloaded = data["id"] == jobs[0].id
+                assert data["model_downloaded"] is downloaded
+                assert data["model_movie_path"] == (f"{movie_dir}/job_{jobs[0].id}.mp4" if downloaded else None)
+                assert data["model_path"] == f"{model_dir}/job_{data['id']}.h5"
+        finally:
+            shutil.rmtree(model_dir)
+            shutil.rmtree(movie_dir)
+
+    def test_index_paginated(self):
+        for i in range(0, 5):
+            Job(status="SCHEDULED").save()
+
+        response = Client().get(reverse('train:index'), {"page": 2, "page_size": 2})
+
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data["count"] == 5
+        assert len(response.data["results"]) == 2
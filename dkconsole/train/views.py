@@ -2,6 +2,7 @@ import logging
 
 from rest_framework import status
 from rest_framework.decorators import api_view
+from rest_framework.pagination import PageNumberPagination
 from rest_framework.response import Response
 
 from dkconsole.train.models import Job
@@ -16,11 +17,28 @@ logger = logging.getLogger(__name__)
 # Create your views here.
 
 
+class JobPagination(PageNumberPagination):
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+
 @api_view(['GET'])
 def index(request):
+    """
+    http://localhost:8000/train/?page=1&page_size=10
+
+    The response is only paginated when page or page_size is given, otherwise all jobs are returned as a list
+    """
     jobs = TrainService.get_jobs()
+    context = TrainService.get_artifact_names()
+
+    if 'page' in request.query_params or 'page_size' in request.query_params:
+        paginator = JobPagination()
+        page = paginator.paginate_queryset(jobs, request)
+        serializer = JobSerializer(page, many=True, context=context)
+        return paginator.get_paginated_response(serializer.data)
 
-    serializer = JobSerializer(jobs, many=True)
+    serializer = JobSerializer(jobs, many=True, context=context)
     return Response(serializer.data)
 
 
@@ -64,8 +82,8 @@ def download_model(request):
     print(request.data)
     job_id = request.data['job_id']
     job = Job.objects.get(pk=job_id)
-    TrainService.download_model(job)
-    return Response({"success": False})
+    queued = TrainService.download_model(job)
+    return Response({"success": True, "queued": queued})
 
 
 @api_view(['POST'])
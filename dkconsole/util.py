@@ -1,61 +1,193 @@
 import os
 import re
 import mimetypes
-from wsgiref.util import FileWrapper
-from django.http.response import StreamingHttpResponse
+import uuid
+from urllib.parse import quote
 
+from django.conf import settings
+from django.http.response import FileResponse, HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
 
-class RangeFileWrapper(object):
-    def __init__(self, filelike, blksize=8192, offset=0, length=None):
-        self.filelike = filelike
-        self.filelike.seek(offset, os.SEEK_SET)
+# Tub images are never rewritten once recorded
+IMMUTABLE_MAX_AGE = 60 * 60 * 24 * 365
+
+
+# More ranges than this in one request are ignored and the whole file is sent, as a guard against abuse
+MAX_RANGES = 16
+# Block size when the file has to go through Python, without wsgi.file_wrapper / sendfile or for multi-range
+STREAM_BLOCK_SIZE = 256 * 1024
+
+
+class FileRange(object):
+    """
+    length bytes of an open file from offset.
+
+    FileResponse hands it to wsgi.file_wrapper: gunicorn then sends it with os.sendfile from the current position of
+    fileno() for Content-Length bytes, without copying it through Python. Elsewhere (runserver, tests) it is read
+    with read(), which stops at the end of the range.
+    """
+
+    def __init__(self, file, offset, length):
+        self.file = file
+        self.file.seek(offset, os.SEEK_SET)
         self.remaining = length
-        self.blksize = blksize
+        self.name = getattr(file, 'name', None)
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def read(self, size=-1):
+        if size is None or size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
 
     def close(self):
-        if hasattr(self.filelike, 'close'):
-            self.filelike.close()
-
-    def __iter__(self):
-        return self
-
-    def __next__(self):
-        if self.remaining is None:
-            # If remaining is None, we're reading the entire file.
-            data = self.filelike.read(self.blksize)
-            if data:
-                return data
-            raise StopIteration()
+        self.file.close()
+
+
+def parse_range_header(header, size):
+    """
+    [(first byte, last byte), ...] of a Range header for a file of size bytes.
+
+    None when the whole file is to be sent: no or unknown header, or more than MAX_RANGES ranges. [] when no range
+    is satisfiable, which is answered with 416: every range starts past the end of the file or ends before it starts.
+    Suffix ranges (bytes=-500) are supported and the last byte is clamped to the end of the file.
+    """
+    match = re.fullmatch(r'\s*bytes\s*=\s*(.+)', header or '', re.I)
+    if not match:
+        return None
+    specs = [spec.strip() for spec in match.group(1).split(',') if spec.strip()]
+    if not specs or len(specs) > MAX_RANGES:
+        return None
+
+    ranges = []
+    for spec in specs:
+        spec_match = re.fullmatch(r'(\d*)\s*-\s*(\d*)', spec)
+        if not spec_match or spec_match.groups() == ('', ''):
+            return None
+        first, last = spec_match.groups()
+        if first == '':
+            # the last n bytes
+            length = int(last)
+            if length == 0:
+                continue
+            first, last = max(0, size - length), size - 1
         else:
-            if self.remaining <= 0:
-                raise StopIteration()
-            data = self.filelike.read(min(self.remaining, self.blksize))
-            if not data:
-                raise StopIteration()
-            self.remaining -= len(data)
-            return data
+            first = int(first)
+            last = min(int(last), size - 1) if last else size - 1
+        if first > last or first >= size:
+            continue
+        ranges.append((first, last))
+    return ranges
+
+
+def sendfile_response(path, content_type):
+    """
+    Empty response telling the front proxy to send path itself, with X-Accel-Redirect (nginx) or X-Sendfile
+    (Apache, lighttpd) as SENDFILE_BACKEND says. The proxy handles Range. None when there is no proxy or path is
+    not under SENDFILE_ROOT.
+    """
+    backend = settings.SENDFILE_BACKEND
+    if not backend:
+        return None
+
+    path = os.path.abspath(path)
+    relative_path = os.path.relpath(path, os.path.abspath(settings.SENDFILE_ROOT))
+    if relative_path.startswith(os.pardir):
+        return None
+
+    resp = HttpResponse(content_type=content_type)
+    if backend == 'x-accel-redirect':
+        resp['X-Accel-Redirect'] = settings.SENDFILE_URL.rstrip('/') + '/' + quote(relative_path)
+    elif backend == 'x-sendfile':
+        resp['X-Sendfile'] = path
+    else:
+        raise ValueError(f"Unknown SENDFILE_BACKEND {backend}")
+    return resp
+
+
+def iter_ranges(path, ranges, size, content_type, boundary):
+    """
+    multipart/byteranges body of the ranges of path
+    """
+    with open(path, 'rb') as f:
+        for first, last in ranges:
+            yield (f"--{boundary}\r\nContent-Type: {content_type}\r\n"
+                   f"Content-Range: bytes {first}-{last}/{size}\r\n\r\n").encode()
+            position = first
+            while position <= last:
+                data = os.pread(f.fileno(), min(STREAM_BLOCK_SIZE, last - position + 1), position)
+                if not data:
+                    break
+                position += len(data)
+                yield data
+            yield b"\r\n"
+        yield f"--{boundary}--\r\n".encode()
 
 
 def video_stream(request, path):
-    range_header = request.META.get('HTTP_RANGE', '').strip()
-    range_re = re.compile(r'bytes\s*=\s*(\d+)\s*-\s*(\d*)', re.I)
-    range_match = range_re.match(range_header)
-    size = os.path.getsize(path)
-    content_type, encoding = mimetypes.guess_type(path)
+    """
+    Send the file at path, answering Range requests (single or multiple ranges, 416 when unsatisfiable).
+
+    The file is offloaded to the front proxy when SENDFILE_BACKEND is set. Otherwise a whole file or a single
+    range goes through wsgi.file_wrapper, which gunicorn sends with os.sendfile. Only multi-range responses are
+    copied through Python.
+    """
+    content_type, encoding = mimetypes.guess_type(str(path))
     content_type = content_type or 'application/octet-stream'
-    if range_match:
-        first_byte, last_byte = range_match.groups()
-        first_byte = int(first_byte) if first_byte else 0
-        last_byte = int(last_byte) if last_byte else size - 1
-        if last_byte >= size:
-            last_byte = size - 1
-        length = last_byte - first_byte + 1
-        resp = StreamingHttpResponse(RangeFileWrapper(open(path, 'rb'), offset=first_byte, length=length), status=206, content_type=content_type)
-        resp['Content-Length'] = str(length)
-        resp['Content-Range'] = 'bytes %s-%s/%s' % (first_byte, last_byte, size)
-    else:
-        resp = StreamingHttpResponse(FileWrapper(open(path, 'rb')), content_type=content_type)
+
+    resp = sendfile_response(path, content_type)
+    if resp is not None:
+        return resp
+
+    size = os.path.getsize(path)
+    ranges = parse_range_header(request.META.get('HTTP_RANGE'), size)
+
+    if ranges is None:
+        resp = FileResponse(open(path, 'rb'), content_type=content_type)
         resp['Content-Length'] = str(size)
+    elif not ranges:
+        resp = HttpResponse(status=416)
+        resp['Content-Range'] = f'bytes */{size}'
+    elif len(ranges) == 1:
+        first, last = ranges[0]
+        resp = FileResponse(FileRange(open(path, 'rb'), first, last - first + 1), status=206,
+                            content_type=content_type)
+        resp['Content-Length'] = str(last - first + 1)
+        resp['Content-Range'] = f'bytes {first}-{last}/{size}'
+    else:
+        boundary = uuid.uuid4().hex
+        resp = StreamingHttpResponse(iter_ranges(path, ranges, size, content_type, boundary), status=206,
+                                     content_type=f'multipart/byteranges; boundary={boundary}')
+    resp.block_size = STREAM_BLOCK_SIZE
     resp['Accept-Ranges'] = 'bytes'
 
     return resp
+
+
+def file_response(request, path, max_age=0, immutable=False):
+    """
+    FileResponse with ETag / Last-Modified taken from the file stat, answering 304 to If-None-Match and
+    If-Modified-Since when the file did not change.
+
+    max_age=0 makes clients revalidate on every use, which is still a bodyless round-trip when unchanged.
+    """
+    stat = os.stat(path)
+    etag = quote_etag(f"{stat.st_mtime_ns:x}-{stat.st_size:x}")
+    last_modified = int(stat.st_mtime)
+
+    resp = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if resp is None:
+        resp = FileResponse(open(path, 'rb'))
+
+    resp['ETag'] = etag
+    resp['Last-Modified'] = http_date(last_modified)
+    if immutable:
+        patch_cache_control(resp, public=True, max_age=max_age, immutable=True)
+    else:
+        patch_cache_control(resp, no_cache=True, max_age=max_age)
+
+    return resp
@@ -15,5 +15,11 @@ os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings.production')
 
 application = get_wsgi_application()
 
+from django.conf import settings  # noqa: E402 settings are only usable once the application is set up
+
+if settings.TRAIN_POLLER_ENABLED:
+    from dkconsole.train.poller import job_status_poller  # noqa: E402
+    job_status_poller.start()
+
 
 